@@ -0,0 +1,365 @@
+"_______Benchmarks trek commands against generated repositories_______"
+
+# python benchmark.py run --files 2000 --depth 30 --branches 8 --output before.json
+# python benchmark.py run ... --output after.json
+# python benchmark.py compare before.json after.json
+# python benchmark.py hash --output hashes.json
+#
+# every measured command runs in its own interpreter, so wall time, peak RSS and the
+# number of files opened belong to that command alone
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import tempfile
+import argparse
+import statistics
+import subprocess
+import contextlib
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MAIN = os.path.join(HERE, "main.py")
+
+# "size:weight" pairs; file sizes are drawn from them
+DEFAULT_SIZES = "512:60,4096:30,65536:9,1048576:1"
+# fraction of files touched by each generated commit
+CHANGE_RATE = 0.02
+# how many files sit in one generated directory
+FILES_PER_DIR = 50
+LINE_WIDTH = 64
+# object sizes the hash benchmark uses, from small trees and commits up to file chunks
+HASH_SIZES = "64,4096,65536,1048576"
+# bytes hashed per algorithm and size in one timing round
+HASH_BYTES = 64 * 1024 * 1024
+
+
+def parse_sizes(spec):
+    sizes = []
+    for part in spec.split(","):
+        size, _, weight = part.partition(":")
+        sizes.append((int(size), float(weight or 1)))
+    return sizes
+
+
+def random_text(rng, size):
+    # hex lines diff and merge like source code, and are cheap to generate
+    data = rng.randbytes(max(size // 2, 1)).hex()
+    return "\n".join(
+        data[i : i + LINE_WIDTH] for i in range(0, len(data), LINE_WIDTH)
+    ) + "\n"
+
+
+def edit_file(rng, path):
+    with open(path, "r") as f:
+        lines = f.read().split("\n")
+    line = rng.randrange(len(lines))
+    lines[line] = rng.randbytes(LINE_WIDTH // 2).hex()
+    with open(path, "w") as f:
+        f.write("\n".join(lines))
+
+
+@contextlib.contextmanager
+def quiet():
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def generate_repo(root, config):
+    # builds the repository in-process; none of this is measured
+    sys.path.insert(0, HERE)
+    import main
+
+    rng = random.Random(config["seed"])
+    sizes, weights = zip(*parse_sizes(config["sizes"]))
+    cwd = os.getcwd()
+    os.chdir(root)
+    try:
+        with quiet():
+            main.init(config["object_format"])
+            paths = []
+            for i in range(config["files"]):
+                directory = f"dir{i // FILES_PER_DIR:04d}"
+                os.makedirs(directory, exist_ok=True)
+                path = f"{directory}/file{i:06d}.txt"
+                with open(path, "w") as f:
+                    f.write(random_text(rng, rng.choices(sizes, weights)[0]))
+                paths.append(path)
+            main.add(["."])
+            main.commit("initial")
+
+            changes = max(1, int(len(paths) * CHANGE_RATE))
+            branch_every = max(1, config["depth"] // max(config["branches"], 1))
+            for step in range(1, config["depth"]):
+                for path in rng.sample(paths, changes):
+                    edit_file(rng, path)
+                main.add(["."])
+                main.commit(f"change {step}")
+                if config["branches"] and step % branch_every == 0:
+                    branches = main.repository().list_refs("refs/heads/")
+                    if len(branches) <= config["branches"]:
+                        main.repository().write_ref(
+                            f"refs/heads/branch{step:04d}", main.get_current_commit()
+                        )
+
+            # a side branch that touches other files than master, ready to merge
+            main.branch("bench-merge")
+            for path in rng.sample(paths, changes):
+                edit_file(rng, path)
+            main.add(["."])
+            main.commit("side change")
+            main.checkout_branch("master")
+            for path in rng.sample(paths, changes):
+                edit_file(rng, path)
+            main.add(["."])
+            main.commit("main change")
+            return paths, rng
+    finally:
+        os.chdir(cwd)
+
+
+def measure(root, argv):
+    # runs one trek command in a child and collects its resource usage
+    stats_fd, stats_path = tempfile.mkstemp(prefix="trek-bench-")
+    os.close(stats_fd)
+    env = dict(os.environ, TREK_BENCH_STATS=stats_path)
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "child", *argv],
+        cwd=root,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    _, status, usage = os.wait4(process.pid, 0)
+    wall = time.perf_counter() - start
+    stderr = process.stderr.read().decode("utf-8", errors="replace")
+    process.stderr.close()
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    with open(stats_path, "r") as f:
+        content = f.read()
+    os.remove(stats_path)
+    child = json.loads(content) if content else {}
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    max_rss = usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return {
+        "wall_s": round(wall, 6),
+        "max_rss_bytes": max_rss,
+        "opens": child.get("opens"),
+        "exit": process.returncode,
+        "error": stderr.strip()[-500:] or None,
+    }
+
+
+def run_child(argv):
+    # counts every file the command opens, then hands over to trek's own entry point
+    opens = [0]
+
+    def audit(event, args):
+        if event == "open":
+            opens[0] += 1
+
+    sys.addaudithook(audit)
+    sys.path.insert(0, HERE)
+    import main
+
+    try:
+        code = main.main(argv)
+    finally:
+        stats_path = os.environ.get("TREK_BENCH_STATS")
+        if stats_path:
+            # os.open fires the audit event as well, so the count is taken before it
+            report = json.dumps({"opens": opens[0]}).encode("utf-8")
+            fd = os.open(stats_path, os.O_WRONLY | os.O_TRUNC)
+            os.write(fd, report)
+            os.close(fd)
+    return code or 0
+
+
+def benchmark(config):
+    root = tempfile.mkdtemp(prefix="trek-bench-")
+    try:
+        started = time.perf_counter()
+        paths, rng = generate_repo(root, config)
+        setup = time.perf_counter() - started
+
+        def touch():
+            cwd = os.getcwd()
+            os.chdir(root)
+            try:
+                for path in rng.sample(paths, max(1, int(len(paths) * CHANGE_RATE))):
+                    edit_file(rng, path)
+            finally:
+                os.chdir(cwd)
+
+        results = {}
+
+        # read-only commands can be repeated on the same tree
+        for name, argv in (
+            ("status", ["status"]),
+            ("log", ["log", "--oneline"]),
+            ("log-stat", ["log", "-n", "20", "--stat"]),
+            ("log-path", ["log", "--oneline", "--", "dir0000/file000000.txt"]),
+            ("branch", ["branch"]),
+            ("diff", ["diff", "master", "bench-merge", "--stat"]),
+        ):
+            samples = [measure(root, argv) for _ in range(config["repeat"])]
+            results[name] = summarize(samples)
+
+        # commands that change the repository run once, in the order a user would
+        touch()
+        results["add"] = summarize([measure(root, ["add", "."])])
+        results["commit"] = summarize([measure(root, ["commit", "-m", "bench"])])
+        results["checkout"] = summarize([measure(root, ["checkout", "bench-merge"])])
+        results["checkout-back"] = summarize([measure(root, ["checkout", "master"])])
+        results["merge"] = summarize([measure(root, ["merge", "bench-merge"])])
+        results["reset"] = summarize([measure(root, ["reset", "bench-merge"])])
+
+        return {
+            "config": config,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "setup_s": round(setup, 3),
+            "results": results,
+        }
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def hash_throughput(sizes, total, repeat):
+    # MB/s of every object format; each buffer gets a fresh hasher, as each object does
+    sys.path.insert(0, HERE)
+    import main
+
+    results = {}
+    for size in sizes:
+        data = os.urandom(size)
+        rounds = max(1, total // size)
+        for name, new_hasher in main.OBJECT_FORMATS.items():
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                for _ in range(rounds):
+                    hasher = new_hasher()
+                    hasher.update(data)
+                    hasher.digest()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            results.setdefault(name, {})[str(size)] = round(rounds * size / best / 2**20, 1)
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "bytes_per_round": total,
+        "mb_per_s": results,
+    }
+
+
+def print_hash_table(report):
+    sizes = next(iter(report["mb_per_s"].values()))
+    print(f"{'MB/s':<10}" + "".join(f"{size:>12}" for size in sizes))
+    for name, speeds in report["mb_per_s"].items():
+        print(f"{name:<10}" + "".join(f"{speed:>12.1f}" for speed in speeds.values()))
+
+
+def summarize(samples):
+    # the median sample stands for the command; the raw timings are kept alongside
+    walls = [sample["wall_s"] for sample in samples]
+    middle = sorted(samples, key=lambda sample: sample["wall_s"])[len(samples) // 2]
+    return dict(middle, wall_s=statistics.median(walls), samples=walls)
+
+
+def compare(old_path, new_path, threshold):
+    with open(old_path, "r") as f:
+        old = json.load(f)
+    with open(new_path, "r") as f:
+        new = json.load(f)
+
+    if old["config"] != new["config"]:
+        print("warning: the two runs used different repository configs")
+
+    regressions = 0
+    print(f"{'command':<15}{'old s':>10}{'new s':>10}{'change':>9}{'old MB':>9}{'new MB':>9}{'opens':>14}")
+    for name, result in new["results"].items():
+        before = old["results"].get(name)
+        if before is None:
+            continue
+        change = (result["wall_s"] - before["wall_s"]) / before["wall_s"] * 100 if before["wall_s"] else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(
+            f"{name:<15}{before['wall_s']:>10.3f}{result['wall_s']:>10.3f}{change:>8.1f}%"
+            f"{before['max_rss_bytes'] / 2**20:>9.1f}{result['max_rss_bytes'] / 2**20:>9.1f}"
+            f"{str(before['opens']) + '->' + str(result['opens']):>14}{flag}"
+        )
+    return 1 if regressions else 0
+
+
+def main(argv):
+    if argv and argv[0] == "child":
+        return run_child(argv[1:])
+
+    parser = argparse.ArgumentParser(description="Benchmark trek commands on generated repositories.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="generate a repository and time each command")
+    run_parser.add_argument("--files", type=int, default=1000)
+    run_parser.add_argument("--sizes", default=DEFAULT_SIZES, help="size:weight pairs, e.g. 512:60,65536:40")
+    run_parser.add_argument("--depth", type=int, default=20, help="commits of history")
+    run_parser.add_argument("--branches", type=int, default=5)
+    run_parser.add_argument("--repeat", type=int, default=3, help="runs of each read-only command")
+    run_parser.add_argument("--seed", type=int, default=1)
+    run_parser.add_argument("--object-format", default="sha1", help="hash the repository is created with")
+    run_parser.add_argument("--output", help="JSON file for the results (stdout without one)")
+
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=10.0, help="allowed slowdown in percent")
+
+    hash_parser = commands.add_parser("hash", help="compare hashing throughput of the object formats")
+    hash_parser.add_argument("--sizes", default=HASH_SIZES, help="comma separated object sizes in bytes")
+    hash_parser.add_argument("--bytes", type=int, default=HASH_BYTES, help="bytes hashed per round")
+    hash_parser.add_argument("--repeat", type=int, default=3, help="rounds per measurement, the best one counts")
+    hash_parser.add_argument("--output", help="JSON file for the results")
+
+    args = parser.parse_args(argv)
+    if args.command == "compare":
+        return compare(args.old, args.new, args.threshold)
+
+    if args.command == "hash":
+        sizes = [int(size) for size in args.sizes.split(",")]
+        report = hash_throughput(sizes, args.bytes, args.repeat)
+        print_hash_table(report)
+        if args.output:
+            with open(args.output, "w") as f:
+                f.write(json.dumps(report, indent=2) + "\n")
+        return 0
+
+    config = {
+        "files": args.files,
+        "sizes": args.sizes,
+        "depth": args.depth,
+        "branches": args.branches,
+        "repeat": args.repeat,
+        "seed": args.seed,
+        "object_format": args.object_format,
+    }
+    report = json.dumps(benchmark(config), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
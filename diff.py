@@ -0,0 +1,261 @@
+"_______Line diff engine used by log, diff and merge_______"
+
+
+# past this many edits in one region the region is reported as a plain replacement
+MAX_EDIT_COST = 2000
+# content is treated as binary when a NUL byte shows up this early
+BINARY_SNIFF_SIZE = 8000
+
+
+def is_binary(content):
+    return b"\0" in content[:BINARY_SNIFF_SIZE]
+
+
+def intern_lines(a_lines, b_lines):
+    # equal lines map to equal ints, so comparisons below never touch the strings
+    ids = {}
+    a = [ids.setdefault(line, len(ids)) for line in a_lines]
+    b = [ids.setdefault(line, len(ids)) for line in b_lines]
+    return a, b
+
+
+def _bisect(a, b, max_cost):
+    # Myers' middle snake, searched from both ends at once in linear space
+    n, m = len(a), len(b)
+    max_d = (n + m + 1) // 2
+    v_offset = max_d
+    v_length = 2 * max_d + 2
+    v1 = [-1] * v_length
+    v2 = [-1] * v_length
+    v1[v_offset + 1] = 0
+    v2[v_offset + 1] = 0
+    delta = n - m
+    front = delta % 2 != 0
+    k1start = k1end = k2start = k2end = 0
+
+    for d in range(min(max_d, max_cost)):
+        for k1 in range(-d + k1start, d + 1 - k1end, 2):
+            k1_offset = v_offset + k1
+            if k1 == -d or (k1 != d and v1[k1_offset - 1] < v1[k1_offset + 1]):
+                x1 = v1[k1_offset + 1]
+            else:
+                x1 = v1[k1_offset - 1] + 1
+            y1 = x1 - k1
+            while x1 < n and y1 < m and a[x1] == b[y1]:
+                x1 += 1
+                y1 += 1
+            v1[k1_offset] = x1
+            if x1 > n:
+                k1end += 2
+            elif y1 > m:
+                k1start += 2
+            elif front:
+                k2_offset = v_offset + delta - k1
+                if 0 <= k2_offset < v_length and v2[k2_offset] != -1:
+                    if x1 >= n - v2[k2_offset]:
+                        return x1, y1
+
+        for k2 in range(-d + k2start, d + 1 - k2end, 2):
+            k2_offset = v_offset + k2
+            if k2 == -d or (k2 != d and v2[k2_offset - 1] < v2[k2_offset + 1]):
+                x2 = v2[k2_offset + 1]
+            else:
+                x2 = v2[k2_offset - 1] + 1
+            y2 = x2 - k2
+            while x2 < n and y2 < m and a[n - x2 - 1] == b[m - y2 - 1]:
+                x2 += 1
+                y2 += 1
+            v2[k2_offset] = x2
+            if x2 > n:
+                k2end += 2
+            elif y2 > m:
+                k2start += 2
+            elif not front:
+                k1_offset = v_offset + delta - k2
+                if 0 <= k1_offset < v_length and v1[k1_offset] != -1:
+                    x1 = v1[k1_offset]
+                    y1 = v_offset + x1 - k1_offset
+                    if x1 >= n - x2:
+                        return x1, y1
+
+    # either nothing in common or too expensive to find out
+    return None
+
+
+def _diff(a, b, a_start, b_start, ops, max_cost):
+    prefix = 0
+    limit = min(len(a), len(b))
+    while prefix < limit and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    limit -= prefix
+    while suffix < limit and a[-1 - suffix] == b[-1 - suffix]:
+        suffix += 1
+
+    if prefix:
+        ops.append(("equal", a_start, a_start + prefix, b_start, b_start + prefix))
+
+    a_mid = a[prefix : len(a) - suffix]
+    b_mid = b[prefix : len(b) - suffix]
+    a_pos = a_start + prefix
+    b_pos = b_start + prefix
+
+    if a_mid or b_mid:
+        split = _bisect(a_mid, b_mid, max_cost) if a_mid and b_mid else None
+        if split is None:
+            ops.append(("replace", a_pos, a_pos + len(a_mid), b_pos, b_pos + len(b_mid)))
+        else:
+            x, y = split
+            _diff(a_mid[:x], b_mid[:y], a_pos, b_pos, ops, max_cost)
+            _diff(a_mid[x:], b_mid[y:], a_pos + x, b_pos + y, ops, max_cost)
+
+    if suffix:
+        a_end = a_start + len(a)
+        b_end = b_start + len(b)
+        ops.append(("equal", a_end - suffix, a_end, b_end - suffix, b_end))
+
+
+def diff_lines(a_lines, b_lines, max_cost=MAX_EDIT_COST):
+    # returns difflib-style opcodes: (tag, a_start, a_end, b_start, b_end)
+    a, b = intern_lines(a_lines, b_lines)
+    ops = []
+    _diff(a, b, 0, 0, ops, max_cost)
+
+    # merge neighbouring runs so each change is one opcode with the right tag
+    opcodes = []
+    for tag, i1, i2, j1, j2 in ops:
+        if i1 == i2 and j1 == j2:
+            continue
+        changed = tag != "equal"
+        if opcodes and (opcodes[-1][0] != "equal") == changed:
+            _, i1, _, j1, _ = opcodes.pop()
+        if changed:
+            tag = "replace" if i1 < i2 and j1 < j2 else "delete" if i1 < i2 else "insert"
+        opcodes.append((tag, i1, i2, j1, j2))
+    return opcodes
+
+
+def count_changes(opcodes):
+    added = removed = 0
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag != "equal":
+            removed += i2 - i1
+            added += j2 - j1
+    return added, removed
+
+
+def group_opcodes(opcodes, context=3):
+    # split into hunks that keep at most `context` equal lines around each change
+    if not opcodes or all(tag == "equal" for tag, *_ in opcodes):
+        return []
+
+    codes = list(opcodes)
+    if codes[0][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = tag, max(i1, i2 - context), i2, max(j1, j2 - context), j2
+    if codes[-1][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)
+
+    groups = []
+    group = []
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == "equal" and i2 - i1 > 2 * context:
+            group.append((tag, i1, i1 + context, j1, j1 + context))
+            groups.append(group)
+            group = []
+            i1, j1 = i2 - context, j2 - context
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == "equal"):
+        groups.append(group)
+    return groups
+
+
+def _hunk_range(start, end):
+    length = end - start
+    if length == 1:
+        return f"{start + 1}"
+    if not length:
+        start -= 1
+    return f"{start + 1},{length}"
+
+
+def unified_diff(a_lines, b_lines, opcodes, fromfile, tofile, context=3):
+    groups = group_opcodes(opcodes, context)
+    if not groups:
+        return
+
+    yield f"--- {fromfile}"
+    yield f"+++ {tofile}"
+    for group in groups:
+        first, last = group[0], group[-1]
+        yield (
+            f"@@ -{_hunk_range(first[1], last[2])} +{_hunk_range(first[3], last[4])} @@"
+        )
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                for line in a_lines[i1:i2]:
+                    yield " " + line
+                continue
+            for line in a_lines[i1:i2]:
+                yield "-" + line
+            for line in b_lines[j1:j2]:
+                yield "+" + line
+
+
+def merge3(base, ours, theirs, ours_label="ours", theirs_label="theirs"):
+    # returns the merged lines and how many regions were left in conflict
+    ours_hunks = [op for op in diff_lines(base, ours) if op[0] != "equal"]
+    theirs_hunks = [op for op in diff_lines(base, theirs) if op[0] != "equal"]
+
+    result = []
+    conflicts = 0
+    pos = oi = ti = 0
+
+    def side_lines(side, hunks, first, last, start, end):
+        # lines of one side covering base[start:end]; outside its hunks it equals the base
+        if first == last:
+            return base[start:end]
+        low, high = hunks[first], hunks[last - 1]
+        return side[low[3] - (low[1] - start) : high[4] + (end - high[2])]
+
+    while oi < len(ours_hunks) or ti < len(theirs_hunks):
+        if ti == len(theirs_hunks) or (
+            oi < len(ours_hunks) and ours_hunks[oi][1] <= theirs_hunks[ti][1]
+        ):
+            start = ours_hunks[oi][1]
+        else:
+            start = theirs_hunks[ti][1]
+
+        # grow the region while a change on either side touches it
+        end = start
+        o_first, t_first = oi, ti
+        while True:
+            if oi < len(ours_hunks) and ours_hunks[oi][1] <= end:
+                end = max(end, ours_hunks[oi][2])
+                oi += 1
+            elif ti < len(theirs_hunks) and theirs_hunks[ti][1] <= end:
+                end = max(end, theirs_hunks[ti][2])
+                ti += 1
+            else:
+                break
+
+        result.extend(base[pos:start])
+        ours_region = side_lines(ours, ours_hunks, o_first, oi, start, end)
+        theirs_region = side_lines(theirs, theirs_hunks, t_first, ti, start, end)
+
+        if t_first == ti:
+            result.extend(ours_region)
+        elif o_first == oi or ours_region == theirs_region:
+            result.extend(theirs_region)
+        else:
+            conflicts += 1
+            result.append(f"<<<<<<< {ours_label}")
+            result.extend(ours_region)
+            result.append("=======")
+            result.extend(theirs_region)
+            result.append(f">>>>>>> {theirs_label}")
+        pos = end
+
+    result.extend(base[pos:])
+    return result, conflicts
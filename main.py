@@ -1,9 +1,30 @@
 import os
+import re
+import glob
+import io
 import json
+import configparser
+import mmap
+import zlib
+import struct
 import hashlib
+import tempfile
+import contextlib
+import functools
+import time
+import heapq
+import itertools
+import select
+import shlex
+import sys
+import threading
+import ctypes
+import ctypes.util
+from collections import OrderedDict, namedtuple
 from datetime import datetime
-import difflib
+from concurrent.futures import ThreadPoolExecutor
 from colorama import Fore, init
+import diff as line_diff
 
 init(autoreset=True)
 
@@ -13,410 +34,3724 @@ redo_stack = []
 "_______Utility Functions_______"
 
 
-def is_ignored(file_path):
-    ignore_path = os.path.join(os.getcwd(), ".trek", ".gitignore")
+# compiled ignore matchers, keyed by ignore file and invalidated when it changes
+_ignore_cache = {}
+
+
+def glob_to_regex(pattern):
+    # gitignore-style globs: "*" and "?" stay within one path component, "**" spans many
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith("**/", i):
+            regex += "(?:.*/)?"
+            i += 3
+        elif pattern.startswith("/**", i) and i + 3 == len(pattern):
+            regex += "/.*"
+            i += 3
+        elif pattern.startswith("**", i):
+            regex += ".*"
+            i += 2
+        elif char == "*":
+            regex += "[^/]*"
+            i += 1
+        elif char == "?":
+            regex += "[^/]"
+            i += 1
+        elif char == "[" and "]" in pattern[i + 2 :]:
+            end = pattern.index("]", i + 2)
+            body = pattern[i + 1 : end]
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            regex += f"[{body.replace(chr(92), chr(92) * 2)}]"
+            i = end + 1
+        elif char == "\\" and i + 1 < len(pattern):
+            regex += re.escape(pattern[i + 1])
+            i += 2
+        else:
+            regex += re.escape(char)
+            i += 1
+    return regex
+
+
+def compile_ignore_rules(lines):
+    rules = []
+    for line in lines:
+        line = line.rstrip("\n").rstrip()
+        if not line or line.startswith("#"):
+            continue
+
+        negate = line.startswith("!")
+        if negate:
+            line = line[1:]
+        elif line.startswith("\\"):
+            line = line[1:]
+
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        if not line:
+            continue
+
+        # a slash anywhere but the end anchors the rule to the repository root
+        if "/" in line:
+            regex = glob_to_regex(line.lstrip("/"))
+        else:
+            regex = "(?:.*/)?" + glob_to_regex(line)
+        rules.append((re.compile(regex + r"\Z"), negate, dir_only))
+
+    # one combined regex answers the common "no rule matches" case in a single pass
+    combined = None
+    if rules:
+        combined = re.compile("|".join(f"(?:{rule.pattern})" for rule, _, _ in rules))
+    has_negation = any(negate for _, negate, _ in rules)
+
+    def match_path(path, is_dir=False):
+        if combined is None or not combined.match(path):
+            return False
+        if not has_negation:
+            return any(rule.match(path) for rule, _, dir_only in rules if is_dir or not dir_only)
+        # later rules override earlier ones, so the last matching rule decides
+        for rule, negate, dir_only in reversed(rules):
+            if (is_dir or not dir_only) and rule.match(path):
+                return not negate
+        return False
+
+    def ignored(path, is_dir=False, check_parents=True):
+        path = normalize_path(path)
+        if path == ".trek" or path.startswith(".trek/"):
+            return True
+        if check_parents:
+            # nothing inside an ignored directory can be re-included
+            parts = path.split("/")
+            for depth in range(1, len(parts)):
+                if match_path("/".join(parts[:depth]), is_dir=True):
+                    return True
+        return match_path(path, is_dir)
+
+    return ignored
+
+
+def get_ignore_matcher(repo_path=None):
+    repo_path = repo_path or os.path.join(os.getcwd(), ".trek")
+    ignore_path = os.path.join(repo_path, ".gitignore")
+
+    try:
+        stat = os.stat(ignore_path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        stamp = None
+
+    cached = _ignore_cache.get(ignore_path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+
+    lines = []
+    if stamp is not None:
+        with open(ignore_path, "r") as ignore_file:
+            lines = ignore_file.readlines()
+
+    matcher = compile_ignore_rules(lines)
+    _ignore_cache[ignore_path] = (stamp, matcher)
+    return matcher
+
+
+def option_value(args, i, convert=str):
+    # the value following the option args[i]; a missing or malformed one is a ValueError
+    if i + 1 >= len(args):
+        raise ValueError(f"{args[i]} needs a value")
+    try:
+        return convert(args[i + 1])
+    except ValueError:
+        raise ValueError(f"Bad value {args[i + 1]!r} for {args[i]}") from None
+
+
+def normalize_path(path):
+    return os.path.normpath(path).replace(os.sep, "/")
+
+
+def walk_files(directory, ignored=None):
+    # ignored directories are pruned here so their contents are never listed
+    for root, dirs, names in os.walk(directory):
+        root = normalize_path(root)
+        prefix = "" if root == "." else root + "/"
+        dirs[:] = sorted(
+            d
+            for d in dirs
+            if d != ".trek"
+            and (ignored is None or not ignored(prefix + d, is_dir=True, check_parents=False))
+        )
+        for name in sorted(names):
+            path = prefix + name
+            if ignored is None or not ignored(path, check_parents=False):
+                yield path
+
+
+def expand_paths(patterns, candidates=None):
+    # turns a mix of files, directories and glob patterns into a sorted list of files;
+    # with `candidates` (paths the filesystem monitor saw change) directories are not walked
+    ignored = get_ignore_matcher()
+    files = set()
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            matches = glob.glob(pattern, recursive=True)
+        else:
+            matches = [pattern]
+
+        if not matches:
+            print(f"{Fore.RED}File {pattern} not found")
+
+        for match in matches:
+            if os.path.isdir(match):
+                if ignored(match, is_dir=True):
+                    continue
+                if candidates is None:
+                    files.update(walk_files(match, ignored))
+                    continue
+                prefix = normalize_path(match)
+                files.update(
+                    path
+                    for path in candidates
+                    if (prefix == "." or path.startswith(prefix + "/"))
+                    and os.path.isfile(path)
+                    and not ignored(path)
+                )
+            elif not os.path.exists(match):
+                print(f"{Fore.RED}File {match} not found")
+            elif ignored(match):
+                print(
+                    f"{Fore.YELLOW}File {Fore.LIGHTMAGENTA_EX}{match}{Fore.YELLOW} is ignored due to .gitignore"
+                )
+            else:
+                files.add(normalize_path(match))
+    return sorted(files)
+
+
+def get_current_commit():
+    return repository().current_commit()
+
+
+"_______Tracing_______"
+
+
+# TREK_TRACE=1 (or "stderr") reports each command on stderr, any other value names a
+# JSON-lines trace file; TREK_CPROFILE=<dir> also dumps a cProfile file per command
+TRACE_ENV = "TREK_TRACE"
+CPROFILE_ENV = "TREK_CPROFILE"
+
+# where traces go when set from the command line (--profile), before the environment
+_trace_target = None
+# the trace of the command currently running, None when tracing is off
+_trace = None
+
+
+class Trace:
+    # spans are aggregated by name, so hot paths can be timed without growing a log
+    def __init__(self, argv):
+        self.argv = argv
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def add_span(self, name, elapsed):
+        with self.lock:
+            span = self.spans.setdefault(name, [0, 0.0])
+            span[0] += 1
+            span[1] += elapsed
+
+    def count(self, name, amount):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def report(self):
+        return {
+            "command": self.argv[0],
+            "argv": self.argv,
+            "wall_s": round(time.perf_counter() - self.started, 6),
+            "spans": {
+                name: {"calls": calls, "total_s": round(total, 6)}
+                for name, (calls, total) in sorted(self.spans.items())
+            },
+            "counters": dict(sorted(self.counters.items())),
+        }
+
+
+class TraceSpan:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        if _trace is not None:
+            _trace.add_span(self.name, time.perf_counter() - self.start)
+
+
+_no_span = contextlib.nullcontext()
+
+
+def trace_span(name):
+    return _no_span if _trace is None else TraceSpan(name)
+
+
+def trace_count(name, amount=1):
+    if _trace is not None:
+        _trace.count(name, amount)
+
+
+def trace_target():
+    return _trace_target or os.environ.get(TRACE_ENV) or None
+
+
+def write_trace(report, target):
+    if target in ("1", "stderr"):
+        out = sys.stderr
+        out.write(f"trace: {' '.join(report['argv'])} {report['wall_s']:.3f}s\n")
+        for name, span in report["spans"].items():
+            out.write(f"  {name:<28}{span['calls']:>8} calls {span['total_s']:>10.4f}s\n")
+        for name, value in report["counters"].items():
+            out.write(f"  {name:<28}{value:>8}\n")
+        out.flush()
+        return
+    with open(target, "a") as trace_file:
+        trace_file.write(json.dumps(report) + "\n")
+
+
+def traced(argv, run):
+    # runs one command under a fresh trace, and under cProfile when asked to
+    global _trace
+    target = trace_target()
+    profile_dir = os.environ.get(CPROFILE_ENV)
+    if target is None and not profile_dir:
+        return run()
+
+    _trace = Trace(argv)
+    try:
+        if profile_dir:
+            import cProfile
+
+            profiler = cProfile.Profile()
+            try:
+                return profiler.runcall(run)
+            finally:
+                os.makedirs(profile_dir, exist_ok=True)
+                profiler.dump_stats(
+                    os.path.join(profile_dir, f"{argv[0]}-{os.getpid()}-{time.time_ns()}.prof")
+                )
+        return run()
+    finally:
+        report = _trace.report()
+        _trace = None
+        if target is not None:
+            write_trace(report, target)
+
+
+"_______Lock Files_______"
+
+
+# how long a writer waits for another process to let go of a lock before giving up
+LOCK_TIMEOUT = 10.0
+LOCK_RETRY_DELAY = 0.002
+LOCK_MAX_RETRY_DELAY = 0.1
+
+
+class LockFile:
+    # "<path>.lock" is created exclusively, so only one process at a time may change path;
+    # whatever was written to it replaces path in one rename when the block exits cleanly
+    def __init__(self, path, timeout=LOCK_TIMEOUT):
+        self.path = path
+        self.lock_path = path + ".lock"
+        self.timeout = timeout
+        self.file = None
+        self.written = False
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        delay = LOCK_RETRY_DELAY
+        while True:
+            try:
+                fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+            except FileExistsError:
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(delay)
+                delay = min(delay * 2, LOCK_MAX_RETRY_DELAY)
+                continue
+            self.file = os.fdopen(fd, "wb")
+            return True
+
+    def write(self, data):
+        # a second write replaces the first, the lock is only renamed once at the end
+        self.file.seek(0)
+        self.file.truncate()
+        self.file.write(data)
+        self.written = True
+
+    def __enter__(self):
+        if self.file is None and not self.acquire():
+            raise TimeoutError(
+                f"{self.lock_path} is held by another process; if no trek command is "
+                "running, it was left behind by one that died and can be removed"
+            )
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        self.file.close()
+        self.file = None
+        if self.written and exc_type is None:
+            publish_file(self.lock_path, self.path)
+        else:
+            os.remove(self.lock_path)
+
+
+"_______Write Batches_______"
+
+
+# core.durability: "none" leaves flushing to the OS, "strict" syncs every file as it is
+# written, "batch" holds loose objects back and syncs them together before anything that
+# can point at them (a ref, the index, a pack index) is published
+DURABILITY_LEVELS = ("none", "batch", "strict")
+
+# the batch of the command running now, None outside of a transaction
+_batch = None
+
+
+def sync_file(path):
+    # fsync needs a descriptor, a read-only one works for files and directories alike
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    trace_count("fsyncs")
+
+
+class WriteBatch:
+    def __init__(self, durability):
+        self.durability = durability
+        # final object path -> the temp file holding it until the next flush
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def add_object(self, temp_path, path):
+        if self.durability == "batch":
+            with self.lock:
+                if path not in self.pending:
+                    self.pending[path] = temp_path
+                    return
+            # another thread stored the same content first
+            os.remove(temp_path)
+            return
+        if self.durability == "strict":
+            sync_file(temp_path)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        os.replace(temp_path, path)
+        if self.durability == "strict":
+            sync_file(directory)
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        with trace_span("batch.flush"):
+            # fsyncs in flight together share the filesystem's journal commits
+            workers = min(len(pending), 4 * (os.cpu_count() or 1))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(sync_file, pending.values()))
+            directories = set()
+            for path, temp_path in pending.items():
+                directory = os.path.dirname(path)
+                if directory not in directories:
+                    # another process may create the same fan-out directory at the same time
+                    os.makedirs(directory, exist_ok=True)
+                    # a new fan-out directory is itself an entry of objects/
+                    directories.add(os.path.dirname(directory))
+                directories.add(directory)
+                os.replace(temp_path, path)
+            for directory in sorted(directories):
+                sync_file(directory)
+
+    def publish(self, temp_path, path):
+        # everything written before this file is durable by the time it becomes visible
+        self.flush()
+        if self.durability != "none":
+            sync_file(temp_path)
+        os.replace(temp_path, path)
+        if self.durability != "none":
+            sync_file(os.path.dirname(path))
+
+
+def durability(repo_path):
+    level = config_value(repo_path, "core.durability")
+    # a hand-edited typo falls back to the default rather than breaking every command
+    return level if level in DURABILITY_LEVELS else CONFIG_DEFAULTS["core"]["durability"]
+
+
+@contextlib.contextmanager
+def transaction(repo_path):
+    # every write until the block exits is one batch; nested transactions join the outer one
+    global _batch
+    if _batch is not None:
+        yield _batch
+        return
+    _batch = WriteBatch(durability(repo_path))
+    try:
+        yield _batch
+    finally:
+        batch, _batch = _batch, None
+        # whatever was stored is complete, so it is kept even when the command failed
+        batch.flush()
+
+
+def publish_file(temp_path, path):
+    # renames a finished file into place; refs, the index and packs all go through here
+    if _batch is None:
+        os.replace(temp_path, path)
+    else:
+        _batch.publish(temp_path, path)
+
+
+def pending_object(path):
+    # the temp file of a loose object a batch has not renamed into place yet
+    return _batch.pending.get(path) if _batch is not None else None
+
+
+"_______Repository Session_______"
+
+
+# parsed objects kept in memory per repository; large blobs are never cached
+OBJECT_CACHE_SIZE = 64 * 1024 * 1024
+OBJECT_CACHE_MAX_ENTRY = OBJECT_CACHE_SIZE // 16
+
+# one session per .trek directory, shared by every command run in this process
+_repositories = {}
+
+# packed-refs holds one "<name> <hash>" line per ref, sorted by name, after this header
+PACKED_REFS_HEADER = b"# trek packed-refs sorted\n"
+
+
+class LRUCache:
+    # evicts least recently used entries once their combined size passes max_size bytes
+    def __init__(self, max_size, max_entry=None):
+        self.max_size = max_size
+        self.max_entry = max_entry or max_size
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        if size > self.max_entry:
+            return value
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self.entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+        return value
+
+    def discard(self, key):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+class Repository:
+    # refs are re-read only when their file changed; objects are immutable, so a cached
+    # object stays valid for as long as the repository holds it
+    def __init__(self, path):
+        self.path = path
+        self.objects = LRUCache(OBJECT_CACHE_SIZE, OBJECT_CACHE_MAX_ENTRY)
+        self.refs = {}
+        self.packed = None
+        self.config = None
+
+    def exists(self):
+        return os.path.isdir(self.path)
+
+    def read_ref(self, name):
+        path = os.path.join(self.path, name)
+        try:
+            stat = os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            self.refs.pop(name, None)
+            # a ref without a loose file may still be packed
+            return self.packed_ref(name) if name.startswith("refs/") else None
+        # a directory of nested refs such as refs/heads/ci is not itself a ref
+        if (stat.st_mode & 0o170000) != 0o100000:
+            return None
+        key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        cached = self.refs.get(name)
+        # a file written within the racy window may change again without a new mtime
+        if cached is not None and cached[0] == key and time.time_ns() - key[0] > RACY_WINDOW_NS:
+            return cached[1]
+        with open(path, "r") as ref_file:
+            value = ref_file.read().strip()
+        self.refs[name] = (key, value)
+        return value
+
+    def write_ref(self, name, value):
+        # loose refs always win over packed ones, so updates never touch packed-refs
+        path = os.path.join(self.path, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with LockFile(path) as lock:
+            lock.write(value.encode("utf-8"))
+        self.refs.pop(name, None)
+
+    def update_ref(self, name, value, expected):
+        # replaces the ref only if it still holds `expected` (None: it must not exist yet)
+        path = os.path.join(self.path, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with LockFile(path) as lock:
+            # other writers wait on the lock, so the value read here cannot change before the rename
+            self.refs.pop(name, None)
+            if self.read_ref(name) != expected:
+                return False
+            lock.write(value.encode("utf-8"))
+        self.refs.pop(name, None)
+        return True
+
+    def delete_ref(self, name):
+        path = os.path.join(self.path, name)
+        with LockFile(path):
+            if os.path.exists(path):
+                os.remove(path)
+            self.refs.pop(name, None)
+            if name.startswith("refs/") and self.packed_ref(name) is not None:
+                with LockFile(os.path.join(self.path, "packed-refs")) as packed_lock:
+                    # read again under the lock so refs packed meanwhile are kept
+                    self.packed = None
+                    self.write_packed_refs(
+                        [(ref, value) for ref, value in self.iter_packed_refs() if ref != name],
+                        packed_lock,
+                    )
+
+    def ref_exists(self, name):
+        return self.read_ref(name) is not None
+
+    def packed_refs(self):
+        # the mapped packed-refs file, reopened only when it was replaced
+        path = os.path.join(self.path, "packed-refs")
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self.packed = None
+            return None
+        key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if self.packed is None or self.packed[0] != key:
+            with open(path, "rb") as packed_file:
+                data = mmap.mmap(packed_file.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else b""
+            self.packed = (key, data)
+        return self.packed[1]
+
+    def packed_search(self, data, name):
+        # offset of the first line whose ref name is >= name
+        key = name.encode("utf-8")
+        low, high = len(PACKED_REFS_HEADER), len(data)
+        while low < high:
+            middle = (low + high) // 2
+            start = max(low, data.rfind(b"\n", low, middle) + 1)
+            end = data.find(b"\n", start)
+            if data[start : data.rfind(b" ", start, end)] < key:
+                low = end + 1
+            else:
+                high = start
+        return low
+
+    def packed_ref(self, name):
+        data = self.packed_refs()
+        if not data:
+            return None
+        start = self.packed_search(data, name)
+        end = data.find(b"\n", start)
+        if end < 0:
+            return None
+        ref, _, value = data[start:end].decode("utf-8").rpartition(" ")
+        return value if ref == name else None
+
+    def iter_packed_refs(self, prefix=""):
+        # sorted (name, hash) pairs for every packed ref starting with prefix
+        data = self.packed_refs()
+        if not data:
+            return
+        pos = self.packed_search(data, prefix)
+        while pos < len(data):
+            end = data.find(b"\n", pos)
+            ref, _, value = data[pos:end].decode("utf-8").rpartition(" ")
+            if not ref.startswith(prefix):
+                return
+            yield ref, value
+            pos = end + 1
+
+    def iter_loose_refs(self, prefix=""):
+        # loose refs are files under refs/, named by their path
+        base = os.path.join(self.path, "refs")
+        for root, dirs, names in os.walk(base):
+            dirs.sort()
+            relative = normalize_path(os.path.relpath(root, self.path))
+            for name in names:
+                ref = f"{relative}/{name}"
+                # lock files of refs being updated right now are not refs themselves
+                if ref.startswith(prefix) and not name.endswith(".lock"):
+                    yield ref
+
+    def list_refs(self, prefix="refs/"):
+        # loose and packed refs merged by name, loose values winning
+        loose = {ref: self.read_ref(ref) for ref in self.iter_loose_refs(prefix)}
+        refs = dict(self.iter_packed_refs(prefix))
+        refs.update(loose)
+        return sorted(refs.items())
+
+    def write_packed_refs(self, refs, lock):
+        # the caller holds packed-refs.lock from reading the old refs until this is renamed in
+        lines = [PACKED_REFS_HEADER]
+        lines.extend(f"{ref} {value}\n".encode("utf-8") for ref, value in sorted(refs))
+        lock.write(b"".join(lines))
+        self.packed = None
+
+    def head_branch(self):
+        # "refs/heads/<name>" when HEAD points at a branch, None when detached
+        head = self.read_ref("HEAD") or ""
+        return head[5:] if head.startswith("ref: ") else None
+
+    def current_commit(self):
+        head = self.read_ref("HEAD") or ""
+        if head.startswith("ref: "):
+            return self.read_ref(head[5:]) or ""
+        return head
+
+    def read_object(self, object_hash):
+        key = ("object", object_hash)
+        cached = self.objects.get(key)
+        if cached is not None:
+            trace_count("object_cache_hits")
+            return cached
+        object_type, content = load_object(self.path, object_hash)
+        if content is None:
+            return None, None
+        return self.objects.put(key, (object_type, content), len(content))
+
+    def cached(self, kind, object_hash, parse):
+        # parsed form of an object, charged at the size of its raw content
+        key = (kind, object_hash)
+        cached = self.objects.get(key)
+        if cached is not None:
+            return cached
+        _, content = self.read_object(object_hash)
+        if content is None:
+            return None
+        return self.objects.put(key, parse(content), len(content))
+
+
+def repository(repo_path=None):
+    repo_path = repo_path or os.path.join(os.getcwd(), ".trek")
+    repo = _repositories.get(repo_path)
+    if repo is None:
+        repo = _repositories[repo_path] = Repository(repo_path)
+    return repo
+
+
+"_______Repository Config_______"
+
+
+# .trek/config is an INI file; anything missing from it falls back to these
+CONFIG_DEFAULTS = {
+    "core": {
+        # files at least this many bytes are stored as chunks, 0 turns chunking off
+        "chunk_threshold": str(16 * 1024 * 1024),
+        # none, batch or strict, see DURABILITY_LEVELS
+        "durability": "batch",
+        # set once by init; repositories from before it existed hash with sha1
+        "object_format": "sha1",
+    },
+    "receive": {
+        # a push may not move the branch a remote has checked out, unless this is false
+        "deny_current_branch": "true",
+    },
+    "gc": {
+        # unreachable objects younger than this many seconds survive gc, so an add or
+        # commit running alongside it never loses objects its refs do not point to yet
+        "prune_expire": str(14 * 24 * 3600),
+    },
+}
+
+
+# settings read with config_int, and the unit they are given in
+CONFIG_INTEGERS = {"core.chunk_threshold": "bytes", "gc.prune_expire": "seconds"}
+
+
+def read_config(repo_path):
+    repo = repository(repo_path)
+    path = os.path.join(repo_path, "config")
+    try:
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    except FileNotFoundError:
+        key = None
+    if repo.config is None or repo.config[0] != key:
+        config = configparser.ConfigParser()
+        config.read_dict(CONFIG_DEFAULTS)
+        if key is not None:
+            config.read(path)
+        repo.config = (key, config)
+    return repo.config[1]
+
+
+def config_value(repo_path, name):
+    section, _, option = name.partition(".")
+    return read_config(repo_path).get(section, option, fallback=None)
+
+
+def config_int(repo_path, name):
+    value = config_value(repo_path, name)
+    # a hand-edited typo falls back to the default rather than breaking every command
+    if not value.isdigit():
+        section, _, option = name.partition(".")
+        value = CONFIG_DEFAULTS[section][option]
+    return int(value)
+
+
+def set_config_value(repo_path, name, value):
+    section, _, option = name.partition(".")
+    config = configparser.ConfigParser()
+    path = os.path.join(repo_path, "config")
+    with LockFile(path) as lock:
+        config.read(path)
+        if not config.has_section(section):
+            config.add_section(section)
+        config.set(section, option, value)
+        text = io.StringIO()
+        config.write(text)
+        lock.write(text.getvalue().encode("utf-8"))
+
+
+def config(name=None, value=None):
+    repo_path = repository().path
+
+    if not os.path.exists(repo_path):
+        print(f"{Fore.RED}Not a trek repository!")
+        return False
 
-    if not os.path.exists(ignore_path):
+    if name is None:
+        settings = read_config(repo_path)
+        for section in settings.sections():
+            for option, current in settings.items(section):
+                print(f"{Fore.CYAN}{section}.{option}{Fore.WHITE}={current}")
+        return
+
+    if "." not in name:
+        print(f"{Fore.RED}Config names look like section.option")
+        return False
+
+    if name == "core.object_format" and value is not None:
+        print(f"{Fore.RED}The object format is chosen at init and cannot change afterwards.")
+        return False
+
+    if name == "receive.deny_current_branch" and value not in (None, "true", "false"):
+        print(f"{Fore.RED}{name} takes true or false")
+        return False
+
+    if name in CONFIG_INTEGERS and value is not None and not value.isdigit():
+        print(f"{Fore.RED}{name} takes a whole number of {CONFIG_INTEGERS[name]}")
+        return False
+
+    if name == "core.durability" and value is not None and value not in DURABILITY_LEVELS:
+        print(f"{Fore.RED}core.durability is one of {', '.join(DURABILITY_LEVELS)}")
+        return False
+
+    if value is None:
+        current = config_value(repo_path, name)
+        if current is None:
+            print(f"{Fore.RED}{name} is not set")
+        else:
+            print(current)
+        return
+
+    set_config_value(repo_path, name, value)
+
+
+"_______Object Storage_______"
+
+
+# objects written before the fan-out layout existed live directly in .trek/objects
+LEGACY_TREE_LINE = re.compile(r"^[0-9a-f]{40} \S")
+
+# files are hashed and compressed in pieces of this size so memory use stays flat
+STREAM_CHUNK_SIZE = 1024 * 1024
+# large files are mostly already-compressed assets, where a higher level only costs time
+STREAM_COMPRESSION_LEVEL = 1
+
+
+# how object ids are computed; every stored hash depends on it, so a repository keeps
+# the format it was created with
+OBJECT_FORMATS = {
+    "sha1": hashlib.sha1,
+    "sha256": hashlib.sha256,
+    # cut to 32 bytes so its ids are as long as sha256's
+    "blake2b": functools.partial(hashlib.blake2b, digest_size=32),
+}
+
+
+def object_format(repo_path):
+    name = config_value(repo_path, "core.object_format")
+    if name not in OBJECT_FORMATS:
+        raise ValueError(f"Unknown object format {name}")
+    return name
+
+
+def new_hasher(repo_path):
+    return OBJECT_FORMATS[object_format(repo_path)]()
+
+
+def object_path(repo_path, object_hash):
+    return os.path.join(repo_path, "objects", object_hash[:2], object_hash[2:])
+
+
+def legacy_object_path(repo_path, object_hash):
+    return os.path.join(repo_path, "objects", object_hash)
+
+
+def object_exists(repo_path, object_hash):
+    if not object_hash:
+        return False
+    if find_packed_object(repo_path, object_hash) is not None:
+        return True
+    path = object_path(repo_path, object_hash)
+    return (
+        os.path.exists(path)
+        or pending_object(path) is not None
+        or os.path.exists(legacy_object_path(repo_path, object_hash))
+    )
+
+
+def freshen_object(repo_path, object_hash):
+    # object_exists for writers: an object being reused gets a new mtime (its pack's, if
+    # packed), so gc's grace period covers it until the index or a ref points to it
+    if not object_hash:
+        return False
+    if pending_object(object_path(repo_path, object_hash)) is not None:
+        return True
+    location = find_packed_object(repo_path, object_hash)
+    paths = [location[0]["path"]] if location is not None else []
+    paths += [object_path(repo_path, object_hash), legacy_object_path(repo_path, object_hash)]
+    for path in paths:
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            # gone already, possibly pruned a moment ago, so the caller writes it again
+            continue
+    return False
+
+
+def write_object(repo_path, content, object_type="blob", object_hash=None):
+    # object_hash is only passed for chunk manifests, which go under their file's hash
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+
+    if object_hash is None:
+        hasher = new_hasher(repo_path)
+        hasher.update(content)
+        object_hash = hasher.hexdigest()
+        trace_count("bytes_hashed", len(content))
+    if freshen_object(repo_path, object_hash):
+        return object_hash
+
+    header = f"{object_type} {len(content)}\0".encode("utf-8")
+    fd, temp_path = tempfile.mkstemp(dir=os.path.join(repo_path, "objects"), prefix="tmp-obj-")
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            temp_file.write(zlib.compress(header + content))
+        publish_object(repo_path, object_hash, temp_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    return object_hash
+
+
+def write_object_from_file(repo_path, file_path, object_type="blob"):
+    # hash and compress in one pass over the file without ever holding all of it
+    size = os.path.getsize(file_path)
+    hasher = new_hasher(repo_path)
+    compressor = zlib.compressobj(STREAM_COMPRESSION_LEVEL)
+    buffer = bytearray(STREAM_CHUNK_SIZE)
+    view = memoryview(buffer)
+    written = 0
+
+    fd, temp_path = tempfile.mkstemp(dir=os.path.join(repo_path, "objects"), prefix="tmp-obj-")
+    try:
+        with open(file_path, "rb") as source, os.fdopen(fd, "wb") as temp_file:
+            temp_file.write(compressor.compress(f"{object_type} {size}\0".encode("utf-8")))
+            while True:
+                count = source.readinto(buffer)
+                if not count:
+                    break
+                written += count
+                hasher.update(view[:count])
+                temp_file.write(compressor.compress(view[:count]))
+            temp_file.write(compressor.flush())
+
+        if written != size:
+            raise ValueError(f"{file_path} changed while it was being added")
+        trace_count("bytes_hashed", written)
+
+        object_hash = hasher.hexdigest()
+        if freshen_object(repo_path, object_hash):
+            os.remove(temp_path)
+        else:
+            publish_object(repo_path, object_hash, temp_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    return object_hash
+
+
+def hash_file(repo_path, file_path):
+    hasher = new_hasher(repo_path)
+    buffer = bytearray(STREAM_CHUNK_SIZE)
+    view = memoryview(buffer)
+    with open(file_path, "rb") as source:
+        while True:
+            count = source.readinto(buffer)
+            if not count:
+                break
+            hasher.update(view[:count])
+            trace_count("bytes_hashed", count)
+    return hasher.hexdigest()
+
+
+def publish_object(repo_path, object_hash, temp_path):
+    # rename is atomic, so readers only ever see complete objects
+    path = object_path(repo_path, object_hash)
+    if _batch is not None:
+        _batch.add_object(temp_path, path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+    trace_count("objects_written")
+
+
+def guess_legacy_type(content):
+    # legacy objects were stored without a header, so the type has to be inferred
+    if content.startswith(b"tree ") and b"\nauthor " in content:
+        return "commit"
+    if content.startswith(TREE_SIGNATURE):
+        return "tree"
+    lines = content.decode("utf-8", errors="replace").strip().split("\n")
+    if lines and all(LEGACY_TREE_LINE.match(line) for line in lines):
+        return "tree"
+    return "blob"
+
+
+def read_object(repo_path, object_hash):
+    if not object_hash:
+        return None, None
+    return repository(repo_path).read_object(object_hash)
+
+
+def load_object(repo_path, object_hash):
+    if not object_hash:
+        return None, None
+    trace_count("objects_read")
+
+    # packs are checked first since that is where most objects live after a repack
+    location = find_packed_object(repo_path, object_hash)
+    if location is not None:
+        return read_packed_object(*location)
+
+    path = object_path(repo_path, object_hash)
+    path = pending_object(path) or path
+    if os.path.exists(path):
+        with open(path, "rb") as object_file:
+            raw = zlib.decompress(object_file.read())
+        header, _, content = raw.partition(b"\0")
+        object_type, size = header.decode("utf-8").split(" ")
+        if int(size) != len(content):
+            raise ValueError(f"Corrupt object {object_hash}")
+        return object_type, content
+
+    path = legacy_object_path(repo_path, object_hash)
+    if os.path.isfile(path):
+        with open(path, "rb") as object_file:
+            content = object_file.read()
+        return guess_legacy_type(content), content
+
+    return None, None
+
+
+def object_type(repo_path, object_hash):
+    # only the header is read, so large blobs are never inflated just to learn their type
+    location = find_packed_object(repo_path, object_hash)
+    if location is not None:
+        pack, offset = location
+        data = pack["data"]
+        while data[offset] == PACK_DELTA:
+            _, pos = decode_varint(data, offset + 1)
+            distance, _ = decode_varint(data, pos)
+            offset -= distance
+        return PACK_TYPE_NAMES[data[offset]]
+
+    path = object_path(repo_path, object_hash)
+    path = pending_object(path) or path
+    if os.path.exists(path):
+        decompressor = zlib.decompressobj()
+        header = b""
+        with open(path, "rb") as object_file:
+            while b"\0" not in header:
+                block = object_file.read(256)
+                if not block:
+                    break
+                header += decompressor.decompress(block)
+        return header.partition(b" ")[0].decode("utf-8")
+
+    kind, _ = load_object(repo_path, object_hash)
+    return kind
+
+
+"_______Chunked Blobs_______"
+
+
+# large files are cut where their content says so, so an edit only changes the chunks
+# around it; the file is stored as a manifest of chunk blobs under its usual hash
+CHUNK_MANIFEST_SIGNATURE = b"\0CHNK"
+CHUNK_MANIFEST_VERSION = 1
+CHUNK_ENTRY = struct.Struct(">Q")
+CHUNK_MIN_SIZE = 256 * 1024
+CHUNK_AVG_SIZE = 1024 * 1024
+CHUNK_MAX_SIZE = 4 * 1024 * 1024
+CHUNK_READ_SIZE = 16 * 1024 * 1024
+# cut points are only considered after this byte, and decided by a hash of the bytes
+# before it; stricter mask below the average size, looser above it (FastCDC's normalization)
+CHUNK_ANCHOR = b"\n"
+CHUNK_WINDOW = 48
+CHUNK_MASK_STRICT = (1 << 13) - 1
+CHUNK_MASK_LOOSE = (1 << 10) - 1
+
+
+def find_chunk_cut(data, start, end):
+    limit = min(end, start + CHUNK_MAX_SIZE)
+    normal = start + CHUNK_AVG_SIZE
+    pos = start + CHUNK_MIN_SIZE
+    while pos < limit:
+        # the byte scan runs in C; the window hash is only taken at candidate bytes
+        pos = data.find(CHUNK_ANCHOR, pos, limit)
+        if pos < 0:
+            break
+        mask = CHUNK_MASK_STRICT if pos < normal else CHUNK_MASK_LOOSE
+        if not zlib.crc32(data[pos - CHUNK_WINDOW : pos]) & mask:
+            return pos + 1
+        pos += 1
+    return limit
+
+
+def iter_file_chunks(source):
+    data = b""
+    start = 0
+    eof = False
+    while True:
+        # keep at least one maximum-size chunk buffered so cuts never depend on read sizes
+        if not eof and len(data) - start < CHUNK_MAX_SIZE:
+            block = source.read(CHUNK_READ_SIZE)
+            data = data[start:] + block
+            start = 0
+            eof = not block
+            continue
+        if start == len(data):
+            return
+        cut = find_chunk_cut(data, start, len(data))
+        yield data[start:cut]
+        start = cut
+
+
+def encode_manifest(chunks, hash_size):
+    data = bytearray(CHUNK_MANIFEST_SIGNATURE)
+    data += bytes([CHUNK_MANIFEST_VERSION, hash_size])
+    for size, chunk_hash in chunks:
+        data += CHUNK_ENTRY.pack(size) + bytes.fromhex(chunk_hash)
+    return bytes(data)
+
+
+def decode_manifest(content):
+    hash_size = content[len(CHUNK_MANIFEST_SIGNATURE) + 1]
+    pos = len(CHUNK_MANIFEST_SIGNATURE) + 2
+    chunks = []
+    while pos < len(content):
+        (size,) = CHUNK_ENTRY.unpack_from(content, pos)
+        pos += CHUNK_ENTRY.size
+        chunks.append((size, content[pos : pos + hash_size].hex()))
+        pos += hash_size
+    return chunks
+
+
+def write_chunked_object(repo_path, file_path):
+    # chunks that are already stored are skipped by write_object, which is the whole point
+    size = os.path.getsize(file_path)
+    hasher = new_hasher(repo_path)
+    chunks = []
+    with open(file_path, "rb") as source:
+        for chunk in iter_file_chunks(source):
+            hasher.update(chunk)
+            chunks.append((len(chunk), write_object(repo_path, chunk, "blob")))
+
+    if sum(chunk_size for chunk_size, _ in chunks) != size:
+        raise ValueError(f"{file_path} changed while it was being added")
+
+    object_hash = hasher.hexdigest()
+    manifest = encode_manifest(chunks, hasher.digest_size)
+    return write_object(repo_path, manifest, "chunked", object_hash)
+
+
+def store_file(repo_path, file_path, size):
+    # big files go in as chunks, everything else as one streamed blob
+    threshold = config_int(repo_path, "core.chunk_threshold")
+    if threshold and size >= threshold:
+        return write_chunked_object(repo_path, file_path)
+    return write_object_from_file(repo_path, file_path, "blob")
+
+
+def iter_blob(repo_path, object_hash):
+    # a file's content piece by piece; chunks bypass the object cache so a big file
+    # streamed to disk does not push everything else out of it
+    object_type, content = read_object(repo_path, object_hash)
+    if object_type != "chunked":
+        if content is not None:
+            yield content
+        return
+    for _, chunk_hash in decode_manifest(content):
+        _, chunk = load_object(repo_path, chunk_hash)
+        if chunk is None:
+            raise ValueError(f"Missing chunk {chunk_hash} of {object_hash}")
+        yield chunk
+
+
+def read_blob(repo_path, object_hash):
+    if not object_hash:
+        return None
+    object_type, content = read_object(repo_path, object_hash)
+    if object_type != "chunked":
+        return content
+    return b"".join(iter_blob(repo_path, object_hash))
+
+
+"_______Staging Index_______"
+
+
+INDEX_SIGNATURE = b"TRKI"
+INDEX_VERSION = 1
+INDEX_HEADER = struct.Struct(">4sIIB")
+# mtime_ns, size, inode, mode, path length; followed by the binary hash and the path
+INDEX_ENTRY = struct.Struct(">qQQIH")
+INDEX_TREE_EXTENSION = b"TREE"
+# files modified this recently may still change within the same mtime tick
+RACY_WINDOW_NS = 2 * 10**9
+
+IndexEntry = namedtuple("IndexEntry", "hash mtime_ns size inode mode")
+
+
+class Index(dict):
+    # path -> IndexEntry, plus the tree hash of every directory whose entries are unchanged
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.trees = {}
+        # stat key of the index file this was read from, None when there was none
+        self.stamp = None
+
+    def invalidate(self, path):
+        parts = path.split("/")
+        for depth in range(len(parts)):
+            self.trees.pop("/".join(parts[:depth]), None)
+
+    def __setitem__(self, path, entry):
+        old = self.get(path)
+        # refreshed stat data leaves the content, and so every tree above it, unchanged
+        if old is None or old.hash != entry.hash:
+            self.invalidate(path)
+        super().__setitem__(path, entry)
+
+    def __delitem__(self, path):
+        self.invalidate(path)
+        super().__delitem__(path)
+
+    def pop(self, path, *default):
+        if path in self:
+            self.invalidate(path)
+        return super().pop(path, *default)
+
+
+def index_entry(file_hash, stat):
+    mtime_ns = stat.st_mtime_ns
+    if mtime_ns >= time.time_ns() - RACY_WINDOW_NS:
+        # too new to trust, a zero mtime forces the next check to rehash the file
+        mtime_ns = 0
+    return IndexEntry(file_hash, mtime_ns, stat.st_size, stat.st_ino, stat.st_mode)
+
+
+def stat_matches(entry, stat):
+    return (
+        entry.mtime_ns == stat.st_mtime_ns
+        and entry.size == stat.st_size
+        and entry.inode == stat.st_ino
+        and entry.mode == stat.st_mode
+    )
+
+
+def index_stamp(stat):
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+def lock_index(repo_path, timeout=LOCK_TIMEOUT):
+    # held from reading the index until the modified copy is renamed over it
+    return LockFile(os.path.join(repo_path, "index"), timeout)
+
+
+def read_index(repo_path):
+    with trace_span("index.read"):
+        index_path = os.path.join(repo_path, "index")
+        try:
+            index_file = open(index_path, "rb")
+        except FileNotFoundError:
+            return Index()
+
+        with index_file:
+            data = index_file.read()
+            stamp = index_stamp(os.fstat(index_file.fileno()))
+
+        if not data.startswith(INDEX_SIGNATURE):
+            # older repositories kept a JSON dict of only what was staged since the last
+            # commit, so the tracked set starts from HEAD's tree with the staged files on top;
+            # without stat data every file is rehashed once
+            staged = json.loads(data.decode("utf-8") or "{}")
+            head_commit = repository(repo_path).current_commit()
+            tracked = {}
+            if head_commit:
+                tracked = read_tree(repo_path, commit_tree_hash(repo_path, head_commit)) or {}
+            tracked.update(staged)
+            index = Index({path: IndexEntry(file_hash, 0, 0, 0, 0) for path, file_hash in tracked.items()})
+            index.stamp = stamp
+            return index
+
+        checksum = new_hasher(repo_path)
+        checksum.update(data[: -checksum.digest_size])
+        if checksum.digest() != data[-checksum.digest_size :]:
+            raise ValueError("Index checksum mismatch")
+
+        _, version, count, hash_size = INDEX_HEADER.unpack_from(data, 0)
+        if version != INDEX_VERSION:
+            raise ValueError(f"Unsupported index version {version}")
+
+        entries = {}
+        pos = INDEX_HEADER.size
+        for _ in range(count):
+            mtime_ns, size, inode, mode, path_length = INDEX_ENTRY.unpack_from(data, pos)
+            pos += INDEX_ENTRY.size
+            file_hash = data[pos : pos + hash_size].hex()
+            pos += hash_size
+            path = data[pos : pos + path_length].decode("utf-8")
+            pos += path_length
+            entries[path] = IndexEntry(file_hash, mtime_ns, size, inode, mode)
+        index = Index(entries)
+        index.stamp = stamp
+
+        # optional extension with the cached tree hash of each untouched directory
+        if data[pos : pos + 4] == INDEX_TREE_EXTENSION:
+            (tree_count,) = struct.unpack_from(">I", data, pos + 4)
+            pos += 8
+            for _ in range(tree_count):
+                (path_length,) = struct.unpack_from(">H", data, pos)
+                pos += 2
+                directory = data[pos : pos + path_length].decode("utf-8")
+                pos += path_length
+                index.trees[directory] = data[pos : pos + hash_size].hex()
+                pos += hash_size
+        return index
+
+
+def write_index(repo_path, index, lock):
+    # the caller holds lock_index() from before it read the index it is writing back
+    with trace_span("index.write"):
+        paths = sorted(index)
+        checksum = new_hasher(repo_path)
+        hash_size = checksum.digest_size
+
+        data = bytearray(INDEX_HEADER.pack(INDEX_SIGNATURE, INDEX_VERSION, len(paths), hash_size))
+        for path in paths:
+            entry = index[path]
+            encoded = path.encode("utf-8")
+            data += INDEX_ENTRY.pack(entry.mtime_ns, entry.size, entry.inode, entry.mode, len(encoded))
+            data += bytes.fromhex(entry.hash)
+            data += encoded
+
+        trees = getattr(index, "trees", {})
+        if trees:
+            data += INDEX_TREE_EXTENSION + struct.pack(">I", len(trees))
+            for directory in sorted(trees):
+                encoded = directory.encode("utf-8")
+                data += struct.pack(">H", len(encoded)) + encoded + bytes.fromhex(trees[directory])
+        checksum.update(data)
+        data += checksum.digest()
+        lock.write(bytes(data))
+
+
+def refresh_index(repo_path, index):
+    # refreshed stat data saves rehashing next time but is not worth waiting for, so it is
+    # dropped when another writer holds the index or has replaced it since it was read
+    lock = lock_index(repo_path, timeout=0)
+    if not lock.acquire():
+        return
+    with lock:
+        try:
+            current = index_stamp(os.stat(os.path.join(repo_path, "index")))
+        except FileNotFoundError:
+            current = None
+        if current == index.stamp:
+            write_index(repo_path, index, lock)
+
+
+"_______Tree Objects_______"
+
+
+TREE_SIGNATURE = b"\0TREE"
+TREE_VERSION = 1
+# entry kind and name length; followed by the name and the binary hash
+TREE_ENTRY = struct.Struct(">BH")
+TREE_FILE = 0
+TREE_DIR = 1
+
+
+def encode_tree(entries):
+    hash_size = len(bytes.fromhex(next(iter(entries.values()))[1])) if entries else 20
+    data = bytearray(TREE_SIGNATURE + bytes([TREE_VERSION, hash_size]))
+    for name in sorted(entries):
+        kind, object_hash = entries[name]
+        encoded = name.encode("utf-8")
+        data += TREE_ENTRY.pack(kind, len(encoded)) + encoded + bytes.fromhex(object_hash)
+    return bytes(data)
+
+
+def is_legacy_tree(content):
+    return not content.startswith(TREE_SIGNATURE)
+
+
+def parse_tree(repo_path, tree_hash):
+    # one directory level: name -> (kind, hash); callers must not modify the result
+    if not tree_hash:
+        return None
+    return repository(repo_path).cached("tree", tree_hash, decode_tree)
+
+
+def decode_tree(content):
+    entries = {}
+    if is_legacy_tree(content):
+        # flat "<hash> <path>" trees from before directories had their own objects
+        for line in content.decode("utf-8").strip().split("\n"):
+            if line:
+                file_hash, file_name = line.split(" ", 1)
+                entries[file_name] = (TREE_FILE, file_hash)
+        return entries
+
+    hash_size = content[len(TREE_SIGNATURE) + 1]
+    pos = len(TREE_SIGNATURE) + 2
+    while pos < len(content):
+        kind, name_length = TREE_ENTRY.unpack_from(content, pos)
+        pos += TREE_ENTRY.size
+        name = content[pos : pos + name_length].decode("utf-8")
+        pos += name_length
+        entries[name] = (kind, content[pos : pos + hash_size].hex())
+        pos += hash_size
+    return entries
+
+
+def read_tree(repo_path, tree_hash, trees=None, prefix=""):
+    # flattens a tree into path -> blob hash; `trees` collects each directory's tree hash
+    entries = parse_tree(repo_path, tree_hash)
+    if entries is None:
+        return None
+    if trees is not None:
+        trees[prefix[:-1]] = tree_hash
+
+    files = {}
+    for name, (kind, object_hash) in entries.items():
+        if kind == TREE_DIR:
+            files.update(read_tree(repo_path, object_hash, trees, prefix + name + "/") or {})
+        else:
+            files[prefix + name] = object_hash
+    return files
+
+
+def iter_tree(repo_path, tree_hash, seen_trees=None, prefix=""):
+    # yields (path, kind, hash) for every entry, skipping subtrees already in seen_trees
+    if seen_trees is not None:
+        if tree_hash in seen_trees:
+            return
+        seen_trees.add(tree_hash)
+    for name, (kind, object_hash) in (parse_tree(repo_path, tree_hash) or {}).items():
+        yield prefix + name, kind, object_hash
+        if kind == TREE_DIR:
+            yield from iter_tree(repo_path, object_hash, seen_trees, prefix + name + "/")
+
+
+def write_tree(repo_path, entries, trees=None):
+    # directories listed in `trees` are reused as they are, every other one is rebuilt
+    trees = {} if trees is None else trees
+    return _write_subtree(repo_path, "", sorted(entries.items()), trees)
+
+
+def _write_subtree(repo_path, directory, items, trees):
+    if directory in trees:
+        return trees[directory]
+
+    tree_entries = {}
+    subdirs = {}
+    for path, file_hash in items:
+        name, separator, rest = path.partition("/")
+        if separator:
+            subdirs.setdefault(name, []).append((rest, file_hash))
+        else:
+            tree_entries[name] = (TREE_FILE, file_hash)
+
+    for name, sub_items in subdirs.items():
+        sub_directory = f"{directory}/{name}" if directory else name
+        tree_entries[name] = (TREE_DIR, _write_subtree(repo_path, sub_directory, sub_items, trees))
+
+    tree_hash = write_object(repo_path, encode_tree(tree_entries), "tree")
+    trees[directory] = tree_hash
+    return tree_hash
+
+
+def diff_trees(repo_path, old_tree, new_tree, paths=None, prefix=""):
+    # subtrees with equal hashes are skipped without being read
+    if old_tree == new_tree:
+        return
+    old_entries = (parse_tree(repo_path, old_tree) or {}) if old_tree else {}
+    new_entries = (parse_tree(repo_path, new_tree) or {}) if new_tree else {}
+
+    for name in sorted(set(old_entries) | set(new_entries)):
+        old_kind, old_hash = old_entries.get(name, (None, None))
+        new_kind, new_hash = new_entries.get(name, (None, None))
+        if (old_kind, old_hash) == (new_kind, new_hash):
+            continue
+
+        path = prefix + name
+        if paths and not any(
+            path_matches(path, paths) or p.startswith(path + "/") for p in paths
+        ):
+            continue
+
+        old_subtree = old_hash if old_kind == TREE_DIR else None
+        new_subtree = new_hash if new_kind == TREE_DIR else None
+        if old_subtree or new_subtree:
+            yield from diff_trees(repo_path, old_subtree, new_subtree, paths, path + "/")
+
+        old_file = old_hash if old_kind == TREE_FILE else None
+        new_file = new_hash if new_kind == TREE_FILE else None
+        if old_file != new_file and path_matches(path, paths):
+            yield path, old_file, new_file
+
+
+"_______Commit Objects_______"
+
+
+def create_commit(repo_path, tree_hash, parents, message):
+    commit_content = f"tree {tree_hash}\n"
+    for parent in parents:
+        commit_content += f"parent {parent}\n"
+    commit_content += f"author User <user@example.com>\n"
+    commit_content += (
+        f"date {datetime.now().strftime(COMMIT_DATE_FORMAT)}\n\n{message}\n"
+    )
+    return write_object(repo_path, commit_content, "commit")
+
+
+def commit_tree_hash(repo_path, commit_hash):
+    info = commit_info(repo_path, commit_hash)
+    return info.tree if info else None
+
+
+"_______Commit Graph_______"
+
+
+COMMIT_GRAPH_SIGNATURE = b"TCGR"
+COMMIT_GRAPH_VERSION = 1
+COMMIT_GRAPH_HEADER = struct.Struct(">4sIB")
+# parent positions, generation number and commit timestamp; hashes come first
+COMMIT_GRAPH_RECORD = struct.Struct(">IIIq")
+NO_PARENT = 0xFFFFFFFF
+COMMIT_DATE_FORMAT = "%a %b %d %H:%M:%S %Y"
+
+CommitInfo = namedtuple("CommitInfo", "tree parents generation timestamp")
+
+# loaded graphs, keyed by repository and invalidated when the file grows
+_commit_graph_cache = {}
+
+
+def parse_commit(commit_content):
+    header, _, message = commit_content.partition("\n\n")
+    commit = {"tree": None, "parents": [], "author": "", "date": "", "message": message}
+    for line in header.split("\n"):
+        key, _, value = line.partition(" ")
+        if key == "parent":
+            commit["parents"].append(value)
+        elif key in ("tree", "author", "date"):
+            commit[key] = value
+    return commit
+
+
+def read_commit(repo_path, commit_hash):
+    return repository(repo_path).cached(
+        "commit", commit_hash, lambda content: parse_commit(content.decode("utf-8", errors="replace"))
+    )
+
+
+def commit_timestamp(date):
+    try:
+        return int(datetime.strptime(date, COMMIT_DATE_FORMAT).timestamp())
+    except ValueError:
+        return 0
+
+
+def commit_graph_path(repo_path):
+    return os.path.join(repo_path, "commit-graph")
+
+
+def commit_graph_record_size(hash_size):
+    return 2 * hash_size + COMMIT_GRAPH_RECORD.size
+
+
+def load_commit_graph(repo_path):
+    path = commit_graph_path(repo_path)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    stamp = (stat.st_size, stat.st_mtime_ns)
+
+    cached = _commit_graph_cache.get(repo_path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+
+    with open(path, "rb") as graph_file:
+        data = graph_file.read()
+
+    if len(data) < COMMIT_GRAPH_HEADER.size:
+        return None
+    signature, version, hash_size = COMMIT_GRAPH_HEADER.unpack_from(data, 0)
+    if signature != COMMIT_GRAPH_SIGNATURE or version != COMMIT_GRAPH_VERSION:
+        return None
+
+    record_size = commit_graph_record_size(hash_size)
+    # a torn trailing record from an interrupted append is simply ignored
+    count = (len(data) - COMMIT_GRAPH_HEADER.size) // record_size
+
+    hashes = []
+    records = []
+    pos = COMMIT_GRAPH_HEADER.size
+    for _ in range(count):
+        hashes.append(data[pos : pos + hash_size].hex())
+        tree = data[pos + hash_size : pos + 2 * hash_size].hex()
+        records.append((tree,) + COMMIT_GRAPH_RECORD.unpack_from(data, pos + 2 * hash_size))
+        pos += record_size
+
+    graph = {
+        "hash_size": hash_size,
+        "hashes": hashes,
+        "records": records,
+        "positions": {commit_hash: i for i, commit_hash in enumerate(hashes)},
+    }
+    _commit_graph_cache[repo_path] = (stamp, graph)
+    return graph
+
+
+def commit_info(repo_path, commit_hash):
+    graph = load_commit_graph(repo_path)
+    if graph is not None:
+        position = graph["positions"].get(commit_hash)
+        if position is not None:
+            tree, parent1, parent2, generation, timestamp = graph["records"][position]
+            parents = [graph["hashes"][p] for p in (parent1, parent2) if p != NO_PARENT]
+            return CommitInfo(tree, parents, generation, timestamp)
+
+    # commits that are not in the graph yet are parsed from their object
+    commit = read_commit(repo_path, commit_hash)
+    if commit is None:
+        return None
+    return CommitInfo(commit["tree"], commit["parents"], None, commit_timestamp(commit["date"]))
+
+
+def add_to_commit_graph(repo_path, commit_hash):
+    # records are appended by position, so writers take turns; the lock is never renamed
+    with LockFile(commit_graph_path(repo_path)):
+        append_to_commit_graph(repo_path, commit_hash)
+
+
+def append_to_commit_graph(repo_path, commit_hash):
+    graph = load_commit_graph(repo_path)
+    positions = dict(graph["positions"]) if graph else {}
+    generations = {}
+
+    # collect every commit missing from the graph, then append parents before children
+    pending = []
+    stack = [commit_hash]
+    visiting = set()
+    while stack:
+        current = stack[-1]
+        if current in positions or current in generations:
+            stack.pop()
+            continue
+
+        commit = read_commit(repo_path, current)
+        if commit is None:
+            return
+        if len(commit["parents"]) > 2:
+            return
+
+        missing = [p for p in commit["parents"] if p not in positions and p not in generations]
+        if missing and current not in visiting:
+            visiting.add(current)
+            stack.extend(missing)
+            continue
+
+        stack.pop()
+        parent_generations = [
+            generations[p] if p in generations else graph["records"][positions[p]][3]
+            for p in commit["parents"]
+        ]
+        generations[current] = 1 + max(parent_generations, default=0)
+        pending.append((current, commit))
+        positions[current] = len(positions)
+
+    if not pending:
+        return
+
+    path = commit_graph_path(repo_path)
+    hash_size = len(bytes.fromhex(commit_hash))
+    end = 0
+    if graph:
+        end = COMMIT_GRAPH_HEADER.size + len(graph["hashes"]) * commit_graph_record_size(hash_size)
+    with open(path, "ab") as graph_file:
+        # a torn record left by an interrupted append is cut off first, since every record
+        # written after it would be read at the wrong offset
+        graph_file.truncate(end)
+        if end == 0:
+            graph_file.write(
+                COMMIT_GRAPH_HEADER.pack(COMMIT_GRAPH_SIGNATURE, COMMIT_GRAPH_VERSION, hash_size)
+            )
+        for current, commit in pending:
+            parent_positions = [positions[p] for p in commit["parents"]]
+            parent_positions += [NO_PARENT] * (2 - len(parent_positions))
+            graph_file.write(bytes.fromhex(current) + bytes.fromhex(commit["tree"]))
+            graph_file.write(
+                COMMIT_GRAPH_RECORD.pack(
+                    parent_positions[0],
+                    parent_positions[1],
+                    generations[current],
+                    commit_timestamp(commit["date"]),
+                )
+            )
+
+    # still under the commit-graph lock, which covers the filter file as well
+    with trace_span("commit.bloom_filters"):
+        append_bloom_filters(repo_path, [current for current, _ in pending])
+
+
+def is_ancestor(repo_path, ancestor, descendant):
+    target = commit_info(repo_path, ancestor)
+    if target is None:
+        return False
+
+    seen = set()
+    pending = [descendant]
+    while pending:
+        current = pending.pop()
+        if current == ancestor:
+            return True
+        if current in seen:
+            continue
+        seen.add(current)
+
+        info = commit_info(repo_path, current)
+        if info is None:
+            continue
+        # a commit can only reach commits with a strictly lower generation number
+        if (
+            info.generation is not None
+            and target.generation is not None
+            and info.generation <= target.generation
+        ):
+            continue
+        pending.extend(info.parents)
+    return False
+
+
+def merge_base(repo_path, commit_a, commit_b):
+    # paint both histories in generation order; the first commit painted by both wins
+    for commit_hash in (commit_a, commit_b):
+        add_to_commit_graph(repo_path, commit_hash)
+
+    if commit_a == commit_b:
+        return commit_a
+
+    infos = [commit_info(repo_path, c) for c in (commit_a, commit_b)]
+    if None in infos:
+        return None
+    # a commit the graph could not take has no generation number to order the walk by
+    if any(info.generation is None for info in infos):
+        return merge_base_by_walk(repo_path, commit_a, commit_b)
+
+    flags = {commit_a: 1, commit_b: 2}
+    pending = [(-info.generation, c) for info, c in zip(infos, (commit_a, commit_b))]
+    heapq.heapify(pending)
+    done = set()
+
+    while pending:
+        _, current = heapq.heappop(pending)
+        if current in done:
+            continue
+        done.add(current)
+
+        # every descendant has a higher generation, so this commit's flags are final
+        if flags[current] == 3:
+            return current
+
+        for parent in commit_info(repo_path, current).parents:
+            combined = flags.get(parent, 0) | flags[current]
+            if combined != flags.get(parent):
+                flags[parent] = combined
+                heapq.heappush(pending, (-commit_info(repo_path, parent).generation, parent))
+    return None
+
+
+def merge_base_by_walk(repo_path, commit_a, commit_b):
+    # every ancestor of commit_a, then the common ones reached first from commit_b; of
+    # those, one that is not itself an ancestor of another is the best base
+    ancestors_a = {commit_hash for commit_hash, _ in iter_commits(repo_path, commit_a)}
+    candidates = []
+    seen = set()
+    pending = [commit_b]
+    while pending:
+        current = pending.pop()
+        if current in seen:
+            continue
+        seen.add(current)
+        if current in ancestors_a:
+            candidates.append(current)
+            continue
+        info = commit_info(repo_path, current)
+        if info is not None:
+            pending.extend(info.parents)
+
+    for candidate in candidates:
+        if not any(other != candidate and is_ancestor(repo_path, candidate, other) for other in candidates):
+            return candidate
+    return None
+
+
+def list_ref_commits(repo_path):
+    repo = repository(repo_path)
+    commits = [value for _, value in repo.list_refs("refs/")]
+    commits.append(repo.current_commit())
+    return [commit_hash for commit_hash in commits if commit_hash]
+
+
+"_______Changed-Path Bloom Filters_______"
+
+
+# one filter per commit over the paths it changed against its first parent, so a
+# path-limited log only reads the trees of commits whose filter answers "maybe"
+BLOOM_SIGNATURE = b"TRKB"
+BLOOM_VERSION = 1
+BLOOM_HEADER = struct.Struct(">4sIBB")
+BLOOM_BITS_PER_PATH = 10
+BLOOM_HASHES = 7
+# past this many changed paths a commit gets no filter and is always compared by tree
+BLOOM_MAX_PATHS = 512
+BLOOM_NO_FILTER = 0xFFFF
+
+# loaded filters, keyed by repository and invalidated when the file grows
+_bloom_cache = {}
+
+
+def bloom_filter_path(repo_path):
+    return os.path.join(repo_path, "commit-bloom")
+
+
+def bloom_keys(paths):
+    # every leading directory goes in too, so "log -- src" finds changes below src/
+    keys = set()
+    for path in paths:
+        parts = path.rstrip("/").split("/")
+        keys.update("/".join(parts[: depth + 1]) for depth in range(len(parts)))
+    return keys
+
+
+def bloom_key_hash(key):
+    # two independent 32-bit hashes, combined into BLOOM_HASHES bit positions below
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+    return struct.unpack(">II", digest)
+
+
+def bloom_positions(key_hash, bit_count):
+    first, second = key_hash
+    return [(first + i * second) % bit_count for i in range(BLOOM_HASHES)]
+
+
+def build_bloom_filter(paths):
+    keys = bloom_keys(paths)
+    if len(keys) > BLOOM_MAX_PATHS:
+        return None
+    bits = bytearray((len(keys) * BLOOM_BITS_PER_PATH + 7) // 8)
+    for key in keys:
+        for position in bloom_positions(bloom_key_hash(key), len(bits) * 8):
+            bits[position >> 3] |= 1 << (position & 7)
+    return bytes(bits)
+
+
+def bloom_maybe_contains(bloom, key_hashes):
+    # False only when none of the keys can have been added; an empty filter holds nothing
+    if not bloom:
+        return False
+    bit_count = len(bloom) * 8
+    for key_hash in key_hashes:
+        positions = bloom_positions(key_hash, bit_count)
+        if all(bloom[position >> 3] & (1 << (position & 7)) for position in positions):
+            return True
+    return False
+
+
+def load_bloom_filters(repo_path):
+    # commit hash -> filter bytes, or None for a commit that changed too much to have one
+    return read_bloom_file(repo_path)[0]
+
+
+def read_bloom_file(repo_path):
+    # the filters and the end of the last complete record, where the next append goes
+    path = bloom_filter_path(repo_path)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return {}, 0
+    stamp = (stat.st_size, stat.st_mtime_ns)
+
+    cached = _bloom_cache.get(repo_path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+
+    with open(path, "rb") as bloom_file:
+        data = bloom_file.read()
+
+    if len(data) < BLOOM_HEADER.size:
+        return {}, 0
+    signature, version, hash_size, hashes = BLOOM_HEADER.unpack_from(data, 0)
+    if signature != BLOOM_SIGNATURE or version != BLOOM_VERSION or hashes != BLOOM_HASHES:
+        return {}, 0
+
+    filters = {}
+    pos = end = BLOOM_HEADER.size
+    # a torn trailing record from an interrupted append is ignored here and cut off by the next one
+    while pos + hash_size + 2 <= len(data):
+        commit_hash = data[pos : pos + hash_size].hex()
+        (length,) = struct.unpack_from(">H", data, pos + hash_size)
+        pos += hash_size + 2
+        if length == BLOOM_NO_FILTER:
+            filters[commit_hash] = None
+            end = pos
+            continue
+        if pos + length > len(data):
+            break
+        filters[commit_hash] = data[pos : pos + length]
+        pos = end = pos + length
+
+    _bloom_cache[repo_path] = (stamp, (filters, end))
+    return filters, end
+
+
+def append_bloom_filters(repo_path, commit_hashes):
+    # the caller holds the commit-graph lock
+    known, end = read_bloom_file(repo_path)
+    records = bytearray()
+    for commit_hash in commit_hashes:
+        if commit_hash in known:
+            continue
+        info = commit_info(repo_path, commit_hash)
+        if info is None:
+            continue
+        parent_tree = commit_tree_hash(repo_path, info.parents[0]) if info.parents else None
+        changes = tree_changes(repo_path, parent_tree, info.tree)
+        bloom = build_bloom_filter(path for path, _, _ in changes)
+        records += bytes.fromhex(commit_hash)
+        if bloom is None:
+            records += struct.pack(">H", BLOOM_NO_FILTER)
+        else:
+            records += struct.pack(">H", len(bloom)) + bloom
+    if not records:
+        return
+
+    with open(bloom_filter_path(repo_path), "ab") as bloom_file:
+        # records after a torn one would never parse, and their commits would be appended again
+        bloom_file.truncate(end)
+        if end == 0:
+            hash_size = len(bytes.fromhex(commit_hashes[0]))
+            bloom_file.write(BLOOM_HEADER.pack(BLOOM_SIGNATURE, BLOOM_VERSION, hash_size, BLOOM_HASHES))
+        bloom_file.write(records)
+
+
+"_______Writes the commit-graph for every commit reachable from a ref_______"
+
+
+def write_commit_graph():
+    repo_path = repository().path
+
+    if not os.path.exists(repo_path):
+        print(f"{Fore.RED}Not a trek repository!")
+        return False
+
+    for commit_hash in list_ref_commits(repo_path):
+        add_to_commit_graph(repo_path, commit_hash)
+
+    graph = load_commit_graph(repo_path)
+    # commits graphed before filters existed get theirs now
+    if graph:
+        with LockFile(commit_graph_path(repo_path)):
+            append_bloom_filters(repo_path, graph["hashes"])
+    count = len(graph["hashes"]) if graph else 0
+    print(f"{Fore.LIGHTGREEN_EX}Commit-graph holds {Fore.CYAN}{count}{Fore.LIGHTGREEN_EX} commits.")
+
+
+"_______Moves loose branches and tags into the sorted packed-refs file_______"
+
+
+def pack_refs():
+    repo = repository()
+    repo_path = repo.path
+
+    if not os.path.exists(repo_path):
+        print(f"{Fore.RED}Not a trek repository!")
+        return False
+
+    with LockFile(os.path.join(repo_path, "packed-refs")) as packed_lock:
+        repo.packed = None
+        loose = [(ref, repo.read_ref(ref)) for ref in repo.iter_loose_refs("refs/")]
+        # a branch without commits yet has nothing to pack
+        loose = [(ref, value) for ref, value in loose if value]
+        refs = dict(repo.iter_packed_refs())
+        refs.update(loose)
+        repo.write_packed_refs(refs.items(), packed_lock)
+
+    # loose files go only once packed-refs holds their value; a ref some other writer has
+    # locked is left loose rather than waited for; empty directories follow
+    for ref, value in loose:
+        ref_lock = LockFile(os.path.join(repo_path, ref), timeout=0)
+        if not ref_lock.acquire():
+            continue
+        with ref_lock:
+            repo.refs.pop(ref, None)
+            if repo.read_ref(ref) == value:
+                os.remove(os.path.join(repo_path, ref))
+                repo.refs.pop(ref, None)
+    for root, dirs, names in os.walk(os.path.join(repo_path, "refs"), topdown=False):
+        relative = normalize_path(os.path.relpath(root, repo_path))
+        if relative.count("/") > 1 and not os.listdir(root):
+            os.rmdir(root)
+
+    print(
+        f"{Fore.LIGHTGREEN_EX}Packed {Fore.CYAN}{len(loose)}{Fore.LIGHTGREEN_EX} refs "
+        f"({Fore.CYAN}{len(refs)}{Fore.LIGHTGREEN_EX} in packed-refs)."
+    )
+
+
+"_______Packfiles_______"
+
+
+PACK_SIGNATURE = b"TPCK"
+PACK_INDEX_SIGNATURE = b"TIDX"
+PACK_VERSION = 1
+PACK_TYPES = {"commit": 1, "tree": 2, "blob": 3, "chunked": 4}
+PACK_TYPE_NAMES = {code: name for name, code in PACK_TYPES.items()}
+PACK_DELTA = 7
+
+DELTA_BLOCK = 16
+DELTA_WINDOW = 4
+DELTA_MAX_DEPTH = 16
+DELTA_MAX_SIZE = 8 * 1024 * 1024
+
+# loaded pack indexes, keyed by repository and invalidated when the pack dir changes
+_pack_cache = {}
+_delta_base_cache = {}
+
+
+def encode_varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def decode_varint(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, pos
+
+
+def _match_length(a, a_pos, b, b_pos):
+    # compare in big slices first and only go byte by byte at the end of a match
+    length = 0
+    step = 4096
+    while step:
+        while (
+            a_pos + length + step <= len(a)
+            and b_pos + length + step <= len(b)
+            and a[a_pos + length : a_pos + length + step]
+            == b[b_pos + length : b_pos + length + step]
+        ):
+            length += step
+        step //= 8
+    return length
+
+
+def create_delta(base, target):
+    # delta ops: 0x00 <offset> <length> copies from the base, 0x01 <length> <bytes> inserts
+    block_index = {}
+    for pos in range(0, len(base) - DELTA_BLOCK + 1, DELTA_BLOCK):
+        block_index.setdefault(base[pos : pos + DELTA_BLOCK], pos)
+
+    delta = bytearray(encode_varint(len(base)) + encode_varint(len(target)))
+    literal_start = 0
+    pos = 0
+    last = len(target) - DELTA_BLOCK
+
+    while pos <= last:
+        base_pos = block_index.get(target[pos : pos + DELTA_BLOCK])
+        if base_pos is None:
+            pos += 1
+            continue
+
+        # grow the match backwards into the pending literal run
+        while pos > literal_start and base_pos > 0 and target[pos - 1] == base[base_pos - 1]:
+            pos -= 1
+            base_pos -= 1
+
+        length = DELTA_BLOCK + _match_length(
+            target, pos + DELTA_BLOCK, base, base_pos + DELTA_BLOCK
+        )
+
+        if pos > literal_start:
+            literal = target[literal_start:pos]
+            delta += b"\x01" + encode_varint(len(literal)) + literal
+        delta += b"\x00" + encode_varint(base_pos) + encode_varint(length)
+
+        pos += length
+        literal_start = pos
+
+    if literal_start < len(target):
+        literal = target[literal_start:]
+        delta += b"\x01" + encode_varint(len(literal)) + literal
+
+    return bytes(delta)
+
+
+def apply_delta(base, delta):
+    base_size, pos = decode_varint(delta, 0)
+    result_size, pos = decode_varint(delta, pos)
+    if base_size != len(base):
+        raise ValueError("Delta base size mismatch")
+
+    result = bytearray()
+    while pos < len(delta):
+        op = delta[pos]
+        pos += 1
+        if op == 0:
+            offset, pos = decode_varint(delta, pos)
+            length, pos = decode_varint(delta, pos)
+            result += base[offset : offset + length]
+        else:
+            length, pos = decode_varint(delta, pos)
+            result += delta[pos : pos + length]
+            pos += length
+
+    if len(result) != result_size:
+        raise ValueError("Delta result size mismatch")
+    return bytes(result)
+
+
+def pack_dir(repo_path):
+    return os.path.join(repo_path, "objects", "pack")
+
+
+def load_packs(repo_path):
+    directory = pack_dir(repo_path)
+    try:
+        stamp = os.stat(directory).st_mtime_ns
+    except FileNotFoundError:
+        return []
+
+    cached = _pack_cache.get(repo_path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+
+    packs = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".idx"):
+            continue
+        idx_path = os.path.join(directory, name)
+        with open(idx_path, "rb") as idx_file:
+            idx = idx_file.read()
+
+        signature, version, hash_size = struct.unpack_from(">4sIB", idx, 0)
+        if signature != PACK_INDEX_SIGNATURE or version != PACK_VERSION:
+            continue
+
+        fanout = struct.unpack_from(">256I", idx, 9)
+        with open(idx_path[:-4] + ".pack", "rb") as pack_file:
+            data = mmap.mmap(pack_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        count = fanout[255]
+        hashes_start = 9 + 256 * 4
+        packs.append(
+            {
+                "path": idx_path[:-4] + ".pack",
+                "idx": idx,
+                "data": data,
+                "count": count,
+                "hash_size": hash_size,
+                "fanout": fanout,
+                "hashes_start": hashes_start,
+                "offsets_start": hashes_start + count * hash_size,
+            }
+        )
+
+    _pack_cache[repo_path] = (stamp, packs)
+    return packs
+
+
+def _pack_lookup(pack, key):
+    # fan-out narrows the range to hashes sharing the first byte, then binary search
+    first = key[0]
+    low = pack["fanout"][first - 1] if first else 0
+    high = pack["fanout"][first]
+    size = pack["hash_size"]
+    idx = pack["idx"]
+    start = pack["hashes_start"]
+
+    while low < high:
+        mid = (low + high) // 2
+        candidate = idx[start + mid * size : start + (mid + 1) * size]
+        if candidate < key:
+            low = mid + 1
+        elif candidate > key:
+            high = mid
+        else:
+            return struct.unpack_from(">Q", idx, pack["offsets_start"] + mid * 8)[0]
+    return None
+
+
+def find_packed_object(repo_path, object_hash):
+    packs = load_packs(repo_path)
+    if not packs:
+        return None
+
+    try:
+        key = bytes.fromhex(object_hash)
+    except ValueError:
+        return None
+
+    for pack in packs:
+        if len(key) != pack["hash_size"]:
+            continue
+        offset = _pack_lookup(pack, key)
+        if offset is not None:
+            return pack, offset
+    return None
+
+
+def read_packed_object(pack, offset):
+    cache_key = (pack["path"], offset)
+    if cache_key in _delta_base_cache:
+        return _delta_base_cache[cache_key]
+
+    data = pack["data"]
+    code = data[offset]
+    size, pos = decode_varint(data, offset + 1)
+    base_offset = None
+    if code == PACK_DELTA:
+        distance, pos = decode_varint(data, pos)
+        base_offset = offset - distance
+    compressed_size, pos = decode_varint(data, pos)
+    content = zlib.decompress(data[pos : pos + compressed_size])
+    if len(content) != size:
+        raise ValueError(f"Corrupt pack entry at offset {offset}")
+
+    if base_offset is None:
+        result = PACK_TYPE_NAMES[code], content
+    else:
+        object_type, base = read_packed_object(pack, base_offset)
+        result = object_type, apply_delta(base, content)
+        # delta chains share bases, so keep a handful of them around
+        if len(_delta_base_cache) > 64:
+            _delta_base_cache.clear()
+        _delta_base_cache[cache_key] = result
+
+    return result
+
+
+def write_pack(repo_path, objects, count=None):
+    # objects is a list of (hash, type, content, delta_base_hash or None), bases first;
+    # any iterable works when its length is passed as count
+    directory = pack_dir(repo_path)
+    os.makedirs(directory, exist_ok=True)
+
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix="tmp-pack-")
+    checksum = new_hasher(repo_path)
+    offsets = {}
+    position = 0
+
+    with os.fdopen(fd, "wb") as pack_file:
+
+        def emit(chunk):
+            nonlocal position
+            pack_file.write(chunk)
+            checksum.update(chunk)
+            position += len(chunk)
+
+        emit(struct.pack(">4sII", PACK_SIGNATURE, PACK_VERSION, len(objects) if count is None else count))
+
+        for object_hash, object_type, content, base_hash in objects:
+            offsets[object_hash] = position
+            if base_hash is not None:
+                header = bytes([PACK_DELTA]) + encode_varint(len(content))
+                header += encode_varint(position - offsets[base_hash])
+            else:
+                header = bytes([PACK_TYPES[object_type]]) + encode_varint(len(content))
+            compressed = zlib.compress(content)
+            emit(header + encode_varint(len(compressed)) + compressed)
+
+        pack_file.write(checksum.digest())
+
+    pack_name = f"pack-{checksum.hexdigest()}"
+    pack_path = os.path.join(directory, pack_name + ".pack")
+    publish_file(temp_path, pack_path)
+
+    entries = sorted((bytes.fromhex(h), offset) for h, offset in offsets.items())
+    hash_size = checksum.digest_size
+    fanout = [0] * 256
+    for key, _ in entries:
+        fanout[key[0]] += 1
+    for i in range(1, 256):
+        fanout[i] += fanout[i - 1]
+
+    idx = bytearray(struct.pack(">4sIB", PACK_INDEX_SIGNATURE, PACK_VERSION, hash_size))
+    idx += struct.pack(">256I", *fanout)
+    for key, _ in entries:
+        idx += key
+    for _, offset in entries:
+        idx += struct.pack(">Q", offset)
+    idx += checksum.digest()
+
+    # the .idx is what makes a pack visible, so it is published last
+    fd, temp_idx = tempfile.mkstemp(dir=directory, prefix="tmp-idx-")
+    with os.fdopen(fd, "wb") as idx_file:
+        idx_file.write(idx)
+    publish_file(temp_idx, os.path.join(directory, pack_name + ".idx"))
+
+    return pack_path
+
+
+def iter_loose_objects(repo_path):
+    objects_path = os.path.join(repo_path, "objects")
+    hex_size = 2 * new_hasher(repo_path).digest_size
+    for name in os.listdir(objects_path):
+        path = os.path.join(objects_path, name)
+        if len(name) == 2 and os.path.isdir(path):
+            for rest in os.listdir(path):
+                if len(rest) == hex_size - 2:
+                    yield name + rest, os.path.join(path, rest)
+        elif len(name) == 40 and os.path.isfile(path):
+            yield name, path
+
+
+def iter_packed_objects(repo_path):
+    for pack in load_packs(repo_path):
+        size = pack["hash_size"]
+        start = pack["hashes_start"]
+        for i in range(pack["count"]):
+            yield pack["idx"][start + i * size : start + (i + 1) * size].hex()
+
+
+def collect_path_hints(repo_path):
+    # map blob hashes to the paths they were committed under so similar files sit together
+    hints = {}
+    seen = set()
+    seen_trees = set()
+    pending = list_ref_commits(repo_path)
+
+    while pending:
+        commit_hash = pending.pop()
+        if commit_hash in seen:
+            continue
+        seen.add(commit_hash)
+        info = commit_info(repo_path, commit_hash)
+        if info is None:
+            continue
+        for path, kind, object_hash in iter_tree(repo_path, info.tree, seen_trees):
+            if kind == TREE_FILE:
+                hints.setdefault(object_hash, path)
+        pending.extend(info.parents)
+    return hints
+
+
+def build_pack_entries(repo_path, object_hashes):
+    hints = collect_path_hints(repo_path)
+    objects = []
+    for object_hash in object_hashes:
+        # straight from disk, a repack would only flush the session cache
+        object_type, content = load_object(repo_path, object_hash)
+        if content is not None:
+            objects.append((object_hash, object_type, content))
+
+    # same-named blobs of similar size end up next to each other, largest first
+    def sort_key(item):
+        object_hash, object_type, content = item
+        path = hints.get(object_hash, "")
+        return (PACK_TYPES[object_type], os.path.basename(path), path, -len(content))
+
+    objects.sort(key=sort_key)
+
+    entries = []
+    depths = {}
+    window = []
+    for object_hash, object_type, content in objects:
+        best = None
+        if object_type == "blob" and 0 < len(content) <= DELTA_MAX_SIZE:
+            for base_hash, base_content in window:
+                if depths[base_hash] >= DELTA_MAX_DEPTH:
+                    continue
+                if len(base_content) > 2 * len(content) or len(content) > 2 * len(base_content):
+                    continue
+                delta = create_delta(base_content, content)
+                if len(delta) < len(content) // 2 and (best is None or len(delta) < len(best[1])):
+                    best = base_hash, delta
+
+        if best is None:
+            entries.append((object_hash, object_type, content, None))
+            depths[object_hash] = 0
+        else:
+            entries.append((object_hash, object_type, best[1], best[0]))
+            depths[object_hash] = depths[best[0]] + 1
+
+        if object_type == "blob":
+            window.append((object_hash, content))
+            if len(window) > DELTA_WINDOW:
+                window.pop(0)
+
+    return entries
+
+
+"_______Packs all objects into a single delta-compressed packfile_______"
+
+
+def repack():
+    repo_path = repository().path
+
+    if not os.path.exists(repo_path):
+        print(f"{Fore.RED}Not a trek repository!")
+        return False
+
+    loose = dict(iter_loose_objects(repo_path))
+    old_packs = [pack["path"] for pack in load_packs(repo_path)]
+    object_hashes = sorted(set(loose) | set(iter_packed_objects(repo_path)))
+
+    if not object_hashes:
+        print(f"{Fore.YELLOW}Nothing to pack.")
+        return
+
+    size_before = sum(os.path.getsize(path) for path in loose.values())
+    size_before += sum(os.path.getsize(path) for path in old_packs)
+
+    entries, size_after = pack_objects(repo_path, object_hashes, old_packs, loose.values())
+
+    deltas = sum(1 for entry in entries if entry[3] is not None)
+    print(
+        f"{Fore.LIGHTGREEN_EX}Packed {Fore.CYAN}{len(entries)}{Fore.LIGHTGREEN_EX} objects "
+        f"({Fore.CYAN}{deltas}{Fore.LIGHTGREEN_EX} deltas): "
+        f"{Fore.YELLOW}{size_before}{Fore.LIGHTGREEN_EX} -> {Fore.YELLOW}{size_after}{Fore.LIGHTGREEN_EX} bytes."
+    )
+
+
+def pack_objects(repo_path, object_hashes, old_packs, loose_paths):
+    # writes object_hashes into one new pack, then drops the packs and loose files it replaces
+    entries = build_pack_entries(repo_path, object_hashes) if object_hashes else []
+    pack_path = write_pack(repo_path, entries) if entries else None
+
+    for path in old_packs:
+        if path != pack_path:
+            os.remove(path)
+            os.remove(path[:-5] + ".idx")
+    for path in loose_paths:
+        os.remove(path)
+    objects_path = os.path.join(repo_path, "objects")
+    for name in os.listdir(objects_path):
+        path = os.path.join(objects_path, name)
+        if len(name) == 2 and os.path.isdir(path) and not os.listdir(path):
+            os.rmdir(path)
+    _pack_cache.pop(repo_path, None)
+    _delta_base_cache.clear()
+    return entries, os.path.getsize(pack_path) if pack_path else 0
+
+
+"_______Removes objects that nothing can reach any more_______"
+
+
+def gc_roots(repo_path):
+    # every commit a user can still get back to: refs, HEAD, a pending merge and undo/redo
+    repo = repository(repo_path)
+    commits = list_ref_commits(repo_path)
+    commits.append(repo.read_ref("MERGE_HEAD"))
+    commits.extend(undo_stack)
+    commits.extend(redo_stack)
+    return {commit_hash for commit_hash in commits if commit_hash}
+
+
+def mark_reachable(repo_path, workers=None):
+    reachable = set()
+    lock = threading.Lock()
+
+    def claim(object_hash):
+        # true for the one worker that gets to walk this object
+        with lock:
+            if object_hash in reachable:
+                return False
+            reachable.add(object_hash)
+            return True
+
+    # commits first; with a commit-graph this never opens a commit object
+    root_trees = []
+    pending = list(gc_roots(repo_path))
+    while pending:
+        commit_hash = pending.pop()
+        if not claim(commit_hash):
+            continue
+        info = commit_info(repo_path, commit_hash)
+        if info is None:
+            continue
+        root_trees.append(info.tree)
+        pending.extend(info.parents)
+
+    # the index may hold staged blobs and cached trees that no commit has yet
+    index = read_index(repo_path)
+    blobs = {entry.hash for entry in index.values()}
+    root_trees.extend(index.trees.values())
+
+    def walk_tree(tree_hash):
+        found = []
+        stack = [tree_hash]
+        while stack:
+            current = stack.pop()
+            if not current or not claim(current):
+                continue
+            # straight from disk, so marking does not flush the session cache
+            _, content = load_object(repo_path, current)
+            if content is None:
+                continue
+            for kind, object_hash in decode_tree(content).values():
+                if kind == TREE_DIR:
+                    stack.append(object_hash)
+                else:
+                    found.append(object_hash)
+        return found
+
+    def walk_blob(blob_hash):
+        # a chunked file also keeps every one of its chunks
+        if not claim(blob_hash) or object_type(repo_path, blob_hash) != "chunked":
+            return
+        _, content = load_object(repo_path, blob_hash)
+        for _, chunk_hash in decode_manifest(content):
+            claim(chunk_hash)
+
+    workers = workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for found in pool.map(walk_tree, root_trees):
+            blobs.update(found)
+        list(pool.map(walk_blob, blobs))
+    return reachable
+
+
+def gc(prune_expire=None, repack_survivors=False, workers=None):
+    repo_path = repository().path
+
+    if not os.path.exists(repo_path):
+        print(f"{Fore.RED}Not a trek repository!")
+        return False
+
+    if prune_expire is None:
+        prune_expire = config_int(repo_path, "gc.prune_expire")
+    cutoff = time.time() - prune_expire
+
+    with trace_span("gc.mark"):
+        reachable = mark_reachable(repo_path, workers)
+
+    removed = 0
+    reclaimed = 0
+
+    # loose objects are deleted one by one
+    with trace_span("gc.prune_loose"):
+        for object_hash, path in list(iter_loose_objects(repo_path)):
+            if object_hash in reachable:
+                continue
+            stat = os.stat(path)
+            if stat.st_mtime > cutoff:
+                continue
+            os.remove(path)
+            removed += 1
+            reclaimed += stat.st_size
+        objects_path = os.path.join(repo_path, "objects")
+        for name in os.listdir(objects_path):
+            path = os.path.join(objects_path, name)
+            if len(name) == 2 and os.path.isdir(path) and not os.listdir(path):
+                os.rmdir(path)
+
+    # packs only shrink when rewritten; packs younger than the grace period stay whole
+    packs = load_packs(repo_path)
+    old_packs = [pack["path"] for pack in packs if os.path.getmtime(pack["path"]) <= cutoff]
+    packed = {}
+    for pack in packs:
+        size = pack["hash_size"]
+        start = pack["hashes_start"]
+        for i in range(pack["count"]):
+            packed.setdefault(pack["idx"][start + i * size : start + (i + 1) * size].hex(), pack["path"])
+    dead = {h for h, path in packed.items() if path in old_packs and h not in reachable}
+
+    rewrite, loose_paths, survivors = [], [], set()
+    if repack_survivors:
+        # everything left, loose or packed, goes into one fresh pack
+        loose = dict(iter_loose_objects(repo_path))
+        rewrite = [pack["path"] for pack in packs]
+        loose_paths = list(loose.values())
+        survivors = set(loose) | (set(packed) - dead)
+    elif dead:
+        rewrite = old_packs
+        survivors = {h for h, path in packed.items() if path in old_packs} - dead
+
+    if rewrite or loose_paths:
+        with trace_span("gc.rewrite_packs"):
+            size_before = sum(os.path.getsize(path) for path in rewrite + loose_paths)
+            _, size_after = pack_objects(repo_path, sorted(survivors), rewrite, loose_paths)
+            removed += len(dead)
+            reclaimed += size_before - size_after
+
+    _delta_base_cache.clear()
+    repository(repo_path).objects.clear()
+
+    print(
+        f"{Fore.LIGHTGREEN_EX}Removed {Fore.CYAN}{removed}{Fore.LIGHTGREEN_EX} unreachable objects "
+        f"({Fore.CYAN}{len(reachable)}{Fore.LIGHTGREEN_EX} reachable), "
+        f"reclaimed {Fore.YELLOW}{reclaimed}{Fore.LIGHTGREEN_EX} bytes."
+    )
+
+
+"_______Initializes the .trek folder_______"
+
+
+def init(object_format="sha1"):
+    repo = repository()
+    repo_path = repo.path
+
+    if os.path.exists(repo_path):
+        print(f"{Fore.RED}Repository already exists!")
+        return False
+
+    if object_format not in OBJECT_FORMATS:
+        print(f"{Fore.RED}Object format must be one of {', '.join(OBJECT_FORMATS)}")
+        return False
+
+    os.makedirs(os.path.join(repo_path, "objects"))
+    os.makedirs(os.path.join(repo_path, "refs", "heads"))
+    os.makedirs(os.path.join(repo_path, "refs", "tags"))
+
+    repo.write_ref("refs/heads/master", "")
+    repo.write_ref("HEAD", "ref: refs/heads/master\n")
+    set_config_value(repo_path, "core.object_format", object_format)
+
+    with open(os.path.join(repo_path, ".gitignore"), "w") as ignore_file:
+        ignore_file.write("")
+
+    print(
+        f"{Fore.LIGHTGREEN_EX}Initialized {Fore.RED} empty {Fore.LIGHTGREEN_EX} repository with {Fore.YELLOW} master {Fore.LIGHTGREEN_EX} branch."
+    )
+
+
+"_______Adds Files to the Staging Area (Index)_______"
+
+
+def add(files, workers=None):
+    repo_path = repository().path
+    index_path = os.path.join(repo_path, "index")
+
+    if not os.path.exists(repo_path):
+        print(f"{Fore.RED}Not a trek repository!")
+        return False
+
+    index = read_index(repo_path)
+    with trace_span("add.expand_paths"):
+        candidates = monitor_candidates(repo_path)
+        files = expand_paths(files, candidates[0] if candidates else None)
+
+    def ingest(file):
+        stat = os.lstat(file)
+        trace_count("files_statted")
+        entry = index.get(file)
+        # unchanged stat data means unchanged content, so the file is not even opened
+        if entry is not None and stat_matches(entry, stat):
+            return file, entry
+        return file, index_entry(store_file(repo_path, file, stat.st_size), stat)
+
+    # hashlib and zlib release the GIL, so threads are enough to keep every core busy
+    workers = workers or os.cpu_count() or 1
+    with trace_span("add.hash_objects"):
+        if workers > 1 and len(files) > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(ingest, files))
+        else:
+            results = [ingest(file) for file in files]
+
+    # the objects are stored already, only merging the entries needs the lock; the index is
+    # read again under it so entries other writers added meanwhile are kept
+    with lock_index(repo_path) as lock:
+        index = read_index(repo_path)
+        # results come back in input order, so the index is the same whatever the timing
+        changed = False
+        for file, entry in results:
+            if index.get(file) != entry:
+                index[file] = entry
+                changed = True
+
+        if changed or not os.path.exists(index_path):
+            write_index(repo_path, index, lock)
+
+    print(
+        f"{Fore.LIGHTGREEN_EX}Added {Fore.CYAN} {len(files)} {Fore.LIGHTGREEN_EX} file(s) to the staging area."
+    )
+
+
+"_______Commits (Saves) those Changes_______"
+
+
+def commit(message, stage_all=False):
+    repo = repository()
+    repo_path = repo.path
+    index_path = os.path.join(repo_path, "index")
+
+    if not os.path.exists(repo_path):
+        print(f"{Fore.RED} Not a trek repository")
+        return False
+
+    if not os.path.exists(index_path):
+        print(f"{Fore.RED}Nothing to commit")
         return False
 
-    with open(ignore_path, "r") as ignore_file:
-        ignore_patterns = ignore_file.readlines()
+    # the index is locked while it is staged into trees, objects are written alongside
+    with lock_index(repo_path) as lock:
+        index = read_index(repo_path)
+
+        # -a stages every modified or deleted tracked file first
+        if stage_all:
+            candidates = monitor_candidates(repo_path)
+            paths = None if candidates is None else sorted(p for p in candidates[0] if p in index)
+            with trace_span("commit.stage_all"):
+                unstaged = unstaged_changes(repo_path, index, paths)
+                for state, path in unstaged:
+                    if state == "deleted":
+                        del index[path]
+                    else:
+                        stat = os.lstat(path)
+                        index[path] = index_entry(store_file(repo_path, path, stat.st_size), stat)
+            if unstaged:
+                write_index(repo_path, index, lock)
+
+        # If the index is empty, nothing to commit
+        if not index:
+            print(f"{Fore.RED}Nothing to commit")
+            return False
+
+        # only directories with staged changes are rebuilt, the rest come from the cached trees
+        cached_trees = dict(index.trees)
+        with trace_span("commit.write_tree"):
+            tree_hash = write_tree(
+                repo_path, {file: entry.hash for file, entry in index.items()}, index.trees
+            )
+        if index.trees != cached_trees:
+            write_index(repo_path, index, lock)
+
+        # a merge that stopped on conflicts is finished by this commit
+        merge_parent = repo.read_ref("MERGE_HEAD")
+        head_ref = repo.head_branch() or "HEAD"
+        current = repo.read_ref(head_ref)
+        parent_commit = current or None
+
+        # the index keeps every tracked file, so an unchanged tree means nothing was staged
+        if (
+            not merge_parent
+            and parent_commit
+            and commit_tree_hash(repo_path, parent_commit) == tree_hash
+        ):
+            print(f"{Fore.RED}Nothing to commit")
+            return False
+
+        parents = [parent_commit] if parent_commit else []
+        if merge_parent:
+            parents.append(merge_parent)
+        commit_hash = create_commit(repo_path, tree_hash, parents, message)
+
+        # the index stays locked until the branch has moved, so commits from this working
+        # tree take turns; a branch moved some other way (a push, a reset) is not committed
+        # on top of, since this tree would silently revert whatever that brought in
+        with trace_span("commit.update_ref"):
+            if not repo.update_ref(head_ref, commit_hash, current):
+                print(f"{Fore.RED}{head_ref} moved while committing; the index is unchanged, commit again.")
+                return False
 
-    ignore_patterns = [pattern.strip() for pattern in ignore_patterns]
+    # Save the commit in the undo stack
+    undo_stack.append(parent_commit or "")
 
-    for pattern in ignore_patterns:
-        if pattern and file_path.endswith(pattern):
-            return True
-    return False
+    if merge_parent:
+        repo.delete_ref("MERGE_HEAD")
 
+    with trace_span("commit.commit_graph"):
+        add_to_commit_graph(repo_path, commit_hash)
 
-def get_current_commit():
-    repo_path = os.path.join(os.getcwd(), ".trek")
-    head_path = os.path.join(repo_path, "HEAD")
-    with open(head_path, "r") as head_file:
-        head = head_file.read().strip()
-    if head.startswith("ref: "):
-        branch_path = os.path.join(repo_path, head[5:])
-        with open(branch_path, "r") as branch_file:
-            return branch_file.read().strip()
-    return head
+    print(f"{Fore.YELLOW}[{commit_hash[:7]}] {Fore.CYAN}{message}")
 
 
-"_______Initializes the .trek folder_______"
+"_______Shows the commit history as well as the changes made in those commits_______"
 
 
-def init():
-    repo_path = os.path.join(os.getcwd(), ".trek")
+DIFF_CACHE_SIZE = 256
+_diff_cache = OrderedDict()
 
-    if os.path.exists(repo_path):
-        print(f"{Fore.RED}Repository already exists!")
-        return
 
-    os.makedirs(os.path.join(repo_path, "objects"))
-    os.makedirs(os.path.join(repo_path, "refs", "heads"))
-    os.makedirs(os.path.join(repo_path, "refs", "tags"))
+def iter_commits(repo_path, start):
+    # newest first across all parents; only the commit-graph (or commit objects) is touched
+    seen = set()
+    pending = []
+    if start:
+        info = commit_info(repo_path, start)
+        if info is not None:
+            heapq.heappush(pending, (-info.timestamp, 0, start, info))
+    order = 1
 
-    master_branch_path = os.path.join(repo_path, "refs", "heads", "master")
-    with open(master_branch_path, "w") as master_file:
-        master_file.write("")
+    while pending:
+        _, _, commit_hash, info = heapq.heappop(pending)
+        if commit_hash in seen:
+            continue
+        seen.add(commit_hash)
+        yield commit_hash, info
+
+        for parent in info.parents:
+            if parent in seen:
+                continue
+            parent_info = commit_info(repo_path, parent)
+            if parent_info is None:
+                print(
+                    f"{Fore.RED}Error: Commit object{Fore.YELLOW} {parent}{Fore.RED} does not exist."
+                )
+                continue
+            heapq.heappush(pending, (-parent_info.timestamp, order, parent, parent_info))
+            order += 1
+
+
+def path_matches(path, paths):
+    return not paths or any(path == p or path.startswith(p.rstrip("/") + "/") for p in paths)
+
+
+def tree_changes(repo_path, old_tree, new_tree, paths=None):
+    if old_tree == new_tree:
+        return []
+    with trace_span("tree_diff"):
+        return compare_trees(repo_path, old_tree, new_tree, paths)
+
+
+def compare_trees(repo_path, old_tree, new_tree, paths):
+    roots = [read_object(repo_path, tree)[1] if tree else None for tree in (old_tree, new_tree)]
+    if not any(root is not None and is_legacy_tree(root) for root in roots):
+        return list(diff_trees(repo_path, old_tree, new_tree, paths))
+
+    # flat legacy trees cannot be compared directory by directory
+    old_entries = (read_tree(repo_path, old_tree) or {}) if old_tree else {}
+    new_entries = (read_tree(repo_path, new_tree) or {}) if new_tree else {}
+    changes = []
+    for path in sorted(set(old_entries) | set(new_entries)):
+        old_hash = old_entries.get(path)
+        new_hash = new_entries.get(path)
+        # equal hashes mean equal content, so those blobs are never read
+        if old_hash != new_hash and path_matches(path, paths):
+            changes.append((path, old_hash, new_hash))
+    return changes
+
+
+def touches_paths(repo_path, commit_hash, info, paths, key_hashes):
+    # a filter that rules every path out settles it without reading a single tree; a
+    # commit unchanged against its first parent is never shown, merge or not
+    bloom = load_bloom_filters(repo_path).get(commit_hash)
+    if bloom is not None:
+        if not bloom_maybe_contains(bloom, key_hashes):
+            trace_count("bloom_negatives")
+            return False
+        trace_count("bloom_maybes")
+    if not info.parents:
+        return bool(tree_changes(repo_path, None, info.tree, paths))
+    # a commit is only shown when it differs from every parent on the given paths
+    return all(
+        tree_changes(repo_path, commit_tree_hash(repo_path, parent), info.tree, paths)
+        for parent in info.parents
+    )
 
-    with open(os.path.join(repo_path, "HEAD"), "w") as head_file:
-        head_file.write("ref: refs/heads/master\n")
 
-    with open(os.path.join(repo_path, ".gitignore"), "w") as ignore_file:
-        ignore_file.write("")
+def blob_lines(repo_path, file_hash):
+    if not file_hash:
+        return []
+    content = read_blob(repo_path, file_hash)
+    return content.decode("utf-8", errors="replace").splitlines() if content is not None else []
 
-    print(
-        f"{Fore.LIGHTGREEN_EX}Initialized {Fore.RED} empty {Fore.LIGHTGREEN_EX} repository with {Fore.YELLOW} master {Fore.LIGHTGREEN_EX} branch."
-    )
+
+def blob_is_binary(repo_path, file_hash):
+    if not file_hash:
+        return False
+    # the first piece is enough to sniff, even for a chunked file
+    content = next(iter_blob(repo_path, file_hash), None)
+    return content is not None and line_diff.is_binary(content)
 
 
-"_______Adds Files to the Staging Area (Index)_______"
+def diff_blobs(repo_path, old_hash, new_hash):
+    # returns None for binary content, otherwise the opcodes; results are reused per pair
+    key = (old_hash, new_hash)
+    if key in _diff_cache:
+        _diff_cache.move_to_end(key)
+        return _diff_cache[key]
 
+    if blob_is_binary(repo_path, old_hash) or blob_is_binary(repo_path, new_hash):
+        opcodes = None
+    else:
+        old_lines = blob_lines(repo_path, old_hash)
+        new_lines = blob_lines(repo_path, new_hash)
+        with trace_span("line_diff"):
+            opcodes = line_diff.diff_lines(old_lines, new_lines)
 
-def add(files):
-    repo_path = os.path.join(os.getcwd(), ".trek")
-    index_path = os.path.join(repo_path, "index")
+    _diff_cache[key] = opcodes
+    if len(_diff_cache) > DIFF_CACHE_SIZE:
+        _diff_cache.popitem(last=False)
+    return opcodes
 
-    if not os.path.exists(repo_path):
-        print(f"{Fore.RED}Not a trek repository!")
+
+def format_diff(repo_path, path, old_hash, new_hash):
+    opcodes = diff_blobs(repo_path, old_hash, new_hash)
+    if opcodes is None:
+        yield f"{Fore.MAGENTA}Binary files a/{path} and b/{path} differ"
         return
 
-    index = {}
-    if os.path.exists(index_path):
-        with open(index_path, "r") as index_file:
-            index = json.load(index_file)
+    diff = line_diff.unified_diff(
+        blob_lines(repo_path, old_hash),
+        blob_lines(repo_path, new_hash),
+        opcodes,
+        fromfile=f"a/{path}" if old_hash else "/dev/null",
+        tofile=f"b/{path}" if new_hash else "/dev/null",
+    )
+    for line in diff:
+        if line.startswith("+++") or line.startswith("---"):
+            yield f"{Fore.WHITE}{line}"
+        elif line.startswith("-"):
+            yield f"{Fore.RED}{line}"
+        elif line.startswith("+"):
+            yield f"{Fore.LIGHTGREEN_EX}{line}"
+        else:
+            yield f"{Fore.CYAN}{line}"
 
-    for file in files:
-        if is_ignored(file):
-            print(
-                f"{Fore.YELLOW}File {Fore.LIGHTMAGENTA_EX}{file}{Fore.YELLOW} is ignored due to .gitignore"
-            )
-            continue
 
-        if not os.path.exists(file):
-            print(f"{Fore.RED}File {file} not found")
+def format_stat(repo_path, changes):
+    for path, old_hash, new_hash in changes:
+        opcodes = diff_blobs(repo_path, old_hash, new_hash)
+        if opcodes is None:
+            yield f" {Fore.YELLOW}{path} {Fore.WHITE}| {Fore.MAGENTA}binary"
             continue
+        added, removed = line_diff.count_changes(opcodes)
+        yield (
+            f" {Fore.YELLOW}{path} {Fore.WHITE}| "
+            f"{Fore.LIGHTGREEN_EX}{'+' * min(added, 40)}{Fore.RED}{'-' * min(removed, 40)}"
+            f" {Fore.WHITE}({added} insertions, {removed} deletions)"
+        )
+    yield f" {Fore.CYAN}{len(changes)} file(s) changed"
 
-        with open(file, "rb") as f:
-            content = f.read()
-            file_hash = hashlib.sha1(content).hexdigest()
-            object_path = os.path.join(repo_path, "objects", file_hash)
-            if not os.path.exists(object_path):
-                with open(object_path, "wb") as object_file:
-                    object_file.write(content)
-
-            index[file] = file_hash
 
-    with open(index_path, "w") as index_file:
-        json.dump(index, index_file, indent=2)
+def format_commit(repo_path, commit_hash, info, oneline=False, stat=False, patch=False, paths=None):
+    commit = read_commit(repo_path, commit_hash)
+    message = commit["message"].strip()
 
-    print(
-        f"{Fore.LIGHTGREEN_EX}Added {Fore.CYAN} {len(files)} {Fore.LIGHTGREEN_EX} file(s) to the staging area."
-    )
+    if oneline:
+        yield f"{Fore.YELLOW}{commit_hash[:7]} {Fore.WHITE}{message.splitlines()[0] if message else ''}"
+    else:
+        yield f"\n{Fore.YELLOW}commit {commit_hash}"
+        if len(info.parents) > 1:
+            yield f"{Fore.CYAN}Merge: {' '.join(parent[:7] for parent in info.parents)}"
+        yield f"{Fore.CYAN}Author: {Fore.WHITE}{commit['author']}"
+        yield f"{Fore.CYAN}Date:   {Fore.WHITE}{commit['date']}\n"
+        for line in message.splitlines():
+            yield f"    {Fore.WHITE}{line}"
+
+    if not stat and not patch:
+        return
 
+    # diffs are shown against the first parent only
+    parent_tree = commit_tree_hash(repo_path, info.parents[0]) if info.parents else None
+    changes = tree_changes(repo_path, parent_tree, info.tree, paths)
+    if stat:
+        yield from format_stat(repo_path, changes)
+    if patch:
+        for path, old_hash, new_hash in changes:
+            yield from format_diff(repo_path, path, old_hash, new_hash)
+
+
+def parse_log_args(args):
+    options = {"max_count": None, "skip": 0, "oneline": False, "stat": False, "patch": False, "paths": []}
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == "-n":
+            options["max_count"] = option_value(args, i, int)
+            i += 1
+        elif arg.startswith("-n") and arg[2:].isdigit():
+            options["max_count"] = int(arg[2:])
+        elif arg == "--skip":
+            options["skip"] = option_value(args, i, int)
+            i += 1
+        elif arg == "--oneline":
+            options["oneline"] = True
+        elif arg == "--stat":
+            options["stat"] = True
+        elif arg in ("--patch", "-p"):
+            options["patch"] = True
+        elif arg == "--":
+            options["paths"].extend(normalize_path(path) for path in args[i + 1 :])
+            break
+        else:
+            options["paths"].append(normalize_path(arg))
+        i += 1
+    return options
 
-"_______Commits (Saves) those Changes_______"
 
+def log(max_count=None, skip=0, oneline=False, stat=False, patch=False, paths=None):
+    repo_path = repository().path
+    if not os.path.exists(repo_path):
+        print(f"{Fore.RED}Not a trek repository!")
+        return False
 
-def commit(message):
-    repo_path = os.path.join(os.getcwd(), ".trek")
-    index_path = os.path.join(repo_path, "index")
+    current_commit = get_current_commit()
+    if current_commit and not object_exists(repo_path, current_commit):
+        print(
+            f"{Fore.RED}Error: Commit object{Fore.YELLOW} {current_commit}{Fore.RED} does not exist."
+        )
+        return False
 
-    if not os.path.exists(repo_path):
-        print(f"{Fore.RED} Not a trek repository")
-        return
+    # "." is the repository root, which limits nothing
+    if paths and "." in paths:
+        paths = []
+
+    # each stage is lazy, so output starts with the first commit instead of after the last
+    commits = iter_commits(repo_path, current_commit)
+    if paths:
+        key_hashes = [bloom_key_hash(path.rstrip("/")) for path in paths]
+        commits = (
+            (commit_hash, info)
+            for commit_hash, info in commits
+            if touches_paths(repo_path, commit_hash, info, paths, key_hashes)
+        )
+    commits = itertools.islice(commits, skip, None if max_count is None else skip + max_count)
 
-    if not os.path.exists(index_path):
-        print(f"{Fore.RED}Nothing to commit")
-        return
+    for commit_hash, info in commits:
+        for line in format_commit(repo_path, commit_hash, info, oneline, stat, patch, paths):
+            with trace_span("log.print"):
+                print(line, flush=True)
 
-    # Loading the staged index
-    with open(index_path, "r") as index_file:
-        index = json.load(index_file)
+    if not oneline:
+        print(f"{Fore.CYAN}End of branch history.")
 
-    # If the index is empty, nothing to commit
-    if not index:
-        print(f"{Fore.RED}Nothing to commit")
-        return
 
-    # Get the current commit (HEAD) from the repository
-    head_path = os.path.join(repo_path, "HEAD")
-    with open(head_path, "r") as head_file:
-        head = head_file.read().strip()
-
-    parent_commit = None
-    if head.startswith("ref: "):  # If HEAD points to a branch
-        branch_path = os.path.join(repo_path, head[5:])
-        if os.path.exists(branch_path):
-            with open(branch_path, "r") as branch_file:
-                parent_commit = branch_file.read().strip()
-
-    # Preparing list of files and their hashes
-    tree_content = "\n".join(
-        [f"{file_hash} {file}" for file, file_hash in index.items()]
-    )
-    tree_hash = hashlib.sha1(tree_content.encode("utf-8")).hexdigest()
-    tree_path = os.path.join(repo_path, "objects", tree_hash)
+"_______Shows the differences between two commits_______"
 
-    if not os.path.exists(tree_path):
-        os.makedirs(os.path.dirname(tree_path), exist_ok=True)
-        with open(tree_path, "w") as tree_file:
-            tree_file.write(tree_content)
 
-    # commit object
-    commit_content = f"tree {tree_hash}\n"
-    if parent_commit:
-        commit_content += f"parent {parent_commit}\n"
-    commit_content += f"author User <user@example.com>\n"
-    commit_content += (
-        f"date {datetime.now().strftime('%a %b %d %H:%M:%S %Y')}\n\n{message}\n"
-    )
-    commit_hash = hashlib.sha1(commit_content.encode("utf-8")).hexdigest()
+def resolve_commit(repo_path, name):
+    repo = repository(repo_path)
+    if name == "HEAD":
+        return repo.current_commit()
 
-    commit_path = os.path.join(repo_path, "objects", commit_hash)
-    if not os.path.exists(commit_path):
-        os.makedirs(os.path.dirname(commit_path), exist_ok=True)
-        with open(commit_path, "w") as commit_file:
-            commit_file.write(commit_content)
+    for ref in (f"refs/heads/{name}", f"refs/tags/{name}"):
+        commit_hash = repo.read_ref(ref)
+        if commit_hash:
+            return commit_hash
 
-    # Save the commit in the undo stack
-    undo_stack.append(get_current_commit())
+    if object_exists(repo_path, name):
+        return name
 
-    # Update the branch reference to point to the new commit
-    if head.startswith("ref: "):
-        branch_path = os.path.join(repo_path, head[5:])
-        with open(branch_path, "w") as branch_file:
-            branch_file.write(commit_hash)
-    else:
-        with open(head_path, "w") as head_file:
-            head_file.write(commit_hash)
+    # abbreviated hashes, as printed by log --oneline
+    if len(name) >= 4:
+        matches = {
+            object_hash
+            for object_hash in itertools.chain(
+                (h for h, _ in iter_loose_objects(repo_path)), iter_packed_objects(repo_path)
+            )
+            if object_hash.startswith(name)
+        }
+        if len(matches) == 1:
+            return matches.pop()
+    return None
 
-    # Clear the index
-    with open(index_path, "w") as index_file:
-        json.dump({}, index_file)
 
-    print(f"{Fore.YELLOW}[{commit_hash[:7]}] {Fore.CYAN}{message}")
+def diff(commit_a, commit_b, stat=False):
+    repo_path = repository().path
+    if not os.path.exists(repo_path):
+        print(f"{Fore.RED}Not a trek repository!")
+        return False
 
+    trees = []
+    for name in (commit_a, commit_b):
+        commit_hash = resolve_commit(repo_path, name)
+        info = commit_info(repo_path, commit_hash) if commit_hash else None
+        if info is None:
+            print(f"{Fore.RED}Commit {Fore.YELLOW}{name}{Fore.RED} not found")
+            return False
+        trees.append(info.tree)
+
+    changes = tree_changes(repo_path, trees[0], trees[1])
+    if stat:
+        lines = format_stat(repo_path, changes)
+    else:
+        lines = itertools.chain.from_iterable(
+            format_diff(repo_path, path, old_hash, new_hash)
+            for path, old_hash, new_hash in changes
+        )
+    for line in lines:
+        print(line, flush=True)
+
+
+"_______Filesystem Monitor_______"
+
+
+# inotify constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+INOTIFY_EVENT = struct.Struct("iIII")
+INOTIFY_WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+    | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+)
+
+# the running watcher, if any; it lives as long as the REPL session
+_monitor = None
+
+
+def load_inotify():
+    # inotify is Linux-only; anywhere else the caller falls back to scanning
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class FsMonitor:
+    # keeps every path that may differ from the index; paths leave the set once a scan
+    # finds them clean, so later queries only look at what was touched since
+    def __init__(self, root, repo_path, libc):
+        self.root = root
+        self.repo_path = repo_path
+        self.libc = libc
+        self.lock = threading.Lock()
+        self.dirty = {}
+        self.sequence = 0
+        self.watches = {}
+        self.stale = False
+        self.fd = None
+        self.thread = None
+
+    def start(self):
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.wake_read, self.wake_write = os.pipe()
+        self.ignored = get_ignore_matcher(self.repo_path)
+
+        # directories holding tracked files are watched even when ignored
+        index = read_index(self.repo_path)
+        tracked_dirs = {""}
+        for path in index:
+            while "/" in path:
+                path = path.rsplit("/", 1)[0]
+                tracked_dirs.add(path)
+
+        self.watch_tree("", tracked_dirs)
+        # watches go in before seeding, so nothing changed in between is missed
+        self.mark(index)
+        self.thread = threading.Thread(target=self.read_events, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            os.write(self.wake_write, b"\0")
+            self.thread.join()
+            self.thread = None
+        for fd in (self.fd, getattr(self, "wake_read", None), getattr(self, "wake_write", None)):
+            if fd is not None:
+                os.close(fd)
+        self.fd = None
+        self.watches.clear()
+
+    def restart(self):
+        self.stop()
+        with self.lock:
+            self.dirty.clear()
+            self.stale = False
+        self.start()
+
+    def add_watch(self, directory):
+        path = os.path.join(self.root, directory) if directory else self.root
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), INOTIFY_WATCH_MASK)
+        if wd >= 0:
+            self.watches[wd] = directory
+
+    def watch_tree(self, directory, tracked_dirs=()):
+        # watch `directory` and everything below it, marking the files found as dirty
+        self.add_watch(directory)
+        base = os.path.join(self.root, directory) if directory else self.root
+        found = []
+        for root, dirs, names in os.walk(base):
+            relative = normalize_path(os.path.relpath(root, self.root))
+            prefix = "" if relative == "." else relative + "/"
+            dirs[:] = [
+                d
+                for d in dirs
+                if d != ".trek"
+                and (prefix + d in tracked_dirs or not self.ignored(prefix + d, is_dir=True))
+            ]
+            for d in dirs:
+                self.add_watch(prefix + d)
+            found.extend(prefix + name for name in names)
+        self.mark(found)
+
+    def mark(self, paths):
+        with self.lock:
+            for path in paths:
+                self.sequence += 1
+                self.dirty[path] = self.sequence
+
+    def handle(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            self.stale = True
+            return
+        if mask & IN_IGNORED:
+            self.watches.pop(wd, None)
+            return
+        directory = self.watches.get(wd)
+        if directory is None:
+            return
+        if mask & IN_MOVE_SELF and not directory:
+            self.stale = True
+            return
+        if not name:
+            return
+        path = f"{directory}/{name}" if directory else name
+        if path == ".trek":
+            return
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                if not self.ignored(path, is_dir=True):
+                    self.watch_tree(path)
+            elif mask & IN_MOVED_FROM:
+                # the files inside left without events of their own
+                self.stale = True
+            return
+        self.mark([path])
+
+    def read_events(self):
+        while True:
+            readable, _, _ = select.select([self.fd, self.wake_read], [], [])
+            if self.wake_read in readable:
+                return
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+                offset += length
+                self.handle(wd, mask, name)
+
+    def changes(self):
+        # (dirty paths, sequence) or None when the set can no longer be trusted
+        if self.stale or self.ignored is not get_ignore_matcher(self.repo_path):
+            self.restart()
+            return None
+        with self.lock:
+            return set(self.dirty), self.sequence
+
+    def settle(self, paths, sequence):
+        # paths touched again after `sequence` stay dirty
+        with self.lock:
+            for path in paths:
+                if self.dirty.get(path, sequence + 1) <= sequence:
+                    del self.dirty[path]
+
+
+def monitor_candidates(repo_path):
+    # the watcher only answers for the tree it was started in
+    if _monitor is None or _monitor.root != os.getcwd():
+        return None
+    return _monitor.changes()
 
-"_______Shows the commit history as well as the changes made in those commits_______"
 
+def fsmonitor(action="start"):
+    global _monitor
+    repo_path = repository().path
 
-def log():
-    repo_path = os.path.join(os.getcwd(), ".trek")
     if not os.path.exists(repo_path):
         print(f"{Fore.RED}Not a trek repository!")
-        return
+        return False
 
-    # get current branch from HEAD
-    head_path = os.path.join(repo_path, "HEAD")
-    with open(head_path, "r") as head_file:
-        head = head_file.read().strip()
+    if _monitor is not None:
+        _monitor.stop()
+        _monitor = None
+        if action == "stop":
+            print(f"{Fore.LIGHTGREEN_EX}Filesystem monitor stopped.")
+            return
+    if action == "stop":
+        print(f"{Fore.YELLOW}Filesystem monitor is not running.")
+        return
 
-    # If HEAD points to a branch, retrieve the commit hash from the branch file
-    current_commit = head
-    if head.startswith("ref: "):
-        branch_path = os.path.join(repo_path, head[5:])
-        with open(branch_path, "r") as branch_file:
-            current_commit = branch_file.read().strip()
+    libc = load_inotify()
+    if libc is None:
+        print(f"{Fore.YELLOW}inotify is not available here, status will scan the working tree.")
+        return
 
-    prev_commit_hashes = {}
+    monitor = FsMonitor(os.getcwd(), repo_path, libc)
+    try:
+        monitor.start()
+    except OSError as error:
+        monitor.stop()
+        print(f"{Fore.RED}Could not start the filesystem monitor: {error}")
+        return False
+    _monitor = monitor
+    print(
+        f"{Fore.LIGHTGREEN_EX}Filesystem monitor watching {Fore.CYAN}{len(monitor.watches)}{Fore.LIGHTGREEN_EX} directories."
+    )
 
-    while current_commit:
-        commit_path = os.path.join(repo_path, "objects", current_commit)
 
-        if not os.path.exists(commit_path):
-            print(
-                f"{Fore.RED}Error: Commit object{Fore.YELLOW} {current_commit}{Fore.RED} does not exist."
-            )
-            break
+"_______Shows staged, modified and untracked files_______"
+
+
+def staged_changes(repo_path, index):
+    # staged changes are differences between the index and the last commit
+    head_commit = get_current_commit()
+    head_tree = {}
+    if head_commit:
+        head_tree = read_tree(repo_path, commit_tree_hash(repo_path, head_commit)) or {}
+
+    staged = []
+    for path in sorted(set(index) | set(head_tree)):
+        if path not in head_tree:
+            staged.append(("new file", path))
+        elif path not in index:
+            staged.append(("deleted", path))
+        elif index[path].hash != head_tree[path]:
+            staged.append(("modified", path))
+    return staged
+
+
+def unstaged_changes(repo_path, index, paths=None):
+    # only files whose stat data no longer matches the index are read
+    unstaged = []
+    refreshed = False
+    entries = index.items() if paths is None else ((path, index[path]) for path in paths)
+    for path, entry in entries:
+        trace_count("files_statted")
+        try:
+            stat = os.lstat(path)
+        except FileNotFoundError:
+            unstaged.append(("deleted", path))
+            continue
+        if stat_matches(entry, stat):
+            continue
+        if hash_file(repo_path, path) != entry.hash:
+            unstaged.append(("modified", path))
+        else:
+            index[path] = index_entry(entry.hash, stat)
+            refreshed = True
+
+    if refreshed:
+        refresh_index(repo_path, index)
+    return sorted(unstaged, key=lambda change: change[1])
+
+
+def working_tree_changes(repo_path, index):
+    # asks the filesystem monitor what was touched, walking the whole tree only without one
+    ignored = get_ignore_matcher(repo_path)
+    candidates = monitor_candidates(repo_path)
+    if candidates is None:
+        unstaged = unstaged_changes(repo_path, index)
+        untracked = [path for path in walk_files(".", ignored) if path not in index]
+        return unstaged, untracked
+
+    paths, sequence = candidates
+    unstaged = unstaged_changes(repo_path, index, sorted(path for path in paths if path in index))
+    untracked = sorted(
+        path
+        for path in paths
+        if path not in index
+        and (os.path.isfile(path) or os.path.islink(path))
+        and not ignored(path)
+    )
+    # whatever matched the index (or vanished, or is ignored) needs no look next time
+    _monitor.settle(paths - {path for _, path in unstaged} - set(untracked), sequence)
+    return unstaged, untracked
 
-        with open(commit_path, "r") as commit_file:
-            commit_content = commit_file.read()
 
-        # Get the tree hash from the commit content
-        tree_hash = commit_content.split("\n")[0].split(" ")[1]
+def status():
+    repo_path = repository().path
 
-        # Retrieve the tree object based on the tree hash
-        tree_path = os.path.join(repo_path, "objects", tree_hash)
-        if not os.path.exists(tree_path):
-            print(
-                f"{Fore.RED}Error: Tree object {Fore.YELLOW} {tree_hash} {Fore.RED}does not exist."
-            )
-            break
+    if not os.path.exists(repo_path):
+        print(f"{Fore.RED}Not a trek repository!")
+        return False
 
-        with open(tree_path, "r") as tree_file:
-            tree_content = tree_file.read().strip().split("\n")
-
-        print(f"\n{Fore.CYAN}Commit: {Fore.YELLOW}{current_commit}")
-        print(f"{Fore.WHITE}{commit_content}")
-        print(f"{Fore.CYAN}Files in this commit:")
-
-        current_commit_files = {}
-
-        for line in tree_content:
-            file_hash, file_name = line.split(" ")
-            current_commit_files[file_name] = file_hash
-            print(f"  {Fore.YELLOW}{file_name} {Fore.CYAN}(hash: {file_hash})")
-
-            # Retrieve the file content
-            file_path = os.path.join(repo_path, "objects", file_hash)
-            if os.path.exists(file_path):
-                with open(file_path, "r") as file:
-                    file_content = file.read()
-                    print(f"{Fore.CYAN}Content: {Fore.WHITE}{file_content[:30]}")
-
-            # Compare with previous commit and show differences
-            if prev_commit_hashes:
-                if file_name in prev_commit_hashes:
-                    prev_file_hash = prev_commit_hashes[file_name]
-                    prev_file_path = os.path.join(repo_path, "objects", prev_file_hash)
-
-                    if os.path.exists(prev_file_path):
-                        with open(prev_file_path, "r") as prev_file:
-                            prev_file_content = prev_file.read()
-
-                        # Compare the content of the current and previous file
-                        current_file_path = os.path.join(
-                            repo_path, "objects", file_hash
-                        )
-                        with open(current_file_path, "r") as current_file:
-                            current_file_content = current_file.read()
-
-                        # Show diff if contents are different
-                        if prev_file_content != current_file_content:
-                            diff = difflib.unified_diff(
-                                prev_file_content.splitlines(),
-                                current_file_content.splitlines(),
-                                fromfile=f"{file_name} (previous)",
-                                tofile=f"{file_name} (current)",
-                            )
-
-                            print(f"{Fore.MAGENTA}Diff for {file_name}:")
-                            for line in diff:
-                                if line.startswith("-"):
-                                    print(f"{Fore.RED}{line}")
-                                elif line.startswith("+"):
-                                    print(f"{Fore.LIGHTGREEN_EX}{line}")
-                                else:
-                                    print(f"{Fore.CYAN}{line}")
+    index = read_index(repo_path)
+    staged = staged_changes(repo_path, index)
+    unstaged, untracked = working_tree_changes(repo_path, index)
+
+    if staged:
+        print(f"{Fore.CYAN}Changes to be committed:")
+        for state, path in staged:
+            print(f"  {Fore.LIGHTGREEN_EX}{state}: {path}")
+    if unstaged:
+        print(f"{Fore.CYAN}Changes not staged for commit:")
+        for state, path in unstaged:
+            print(f"  {Fore.RED}{state}: {path}")
+    if untracked:
+        print(f"{Fore.CYAN}Untracked files:")
+        for path in untracked:
+            print(f"  {Fore.RED}{path}")
+    if not staged and not unstaged and not untracked:
+        print(f"{Fore.LIGHTGREEN_EX}Nothing to commit, working tree clean.")
 
-                    else:
-                        print(
-                            f"{Fore.RED}Warning: Previous file {file_name} does not exist in previous commit."
-                        )
-                else:
-                    print(f"{Fore.LIGHTGREEN_EX}Added file: {file_name}")
-
-            # Check for files that were removed
-            if (
-                file_name not in current_commit_files
-                and file_name in prev_commit_hashes
-            ):
-                print(f"{Fore.RED}Removed file: {file_name}")
-
-        prev_commit_hashes = current_commit_files
-
-        # Move to the parent commit
-        parent_commit = None
-        for line in commit_content.split("\n"):
-            if line.startswith("parent "):
-                parent_commit = line.split(" ")[1]
-                break
 
-        current_commit = parent_commit
+"_______Shows All the Branches and if a Name is Specified, Creates a Branch with that Name and Switches to it_______"
 
-    print(f"{Fore.CYAN}End of branch history.")
 
+def parse_ref_list_args(args):
+    options = {"prefix": "", "max_count": None, "skip": 0}
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == "-n":
+            options["max_count"] = option_value(args, i, int)
+            i += 1
+        elif arg == "--skip":
+            options["skip"] = option_value(args, i, int)
+            i += 1
+        elif arg.startswith("-") and arg != "--list":
+            raise ValueError(f"Unknown option {arg}")
+        elif arg != "--list":
+            options["prefix"] = arg
+        i += 1
+    return options
+
+
+def valid_ref_name(name):
+    # a leading "-" reads as an option, ".lock" is where ref locks live, ".." escapes refs/
+    return bool(name) and not name.startswith("-") and not name.endswith(".lock") and ".." not in name
+
+
+def print_refs(repo, namespace, title, prefix="", max_count=None, skip=0, current=None):
+    # refs come back sorted from packed-refs and the loose files, so a page is a slice
+    refs = repo.list_refs(namespace + prefix)
+    if not refs:
+        print(f"{Fore.RED}No {title.lower()} found.")
+        return
 
-"_______Shows All the Branches and if a Name is Specified, Creates a Branch with that Name and Switches to it_______"
+    end = len(refs) if max_count is None else min(len(refs), skip + max_count)
+    print(f"{Fore.CYAN}{title}:")
+    for ref, _ in refs[skip:end]:
+        marker = "*" if ref == current else " "
+        print(f" {Fore.LIGHTGREEN_EX}{marker} {Fore.YELLOW}{ref[len(namespace):]}")
+    if skip or end < len(refs):
+        print(f"{Fore.CYAN}({skip + 1}-{end} of {len(refs)}, use --skip {end} for more)")
 
 
-def branch(name=None):
-    repo_path = os.path.join(os.getcwd(), ".trek")
+def branch(name=None, prefix="", max_count=None, skip=0):
+    repo = repository()
+    repo_path = repo.path
 
     if not os.path.exists(repo_path):
         print(f"{Fore.RED}Not a trek repository!")
-        return
-
-    branches_path = os.path.join(repo_path, "refs", "heads")
+        return False
 
     if name is None:
-        branches = os.listdir(branches_path)
-        if branches:
-            print(f"{Fore.CYAN}Branches:")
-            for branch in branches:
-                print(f"  {Fore.YELLOW}{branch}")
-        else:
-            print(f"{Fore.RED}No branches found.")
+        print_refs(repo, "refs/heads/", "Branches", prefix, max_count, skip, repo.head_branch())
         return
 
-    head_path = os.path.join(repo_path, "HEAD")
-    with open(head_path, "r") as head_file:
-        head = head_file.read().strip()
-
-    current_commit = ""
-    if head.startswith("ref: "):
-        current_branch_path = os.path.join(repo_path, head[5:])
-        with open(current_branch_path, "r") as current_branch_file:
-            current_commit = current_branch_file.read().strip()
-    else:
-        current_commit = head
+    current_commit = repo.current_commit()
 
-    new_branch_path = os.path.join(branches_path, name)
-    if os.path.exists(new_branch_path):
-        with open(head_path, "w") as head_file:
-            head_file.write(f"ref: refs/heads/{name}")
-        print(f"{Fore.LIGHTGREEN_EX}Switched to branch {Fore.YELLOW} '{name}'")
-        return
+    # an existing branch is switched to like checkout does, working tree and index included
+    if repo.ref_exists(f"refs/heads/{name}"):
+        return checkout_branch(name)
 
-    with open(new_branch_path, "w") as branch_file:
-        branch_file.write(current_commit)
+    if not valid_ref_name(name):
+        print(f"{Fore.YELLOW}'{name}'{Fore.RED} is not a valid branch name.")
+        return False
 
-    with open(head_path, "w") as head_file:
-        head_file.write(f"ref: refs/heads/{name}")
+    # created only if no other writer made the same branch in the meantime
+    if not repo.update_ref(f"refs/heads/{name}", current_commit, None):
+        print(f"{Fore.RED}Branch {Fore.YELLOW}'{name}'{Fore.RED} was just created elsewhere.")
+        return False
+    repo.write_ref("HEAD", f"ref: refs/heads/{name}")
 
     print(
         f"{Fore.LIGHTGREEN_EX}Created and switched to new branch {Fore.YELLOW} '{name}'"
     )
 
 
-"_______Shifts the HEAD to the specified branch_______"
+"_______Shows All the Tags and if a Name is Specified, Tags the Current Commit with that Name_______"
 
 
-def checkout_branch(branch_name):
-    repo_path = os.path.join(os.getcwd(), ".trek")
+def tag(name=None, prefix="", max_count=None, skip=0):
+    repo = repository()
+    repo_path = repo.path
 
     if not os.path.exists(repo_path):
         print(f"{Fore.RED}Not a trek repository!")
+        return False
+
+    if name is None:
+        print_refs(repo, "refs/tags/", "Tags", prefix, max_count, skip)
         return
 
-    branches_path = os.path.join(repo_path, "refs", "heads")
-    branch_path = os.path.join(branches_path, branch_name)
+    if not valid_ref_name(name):
+        print(f"{Fore.YELLOW}'{name}'{Fore.RED} is not a valid tag name.")
+        return False
+
+    if repo.ref_exists(f"refs/tags/{name}"):
+        print(f"{Fore.RED}Tag {Fore.YELLOW}'{name}'{Fore.RED} already exists.")
+        return False
+
+    current_commit = repo.current_commit()
+    if not current_commit:
+        print(f"{Fore.RED}Nothing to tag yet.")
+        return False
+
+    if not repo.update_ref(f"refs/tags/{name}", current_commit, None):
+        print(f"{Fore.RED}Tag {Fore.YELLOW}'{name}'{Fore.RED} already exists.")
+        return False
+    print(f"{Fore.LIGHTGREEN_EX}Tagged {Fore.YELLOW}{current_commit[:7]}{Fore.LIGHTGREEN_EX} as {Fore.YELLOW}'{name}'")
+
+
+"_______Working Tree Checkout_______"
+
+
+def tree_lookup(repo_path, tree_hash, path):
+    # walks only the directories along `path` instead of the whole tree
+    object_hash = tree_hash
+    for name in path.split("/"):
+        entries = parse_tree(repo_path, object_hash) if object_hash else None
+        if not entries or name not in entries:
+            return None
+        kind, object_hash = entries[name]
+    return object_hash if kind == TREE_FILE else None
+
+
+def checkout_write(repo_path, path, file_hash, mode):
+    # write next to the target and rename over it so no reader sees a half-written file
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory or ".", prefix=".trek-tmp-")
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            # chunked files are streamed chunk by chunk, never held whole
+            for content in iter_blob(repo_path, file_hash):
+                temp_file.write(content)
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    trace_count("files_written")
+    return path, index_entry(file_hash, os.lstat(path))
+
+
+def untracked_in_the_way(index, paths):
+    # untracked files sitting where a file is about to be written
+    return [path for path in paths if path not in index and os.path.lexists(path)]
+
+
+def checkout_tree(repo_path, target_tree, force=False, workers=None):
+    # moves the working tree and index from HEAD's tree to target_tree, touching only what
+    # differs; the index stays locked from the local-change check until it matches the new tree
+    with lock_index(repo_path) as lock:
+        index = read_index(repo_path)
+        head_commit = get_current_commit()
+        head_tree = commit_tree_hash(repo_path, head_commit) if head_commit else None
+
+        with trace_span("checkout.tree_diff"):
+            changes = {
+                path: new_hash
+                for path, _, new_hash in diff_trees(repo_path, head_tree, target_tree)
+            }
+
+        with trace_span("checkout.local_changes"):
+            local = {path for _, path in staged_changes(repo_path, index)}
+            local.update(path for _, path in unstaged_changes(repo_path, index))
+
+        if force:
+            # a hard checkout also throws away local edits to paths the trees agree on
+            for path in local - set(changes):
+                changes[path] = tree_lookup(repo_path, target_tree, path)
+        else:
+            blocked = local & set(changes)
+            blocked.update(
+                untracked_in_the_way(
+                    index, [path for path, new_hash in changes.items() if new_hash]
+                )
+            )
+            blocked = sorted(blocked)
+            if blocked:
+                print(f"{Fore.RED}Your local changes would be overwritten by checkout:")
+                for path in blocked:
+                    print(f"  {Fore.YELLOW}{path}")
+                return False
+
+        removed = [path for path, new_hash in changes.items() if new_hash is None]
+        written = sorted((path, new_hash) for path, new_hash in changes.items() if new_hash)
+
+        for path in removed:
+            if os.path.isfile(path) or os.path.islink(path):
+                os.remove(path)
+            index.pop(path, None)
+            # drop directories the removal left empty
+            directory = os.path.dirname(path)
+            while directory and os.path.isdir(directory) and not os.listdir(directory):
+                os.rmdir(directory)
+                directory = os.path.dirname(directory)
+
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+
+        workers = workers or os.cpu_count() or 1
+        with trace_span("checkout.write_files"):
+            if workers > 1 and len(written) > 1:
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    results = list(
+                        pool.map(lambda item: checkout_write(repo_path, *item, mode), written)
+                    )
+            else:
+                results = [
+                    checkout_write(repo_path, path, file_hash, mode) for path, file_hash in written
+                ]
+
+        for path, entry in results:
+            index[path] = entry
+
+        if changes or not os.path.exists(os.path.join(repo_path, "index")):
+            write_index(repo_path, index, lock)
+        return True
+
+
+"_______Shifts the HEAD to the specified branch_______"
+
+
+def checkout_branch(branch_name):
+    repo = repository()
+    repo_path = repo.path
+
+    if not os.path.exists(repo_path):
+        print(f"{Fore.RED}Not a trek repository!")
+        return False
 
-    if not os.path.exists(branch_path):
+    if not repo.ref_exists(f"refs/heads/{branch_name}"):
         print(
             f"{Fore.RED}Branch {Fore.YELLOW} '{branch_name}' {Fore.RED} does not exist"
         )
-        return
+        return False
 
-    with open(branch_path, "r") as branch_file:
-        commit_hash = branch_file.read().strip()
+    commit_hash = repo.read_ref(f"refs/heads/{branch_name}")
 
     # Ensure commit exists
-    commit_path = os.path.join(repo_path, "objects", commit_hash)
-    if not os.path.exists(commit_path):
+    if not object_exists(repo_path, commit_hash):
         print(
             f"{Fore.RED}Commit {Fore.YELLOW} {commit_hash} {Fore.RED} not found in branch {Fore.CYAN}'{branch_name}'"
         )
-        return
+        return False
 
     print(f"{Fore.CYAN}Switching to branch {Fore.YELLOW} '{branch_name}'...")
 
+    # only files that differ between the two branches are rewritten
+    if not checkout_tree(repo_path, commit_tree_hash(repo_path, commit_hash)):
+        return False
+
     # Updating HEAD
-    head_path = os.path.join(repo_path, "HEAD")
-    with open(head_path, "w") as head_file:
-        head_file.write(f"ref: refs/heads/{branch_name}")
+    repo.write_ref("HEAD", f"ref: refs/heads/{branch_name}")
 
     print(f"{Fore.LIGHTGREEN_EX}Checked out branch {Fore.YELLOW} '{branch_name}'.")
 
@@ -424,81 +3759,190 @@ def checkout_branch(branch_name):
 "_______Merges the specified branch into the current branch_______"
 
 
+def write_working_file(path, content):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "wb") as working_file:
+        working_file.write(content)
+
+
+def merge_trees(repo_path, base, ours, theirs, theirs_label):
+    merged = {}
+    conflicts = []
+    conflict_contents = {}
+
+    for path in sorted(set(base) | set(ours) | set(theirs)):
+        base_hash, ours_hash, theirs_hash = base.get(path), ours.get(path), theirs.get(path)
+
+        # a side that left the path alone takes the other side's version, no reads needed
+        if ours_hash == theirs_hash or base_hash == theirs_hash:
+            result = ours_hash
+        elif base_hash == ours_hash:
+            result = theirs_hash
+        elif ours_hash is None or theirs_hash is None:
+            result = ours_hash or theirs_hash
+            conflicts.append((path, "modified on one side, deleted on the other"))
+        elif blob_is_binary(repo_path, ours_hash) or blob_is_binary(repo_path, theirs_hash):
+            result = ours_hash
+            conflicts.append((path, "binary file changed on both sides"))
+        else:
+            # only files changed on both sides are read and merged line by line
+            lines, conflict_count = line_diff.merge3(
+                blob_lines(repo_path, base_hash),
+                blob_lines(repo_path, ours_hash),
+                blob_lines(repo_path, theirs_hash),
+                "HEAD",
+                theirs_label,
+            )
+            content = ("\n".join(lines) + "\n" if lines else "").encode("utf-8")
+            if conflict_count:
+                result = ours_hash
+                conflict_contents[path] = content
+                conflicts.append((path, f"{conflict_count} conflicting hunk(s)"))
+            else:
+                result = write_object(repo_path, content, "blob")
+
+        if result is not None:
+            merged[path] = result
+
+    return merged, conflicts, conflict_contents
+
+
 def merge(branch_name):
-    repo_path = os.path.join(os.getcwd(), ".trek")
+    repo = repository()
+    repo_path = repo.path
 
     if not os.path.exists(repo_path):
         print(f"{Fore.RED}Not a trek repository!")
-        return
-
-    # current branch from the HEAD file
-    head_path = os.path.join(repo_path, "HEAD")
-    with open(head_path, "r") as head_file:
-        head = head_file.read().strip()
+        return False
 
     # make sure that HEAD has a refernce to a branch
-    if not head.startswith("ref: "):
+    current_branch = repo.head_branch()
+    if current_branch is None:
         print(f"{Fore.RED}You must be on a branch to merge.")
-        return
-
-    current_branch_path = os.path.join(repo_path, head[5:])
-    branch_path = os.path.join(repo_path, "refs", "heads", branch_name)
+        return False
 
-    if not os.path.exists(branch_path):
+    if not repo.ref_exists(f"refs/heads/{branch_name}"):
         print(
             f"{Fore.RED}Branch {Fore.YELLOW}'{branch_name}'{Fore.RED} does not exist."
         )
-        return
-
-    with open(current_branch_path, "r") as current_branch_file:
-        current_commit = current_branch_file.read().strip()
+        return False
 
-    with open(branch_path, "r") as branch_file:
-        branch_commit = branch_file.read().strip()
+    current_commit = repo.read_ref(current_branch) or ""
+    branch_commit = repo.read_ref(f"refs/heads/{branch_name}")
 
     # if both branches already point to the same commit, no merge needed
     if current_commit == branch_commit:
         print(f"{Fore.CYAN}Already up-to-date")
         return
 
-    current_commit_path = os.path.join(repo_path, "objects", current_commit)
-    branch_commit_path = os.path.join(repo_path, "objects", branch_commit)
+    # Reading both commits, from the commit-graph where possible
+    current_info = commit_info(repo_path, current_commit)
+    branch_info = commit_info(repo_path, branch_commit)
 
     # if commit objects exist for both commits
-    if not os.path.exists(current_commit_path) or not os.path.exists(
-        branch_commit_path
-    ):
+    if current_info is None or branch_info is None:
         print(f"{Fore.RED}Unable to find commit objects. Merge failed.")
-        return
-
-    # Reading commit contents from both commit objects
-    with open(current_commit_path, "r") as current_commit_file:
-        current_commit_content = current_commit_file.read()
-
-    with open(branch_commit_path, "r") as branch_commit_file:
-        branch_commit_content = branch_commit_file.read()
-
-    # to extract the tree hash from a commit content
-    def extract_tree_hash(commit_content):
-        for line in commit_content.splitlines():
-            if line.startswith("tree "):
-                return line.split(" ")[1]
-        return None
+        return False
 
-    # Extract tree hashes from both commit contents
-    current_tree = extract_tree_hash(current_commit_content)
-    branch_tree = extract_tree_hash(branch_commit_content)
+    # the other branch is already part of our history
+    if is_ancestor(repo_path, branch_commit, current_commit):
+        print(f"{Fore.CYAN}Already up-to-date")
+        return
 
-    # If the trees are same then no conflicts and we can merge
-    if current_tree == branch_tree:
-        with open(current_branch_path, "w") as current_branch_file:
-            current_branch_file.write(branch_commit)
+    # our branch is behind the other one, so it can simply move forward
+    if is_ancestor(repo_path, current_commit, branch_commit):
+        if not checkout_tree(repo_path, branch_info.tree):
+            return False
+        if not repo.update_ref(current_branch, branch_commit, current_commit or ""):
+            print(f"{Fore.RED}{current_branch} moved during the merge, merge again.")
+            return False
         print(
             f"{Fore.LIGHTGREEN_EX}Successfully merged branch {Fore.YELLOW}'{branch_name}'{Fore.LIGHTGREEN_EX} into the current branch (fast-forward)."
         )
         return
 
-    print(f"{Fore.RED}Merge conflict detected. Resolve conflicts manually.")
+    # the index stays locked until it holds the merge result
+    with lock_index(repo_path) as lock:
+        # the merge rewrites working files, so local changes would be lost
+        index = read_index(repo_path)
+        if staged_changes(repo_path, index) or unstaged_changes(repo_path, index):
+            print(f"{Fore.RED}Commit or reset your local changes before merging.")
+            return False
+
+        # both branches moved on since they split, so merge them path by path from their base
+        with trace_span("merge.merge_base"):
+            base_commit = merge_base(repo_path, current_commit, branch_commit)
+        base_entries = {}
+        if base_commit:
+            base_entries = read_tree(repo_path, commit_tree_hash(repo_path, base_commit)) or {}
+        ours_entries = read_tree(repo_path, current_info.tree)
+        theirs_entries = read_tree(repo_path, branch_info.tree)
+
+        with trace_span("merge.merge_trees"):
+            merged, conflicts, conflict_contents = merge_trees(
+                repo_path, base_entries, ours_entries, theirs_entries, branch_name
+            )
+
+        # only paths whose result differs from our side touch the working tree
+        written = [
+            path
+            for path in sorted(set(merged) | set(conflict_contents))
+            if path in conflict_contents or merged[path] != ours_entries.get(path)
+        ]
+        blocked = untracked_in_the_way(index, written)
+        if blocked:
+            print(f"{Fore.RED}Untracked files would be overwritten by merge:")
+            for path in blocked:
+                print(f"  {Fore.YELLOW}{path}")
+            return False
+
+        for path in sorted(set(ours_entries) | set(merged)):
+            if path in conflict_contents:
+                write_working_file(path, conflict_contents[path])
+                continue
+            new_hash = merged.get(path)
+            if new_hash == ours_entries.get(path):
+                continue
+            if new_hash is None:
+                if os.path.exists(path):
+                    os.remove(path)
+                index.pop(path, None)
+            else:
+                write_working_file(path, read_blob(repo_path, new_hash))
+                index[path] = index_entry(new_hash, os.lstat(path))
+        write_index(repo_path, index, lock)
+
+        if conflicts:
+            # commit picks MERGE_HEAD up as the second parent once conflicts are resolved
+            repo.write_ref("MERGE_HEAD", branch_commit)
+            print(f"{Fore.RED}Automatic merge failed; fix conflicts, add the files and commit:")
+            for path, reason in conflicts:
+                print(f"  {Fore.YELLOW}{path} {Fore.RED}({reason})")
+            return False
+
+        with trace_span("merge.write_tree"):
+            tree_hash = write_tree(repo_path, merged, index.trees)
+        write_index(repo_path, index, lock)
+
+    commit_hash = create_commit(
+        repo_path, tree_hash, [current_commit, branch_commit], f"Merge branch '{branch_name}'"
+    )
+    if not repo.update_ref(current_branch, commit_hash, current_commit or ""):
+        # the next commit records the merge with its second parent, as after a conflict
+        repo.write_ref("MERGE_HEAD", branch_commit)
+        print(
+            f"{Fore.RED}{current_branch} moved during the merge; the merged files are in "
+            f"the working tree, commit them to finish."
+        )
+        return False
+    undo_stack.append(current_commit)
+    add_to_commit_graph(repo_path, commit_hash)
+
+    print(
+        f"{Fore.LIGHTGREEN_EX}Merged branch {Fore.YELLOW}'{branch_name}'{Fore.LIGHTGREEN_EX} into the current branch: {Fore.YELLOW}[{commit_hash[:7]}]"
+    )
 
 
 "_______undo the last commit by resetting to the previous commit_______"
@@ -507,7 +3951,7 @@ def merge(branch_name):
 def undo():
     if not undo_stack:
         print(f"{Fore.RED}Nothing to undo.")
-        return
+        return False
 
     # Pop the last commit from the undo stack (the commit to undo)
     commit_to_undo = undo_stack.pop()
@@ -528,7 +3972,7 @@ def undo():
 def redo():
     if not redo_stack:
         print(f"{Fore.RED}Nothing to redo.")
-        return
+        return False
 
     # Pop the last commit from the redo stack (the commit to redo)
     commit_to_redo = redo_stack.pop()
@@ -547,62 +3991,230 @@ def redo():
 
 
 def reset(commit_hash, hard=False):
-    repo_path = os.path.join(os.getcwd(), ".trek")
+    repo = repository()
+    repo_path = repo.path
 
     if not os.path.exists(repo_path):
         print(f"{Fore.RED}Not a trek repository")
-        return
+        return False
 
-    # making the path to the commit object from the given commit hash
-    commit_path = os.path.join(repo_path, "objects", commit_hash)
+    # Reading the commit, from the commit-graph where possible
+    info = commit_info(repo_path, commit_hash)
 
     # Check if the specified commit exists
-    if not os.path.exists(commit_path):
+    if info is None:
         print(f"{Fore.RED}Commit not found")
-        return
-
-    # Reading the content of the commit object
-    with open(commit_path, "r") as commit_file:
-        commit_content = commit_file.read()
-
-    # Extract the tree hash from the commit content (tree hash is saved in the very first line)
-    tree_hash = commit_content.split("\n")[0].split(" ")[1]
+        return False
 
-    # making the path to the tree object corresponding to the tree hash
-    tree_path = os.path.join(repo_path, "objects", tree_hash)
+    tree_hash = info.tree
 
     # Check if the tree object exists
-    if not os.path.exists(tree_path):
+    if not object_exists(repo_path, tree_hash):
         print(f"{Fore.RED}Error: Tree object {tree_hash} does not exist.")
-        return
+        return False
 
-    # Read the content of the tree object
-    with open(tree_path, "r") as tree_file:
-        tree_content = tree_file.read().strip().split("\n")
+    # a hard reset discards local edits, so nothing blocks the checkout
+    checkout_tree(repo_path, tree_hash, force=True)
 
-    for line in tree_content:
-        file_hash, file_name = line.split(" ")
+    # Update the HEAD file to point to the specified commit hash
+    repo.write_ref("HEAD", commit_hash)
 
-        # Making the path to the file object in the object store
-        file_path = os.path.join(repo_path, "objects", file_hash)
+    print(
+        f"{Fore.LIGHTGREEN_EX}Hard reset to commit {Fore.YELLOW}{commit_hash} {Fore.LIGHTGREEN_EX}- Files updated."
+    )
 
-        # retrieving its content
-        if os.path.exists(file_path):
-            with open(file_path, "r") as file:
-                file_content = file.read()
 
-            # Write the content to the file
-            with open(file_name, "w") as working_file:
-                working_file.write(file_content)
+"_______Transfers objects and refs between repositories_______"
 
-    # Update the HEAD file to point to the specified commit hash
-    head_path = os.path.join(repo_path, "HEAD")
-    with open(head_path, "w") as head_file:
-        head_file.write(commit_hash)
 
+def find_remote_repo(path):
+    # accepts either a working directory or its .trek directory
+    path = os.path.abspath(path)
+    if os.path.basename(path) != ".trek":
+        path = os.path.join(path, ".trek")
+    return path if os.path.isdir(os.path.join(path, "objects")) else None
+
+
+def missing_objects(source_path, target_path, want, haves):
+    # walks back from `want` only until history the target already has; whatever the
+    # target has it has completely, so a tree it holds is never opened
+    commits = []
+    seen = set()
+    pending = [want]
+    while pending:
+        commit_hash = pending.pop()
+        if commit_hash in seen or commit_hash in haves or object_exists(target_path, commit_hash):
+            continue
+        seen.add(commit_hash)
+        info = commit_info(source_path, commit_hash)
+        if info is None:
+            raise ValueError(f"Commit {commit_hash} is missing from {source_path}")
+        commits.append((commit_hash, info.tree))
+        pending.extend(info.parents)
+
+    objects = []
+    sent = set()
+
+    def add(object_hash):
+        if object_hash in sent or object_exists(target_path, object_hash):
+            return False
+        sent.add(object_hash)
+        objects.append(object_hash)
+        return True
+
+    for commit_hash, tree_hash in commits:
+        add(commit_hash)
+        stack = [tree_hash]
+        while stack:
+            current = stack.pop()
+            if not add(current):
+                continue
+            for kind, object_hash in (parse_tree(source_path, current) or {}).values():
+                if kind == TREE_DIR:
+                    stack.append(object_hash)
+                elif add(object_hash) and object_type(source_path, object_hash) == "chunked":
+                    _, manifest = read_object(source_path, object_hash)
+                    for _, chunk_hash in decode_manifest(manifest):
+                        add(chunk_hash)
+    return len(commits), objects
+
+
+def send_pack(source_path, target_path, object_hashes):
+    # objects are read one at a time as the pack is written, never all held at once
+    def stream():
+        for object_hash in object_hashes:
+            object_type, content = load_object(source_path, object_hash)
+            yield object_hash, object_type, content, None
+
+    pack_path = write_pack(target_path, stream(), len(object_hashes))
+    return os.path.getsize(pack_path)
+
+
+def transfer(source_path, target_path, source_ref, target_ref, force=False):
+    source = repository(source_path)
+    target = repository(target_path)
+
+    # object ids of one format mean nothing in a repository of another
+    if object_format(source_path) != object_format(target_path):
+        print(
+            f"{Fore.RED}{source_path} uses {object_format(source_path)} object ids but "
+            f"{target_path} uses {object_format(target_path)}."
+        )
+        return False
+
+    want = source.read_ref(source_ref)
+    if not want:
+        print(f"{Fore.RED}{source_ref} does not exist in {source_path}")
+        return False
+
+    old = target.read_ref(target_ref)
+    if old == want:
+        print(f"{Fore.CYAN}{target_ref} is already up-to-date.")
+        return True
+
+    # only a descendant of what the target had may replace it, unless forced; all of the
+    # want's history is in the source, so this is settled before anything is sent
+    if (
+        old
+        and not force
+        and not (object_exists(source_path, old) and is_ancestor(source_path, old, want))
+    ):
+        print(
+            f"{Fore.RED}Rejected {Fore.YELLOW}{target_ref}{Fore.RED}: not a fast-forward "
+            f"({old[:7]} is not an ancestor of {want[:7]})."
+        )
+        return False
+
+    # the target's ref tips are its "haves"; the source's tip is the "want"
+    haves = {value for _, value in target.list_refs("refs/") if value}
+    with trace_span("transfer.negotiate"):
+        commit_count, object_hashes = missing_objects(source_path, target_path, want, haves)
+
+    size = 0
+    if object_hashes:
+        with trace_span("transfer.send_pack"):
+            size = send_pack(source_path, target_path, object_hashes)
+        trace_count("objects_sent", len(object_hashes))
+
+    if not target.update_ref(target_ref, want, old):
+        print(f"{Fore.RED}{target_ref} changed during the transfer, try again.")
+        return False
+    add_to_commit_graph(target_path, want)
+
+    if not object_hashes:
+        print(f"{Fore.LIGHTGREEN_EX}Updated {Fore.YELLOW}{target_ref}{Fore.LIGHTGREEN_EX}, no objects needed.")
+        return True
     print(
-        f"{Fore.LIGHTGREEN_EX}Hard reset to commit {Fore.YELLOW}{commit_hash} {Fore.LIGHTGREEN_EX}- Files updated."
+        f"{Fore.LIGHTGREEN_EX}Sent {Fore.CYAN}{commit_count}{Fore.LIGHTGREEN_EX} commit(s), "
+        f"{Fore.CYAN}{len(object_hashes)}{Fore.LIGHTGREEN_EX} object(s) in one pack of "
+        f"{Fore.YELLOW}{size}{Fore.LIGHTGREEN_EX} bytes: {Fore.YELLOW}{target_ref} "
+        f"{(old or '')[:7] or '(new)'}..{want[:7]}"
     )
+    return True
+
+
+def split_refspec(spec):
+    # "<branch>" or "<source branch>:<target branch>"
+    source, _, target = spec.partition(":")
+    for name in (source, target or source):
+        if not valid_ref_name(name):
+            raise ValueError(f"'{name}' is not a valid branch name")
+    return f"refs/heads/{source}", f"refs/heads/{target or source}"
+
+
+def push_remote(remote, spec, force=False):
+    repo_path = repository().path
+    remote_path = find_remote_repo(remote)
+    if remote_path is None:
+        print(f"{Fore.RED}{remote} is not a trek repository")
+        return False
+    source_ref, target_ref = split_refspec(spec)
+
+    # the remote's index and working tree stay on its checked-out branch, so moving that
+    # branch under them would make them look like they undo the push; a mirror nobody works
+    # in can set receive.deny_current_branch to false
+    if (
+        repository(remote_path).head_branch() == target_ref
+        and config_value(remote_path, "receive.deny_current_branch") != "false"
+    ):
+        print(
+            f"{Fore.RED}Refusing to update {Fore.YELLOW}{target_ref}{Fore.RED}, it is checked out "
+            f"in {remote}; push to another branch and merge it there."
+        )
+        return False
+    return transfer(repo_path, remote_path, source_ref, target_ref, force)
+
+
+def pull_remote(remote, spec, force=False):
+    repo = repository()
+    remote_path = find_remote_repo(remote)
+    if remote_path is None:
+        print(f"{Fore.RED}{remote} is not a trek repository")
+        return False
+    source_ref, target_ref = split_refspec(spec)
+
+    # pulling into the checked-out branch moves the working tree along with it
+    if repo.head_branch() == target_ref:
+        old = repo.read_ref(target_ref)
+        if not transfer(remote_path, repo.path, source_ref, "FETCH_HEAD", True):
+            return False
+        new = repo.read_ref("FETCH_HEAD")
+        repo.delete_ref("FETCH_HEAD")
+        if new == old:
+            print(f"{Fore.CYAN}{target_ref} is already up-to-date.")
+            return
+        if old and not force and not is_ancestor(repo.path, old, new):
+            print(f"{Fore.RED}Rejected {Fore.YELLOW}{target_ref}{Fore.RED}: not a fast-forward.")
+            return False
+        if not checkout_tree(repo.path, commit_tree_hash(repo.path, new)):
+            return False
+        if not repo.update_ref(target_ref, new, old):
+            print(f"{Fore.RED}{target_ref} changed during the pull, pull again.")
+            return False
+        print(f"{Fore.LIGHTGREEN_EX}Fast-forwarded {Fore.YELLOW}{target_ref}{Fore.LIGHTGREEN_EX} to {new[:7]}.")
+        return
+
+    return transfer(remote_path, repo.path, source_ref, target_ref, force)
 
 
 "_______pushes changes from a source branch to a target branch_______"
@@ -610,36 +4222,34 @@ def reset(commit_hash, hard=False):
 
 def push(source_branch, target_branch):
     # getting the repository path
-    repo_path = os.path.join(os.getcwd(), ".trek")
+    repo = repository()
+    repo_path = repo.path
 
     # Checking if repository exists
     if not os.path.exists(repo_path):
         print(f"{Fore.RED}Not a trek repository!")
-        return
-
-    # making paths for the source and target branch files
-    source_branch_path = os.path.join(repo_path, "refs", "heads", source_branch)
-    target_branch_path = os.path.join(repo_path, "refs", "heads", target_branch)
+        return False
 
-    if not os.path.exists(source_branch_path):
+    if not repo.ref_exists(f"refs/heads/{source_branch}"):
         print(
             f"{Fore.RED}Source branch {Fore.YELLOW}'{source_branch}' {Fore.RED}does not exist."
         )
-        return
+        return False
 
-    if not os.path.exists(target_branch_path):
+    if not repo.ref_exists(f"refs/heads/{target_branch}"):
         print(
             f"{Fore.RED}Target branch {Fore.YELLOW}'{target_branch}' {Fore.RED}does not exist."
         )
-        return
+        return False
 
     # reading the commit hash of the last commit in source branch
-    with open(source_branch_path, "r") as source_file:
-        last_commit = source_file.read().strip()
+    last_commit = repo.read_ref(f"refs/heads/{source_branch}")
 
-    # writing the last commit to the target branch
-    with open(target_branch_path, "w") as target_file:
-        target_file.write(last_commit)
+    # writing the last commit to the target branch, unless another writer moved it first
+    target_ref = f"refs/heads/{target_branch}"
+    if not repo.update_ref(target_ref, last_commit, repo.read_ref(target_ref)):
+        print(f"{Fore.RED}{target_ref} changed during the push, push again.")
+        return False
 
     print(
         f"{Fore.LIGHTGREEN_EX}Pushed commit from {Fore.YELLOW}'{source_branch}'{Fore.LIGHTGREEN_EX} to {Fore.CYAN}'{target_branch}'."
@@ -651,81 +4261,212 @@ def push(source_branch, target_branch):
 
 def pull(source_branch, target_branch):
     # gets the repository path
-    repo_path = os.path.join(os.getcwd(), ".trek")
+    repo = repository()
+    repo_path = repo.path
 
     # Checking if the repository exist
     if not os.path.exists(repo_path):
         print(f"{Fore.RED}Not a trek repository!")  # Error message
-        return
-
-    # making paths for the source and target branch files
-    source_branch_path = os.path.join(repo_path, "refs", "heads", source_branch)
-    target_branch_path = os.path.join(repo_path, "refs", "heads", target_branch)
+        return False
 
     # Check if the source branch exist
-    if not os.path.exists(source_branch_path):
+    if not repo.ref_exists(f"refs/heads/{source_branch}"):
         print(
             f"{Fore.RED}Source branch {Fore.YELLOW}'{source_branch}' {Fore.RED}does not exist."
         )
-        return
+        return False
 
     # Check if the target branch exist
-    if not os.path.exists(target_branch_path):
+    if not repo.ref_exists(f"refs/heads/{target_branch}"):
         print(
             f"{Fore.RED}Target branch {Fore.YELLOW}'{target_branch}' {Fore.RED}does not exist."
         )
-        return
+        return False
 
     # reading commit hash from source branch
-    with open(source_branch_path, "r") as source_file:
-        source_commit = source_file.read().strip()
+    source_commit = repo.read_ref(f"refs/heads/{source_branch}")
 
-    # writing the commit from source in the target branch
-    with open(target_branch_path, "w") as target_file:
-        target_file.write(source_commit)
+    # writing the commit from source in the target branch, unless another writer moved it first
+    target_ref = f"refs/heads/{target_branch}"
+    if not repo.update_ref(target_ref, source_commit, repo.read_ref(target_ref)):
+        print(f"{Fore.RED}{target_ref} changed during the pull, pull again.")
+        return False
     print(
         f"{Fore.LIGHTGREEN_EX}Pulled commit from {Fore.YELLOW}'{source_branch}' {Fore.LIGHTGREEN_EX}into {Fore.CYAN}'{target_branch}'."
     )
 
 
+def parse_commit_args(args):
+    # "commit -a -m <message>", or the REPL's older "commit <message words>"
+    stage_all = False
+    message = []
+    i = 0
+    while i < len(args):
+        if args[i] == "-a":
+            stage_all = True
+        elif args[i] == "-m":
+            message.append(option_value(args, i))
+            i += 1
+        elif args[i] == "-am":
+            stage_all = True
+            message.append(option_value(args, i))
+            i += 1
+        else:
+            message.append(args[i])
+        i += 1
+    if not message:
+        raise ValueError("commit needs a message")
+    return " ".join(message), stage_all
+
+
+def run_command(argv):
+    # one already split command line; False when it failed, is unknown or malformed
+    if not argv:
+        return True
+
+    def execute():
+        # a command's writes are one batch: objects become durable together, refs last
+        with transaction(repository().path):
+            return dispatch_command(argv[0], argv[1:])
+
+    try:
+        return traced(argv, execute) is not False
+    except (TimeoutError, ValueError) as error:
+        # a malformed argument, or a lock another process held past LOCK_TIMEOUT
+        print(f"{Fore.RED}{error}")
+        return False
+
+
+def dispatch_command(command, args):
+    # commands return False when they fail and None when they succeed
+    if command == "init":
+        # init [--object-format=sha1|sha256|blake2b]
+        formats = [arg.partition("=")[2] for arg in args if arg.startswith("--object-format=")]
+        return init(*formats[-1:])
+    elif command == "add" and args:
+        workers = None
+        if args[0] == "-j":
+            workers = option_value(args, 0, int)
+            args = args[2:]
+        return add(args, workers)
+    elif command == "commit" and args:
+        message, stage_all = parse_commit_args(args)
+        return commit(message, stage_all)
+    elif command == "diff" and len(args) >= 2:
+        stat = "--stat" in args
+        args = [arg for arg in args if arg != "--stat"]
+        return diff(args[0], args[1], stat)
+    elif command == "status":
+        return status()
+    elif command == "log":
+        return log(**parse_log_args(args))
+    elif command == "branch":
+        # any option, or none at all, lists; otherwise the one argument is a name
+        if not args or any(arg.startswith("-") for arg in args):
+            return branch(**parse_ref_list_args(args))
+        return branch(args[0])
+    elif command == "tag":
+        if not args or any(arg.startswith("-") for arg in args):
+            return tag(**parse_ref_list_args(args))
+        return tag(args[0])
+    elif command == "pack-refs":
+        return pack_refs()
+    elif command == "checkout" and args:
+        return checkout_branch(args[0])
+    elif command == "merge" and args:
+        return merge(args[0])
+    elif command == "config":
+        return config(*args[:2])
+    elif command == "commit-graph":
+        return write_commit_graph()
+    elif command == "fsmonitor":
+        return fsmonitor(args[0] if args else "start")
+    elif command == "gc":
+        prune_expire = None
+        for arg in args:
+            if arg.startswith("--prune="):
+                value = arg.partition("=")[2]
+                if value != "now" and not value.isdigit():
+                    raise ValueError(f"--prune takes seconds or now, not {value!r}")
+                prune_expire = 0 if value == "now" else int(value)
+        return gc(prune_expire, "--repack" in args)
+    elif command == "repack":
+        return repack()
+    elif command == "reset" and args:
+        return reset(resolve_commit(repository().path, args[0]) or args[0])
+    elif command == "undo":
+        return undo()
+    elif command == "redo":
+        return redo()
+    elif command in ("push", "pull") and len(args) >= 2:
+        force = "--force" in args
+        args = [arg for arg in args if arg != "--force"]
+        # "<path> <branch>[:<branch>]" syncs with another repository, two names stay local
+        if find_remote_repo(args[0]) is not None and args[0] not in (".", ".trek"):
+            return (push_remote if command == "push" else pull_remote)(args[0], args[1], force)
+        return (push if command == "push" else pull)(args[0], args[1])
+    else:
+        print(f"{Fore.RED}Unknown Command")
+        return False
+
+
+def run_batch(batch_file):
+    # every line runs in this one process, so the repository session stays warm throughout
+    failures = 0
+    for line_number, line in enumerate(batch_file, 1):
+        try:
+            argv = shlex.split(line, comments=True)
+        except ValueError as error:
+            print(f"{Fore.RED}line {line_number}: {error}")
+            failures += 1
+            continue
+        if argv and not run_command(argv):
+            print(f"{Fore.RED}line {line_number}: {line.strip()}")
+            failures += 1
+    return failures
+
+
+def split_repl_line(command):
+    # the REPL's original "commit <message>" keeps its message exactly as typed, apostrophes
+    # and runs of spaces included; options and quoted messages are split like a shell would
+    if command.startswith("commit "):
+        message = command[7:]
+        if message.strip() and not message.lstrip().startswith(("-", '"', "'")):
+            return ["commit", "-m", message]
+    return shlex.split(command)
+
+
 def run():
     while True:
         command = input("trek> ")
 
         if command == "exit":
             break
-        elif command.startswith("init"):
-            init()
-        elif command.startswith("add "):
-            files = command.split()[1:]
-            add(files)
-        elif command.startswith("commit "):
-            message = command[7:]
-            commit(message)
-        elif command == "log":
-            log()
-        elif command.startswith("branch "):
-            branch_name = command.split()[1] if len(command.split()) > 1 else None
-            branch(branch_name)
-        elif command.startswith("checkout "):
-            branch_name = command.split()[1]
-            checkout_branch(branch_name)
-        elif command.startswith("merge "):
-            branch_name = command.split()[1]
-            merge(branch_name)
-        elif command == "undo":
-            undo()
-        elif command == "redo":
-            redo()
-        elif command.startswith("push "):
-            branches = command.split()[1:]
-            push(branches[0], branches[1])
-        elif command.startswith("pull "):
-            branches = command.split()[1:]
-            pull(branches[0], branches[1])
-        else:
-            print(f"{Fore.RED}Unknown Command")
+        try:
+            argv = split_repl_line(command)
+        except ValueError as error:
+            print(f"{Fore.RED}{error}")
+            continue
+        run_command(argv)
+
+
+def main(argv):
+    # no arguments opens the REPL, "batch [file]" runs a script (stdin without a file)
+    global _trace_target
+    while argv and argv[0].startswith("--profile"):
+        # --profile reports on stderr, --profile=<file> appends JSON lines to a file
+        _trace_target = argv[0].partition("=")[2] or "stderr"
+        argv = argv[1:]
+    if not argv:
+        run()
+        return 0
+    if argv[0] == "batch":
+        if len(argv) > 1 and argv[1] != "-":
+            with open(argv[1], "r") as batch_file:
+                return 1 if run_batch(batch_file) else 0
+        return 1 if run_batch(sys.stdin) else 0
+    return 0 if run_command(argv) else 1
 
 
 if __name__ == "__main__":
-    run()
+    sys.exit(main(sys.argv[1:]))
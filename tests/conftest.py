@@ -0,0 +1,45 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    # a fresh repository in its own directory, with nothing cached from earlier tests
+    monkeypatch.chdir(tmp_path)
+    for cache in (
+        main._repositories,
+        main._commit_graph_cache,
+        main._bloom_cache,
+        main._pack_cache,
+        main._delta_base_cache,
+        main._diff_cache,
+        main._ignore_cache,
+    ):
+        cache.clear()
+    main.init()
+    return main.repository().path
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as file:
+        file.write(content)
+
+
+def read(path):
+    with open(path) as file:
+        return file.read()
+
+
+def commit_files(files, message):
+    for path, content in files.items():
+        write(path, content)
+    main.add(list(files))
+    assert main.commit(message) is not False
+    return main.get_current_commit()
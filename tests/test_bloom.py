@@ -0,0 +1,60 @@
+import os
+import re
+
+import main
+from conftest import commit_files
+
+
+def test_bloom_filters_hold_changed_paths_and_their_directories(repo):
+    first = commit_files({"a.txt": "a\n"}, "one")
+    second = commit_files({"src/lib/b.txt": "b\n"}, "two")
+    main.write_commit_graph()
+
+    filters = main.load_bloom_filters(repo)
+    assert set(filters) == {first, second}
+    for key in ("src", "src/lib", "src/lib/b.txt"):
+        assert main.bloom_maybe_contains(filters[second], [main.bloom_key_hash(key)])
+    assert main.bloom_maybe_contains(filters[first], [main.bloom_key_hash("a.txt")])
+
+
+def test_bloom_filter_never_misses_an_added_path():
+    paths = [f"dir{i % 7}/file{i}.txt" for i in range(200)]
+    bloom = main.build_bloom_filter(paths)
+    for key in main.bloom_keys(paths):
+        assert main.bloom_maybe_contains(bloom, [main.bloom_key_hash(key)])
+    assert not main.bloom_maybe_contains(b"", [main.bloom_key_hash("dir0")])
+
+
+def test_bloom_filter_skipped_for_huge_changes():
+    paths = [f"file{i}.txt" for i in range(main.BLOOM_MAX_PATHS + 1)]
+    assert main.build_bloom_filter(paths) is None
+
+
+def test_append_after_torn_record_stays_readable(repo):
+    first = commit_files({"a.txt": "a\n"}, "one")
+    with open(main.bloom_filter_path(repo), "ab") as bloom_file:
+        bloom_file.write(b"\x01\x02\x03")
+    second = commit_files({"b.txt": "b\n"}, "two")
+    third = commit_files({"c.txt": "c\n"}, "three")
+
+    assert set(main.load_bloom_filters(repo)) == {first, second, third}
+    # every commit already has its filter, so nothing is appended again
+    size = os.path.getsize(main.bloom_filter_path(repo))
+    main.write_commit_graph()
+    assert os.path.getsize(main.bloom_filter_path(repo)) == size
+
+
+def logged_messages(out):
+    return [re.sub(r"\x1b\[[0-9;]*m", "", line).split()[-1] for line in out.strip().splitlines()]
+
+
+def test_path_limited_log_matches_unfiltered_walk(repo, capsys):
+    commit_files({"a.txt": "a\n"}, "one")
+    commit_files({"src/b.txt": "b\n"}, "two")
+    commit_files({"a.txt": "changed\n"}, "three")
+    capsys.readouterr()
+
+    main.log(oneline=True, paths=["src"])
+    assert logged_messages(capsys.readouterr().out) == ["two"]
+    main.log(oneline=True, paths=["a.txt"])
+    assert logged_messages(capsys.readouterr().out) == ["three", "one"]
@@ -0,0 +1,69 @@
+import os
+
+import main
+from conftest import commit_files, read, write
+
+
+def two_branches():
+    commit_files({"a.txt": "a\n", "same.txt": "same\n", "old/x.txt": "x\n"}, "one")
+    main.branch("feature")
+    os.remove("old/x.txt")
+    main.commit("drop old", stage_all=True)
+    commit_files({"a.txt": "feature\n", "new/b.txt": "b\n"}, "feature")
+    main.checkout_branch("master")
+
+
+def test_checkout_switches_files_and_index(repo):
+    two_branches()
+    assert read("a.txt") == "a\n"
+    assert read("old/x.txt") == "x\n"
+    assert not os.path.exists("new")
+
+    assert main.checkout_branch("feature") is not False
+    assert read("a.txt") == "feature\n"
+    assert read("new/b.txt") == "b\n"
+    # directories emptied by the switch go too
+    assert not os.path.exists("old")
+    assert set(main.read_index(repo)) == {"a.txt", "same.txt", "new/b.txt"}
+    assert main.repository().head_branch() == "refs/heads/feature"
+
+
+def test_checkout_only_rewrites_files_that_differ(repo):
+    two_branches()
+    os.utime("same.txt", (1_000_000, 1_000_000))
+    main.add(["same.txt"])
+    main.checkout_branch("feature")
+    assert os.path.getmtime("same.txt") == 1_000_000
+
+
+def test_checkout_refuses_to_overwrite_local_changes(repo):
+    two_branches()
+    write("a.txt", "local edit\n")
+    assert main.checkout_branch("feature") is False
+    assert read("a.txt") == "local edit\n"
+    assert main.repository().head_branch() == "refs/heads/master"
+
+
+def test_checkout_refuses_to_overwrite_untracked_files(repo):
+    two_branches()
+    write("new/b.txt", "mine\n")
+    assert main.checkout_branch("feature") is False
+    assert read("new/b.txt") == "mine\n"
+
+
+def test_checkout_keeps_local_changes_to_files_both_branches_share(repo):
+    two_branches()
+    write("same.txt", "local edit\n")
+    assert main.checkout_branch("feature") is not False
+    assert read("same.txt") == "local edit\n"
+
+
+def test_branch_with_existing_name_checks_it_out(repo):
+    commit_files({"a.txt": "a\n"}, "one")
+    main.branch("feature")
+    commit_files({"b.txt": "b\n"}, "two")
+
+    main.branch("master")
+    assert main.repository().head_branch() == "refs/heads/master"
+    assert not os.path.exists("b.txt")
+    assert set(main.read_index(repo)) == {"a.txt"}
@@ -0,0 +1,64 @@
+import os
+import random
+
+import main
+
+
+def random_bytes(size, seed=0):
+    return random.Random(seed).randbytes(size)
+
+
+def test_manifest_round_trip():
+    chunks = [(4096, "aa" * 32), (123, "bb" * 32), (1, "cc" * 32)]
+    assert main.decode_manifest(main.encode_manifest(chunks, 32)) == chunks
+
+
+def test_chunked_file_round_trip(repo):
+    main.config("core.chunk_threshold", "1024")
+    # past the largest chunk size, so the file cannot be stored as a single chunk
+    data = random_bytes(main.CHUNK_MAX_SIZE * 2 + 1000, 5)
+    with open("big.bin", "wb") as big_file:
+        big_file.write(data)
+    main.add(["big.bin"])
+
+    object_hash = main.read_index(repo)["big.bin"].hash
+    assert object_hash == main.hash_file(repo, "big.bin")
+    object_type, manifest = main.load_object(repo, object_hash)
+    assert object_type == "chunked"
+    chunks = main.decode_manifest(manifest)
+    assert len(chunks) > 1
+    assert sum(size for size, _ in chunks) == len(data)
+    assert b"".join(main.iter_blob(repo, object_hash)) == data
+
+
+def test_edit_in_the_middle_reuses_most_chunks(repo):
+    main.config("core.chunk_threshold", "1024")
+    lines = [f"line {i} {random.Random(i).random()}\n".encode() for i in range(300_000)]
+    with open("big.txt", "wb") as big_file:
+        big_file.write(b"".join(lines))
+    main.add(["big.txt"])
+    before = main.decode_manifest(main.load_object(repo, main.read_index(repo)["big.txt"].hash)[1])
+
+    lines[len(lines) // 2] = b"edited\n"
+    with open("big.txt", "wb") as big_file:
+        big_file.write(b"".join(lines))
+    main.add(["big.txt"])
+    after = main.decode_manifest(main.load_object(repo, main.read_index(repo)["big.txt"].hash)[1])
+
+    assert len(before) > 2
+    assert len({h for _, h in after} - {h for _, h in before}) <= 2
+
+
+def test_integer_config_is_validated_when_set(repo):
+    assert main.config("core.chunk_threshold", "16mb") is False
+    assert main.config("gc.prune_expire", "-1") is False
+    assert main.config_int(repo, "core.chunk_threshold") == int(main.CONFIG_DEFAULTS["core"]["chunk_threshold"])
+
+    assert main.config("core.chunk_threshold", "4096") is not False
+    assert main.config_int(repo, "core.chunk_threshold") == 4096
+
+
+def test_hand_edited_integer_config_falls_back_to_default(repo):
+    with open(os.path.join(repo, "config"), "a") as config_file:
+        config_file.write("[gc]\nprune_expire = two weeks\n")
+    assert main.config_int(repo, "gc.prune_expire") == int(main.CONFIG_DEFAULTS["gc"]["prune_expire"])
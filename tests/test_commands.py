@@ -0,0 +1,82 @@
+import io
+import re
+
+import pytest
+
+import main
+from conftest import commit_files, write
+
+
+def plain(out):
+    return re.sub(r"\x1b\[[0-9;]*m", "", out)
+
+
+@pytest.mark.parametrize(
+    "line, argv",
+    [
+        ("commit it's done", ["commit", "-m", "it's done"]),
+        ("commit two  spaces", ["commit", "-m", "two  spaces"]),
+        ('commit -m "quoted message"', ["commit", "-m", "quoted message"]),
+        ("commit 'quoted'", ["commit", "quoted"]),
+        ("commit -am fix", ["commit", "-am", "fix"]),
+        ("add a.txt 'b c.txt'", ["add", "a.txt", "b c.txt"]),
+        ("log -n 3", ["log", "-n", "3"]),
+    ],
+)
+def test_repl_line_splitting(line, argv):
+    assert main.split_repl_line(line) == argv
+
+
+def test_repl_commits_an_unquoted_message_as_typed(repo, monkeypatch):
+    write("a.txt", "a\n")
+    lines = iter(["add a.txt", "commit it's  done", "exit"])
+    monkeypatch.setattr("builtins.input", lambda prompt: next(lines))
+    main.run()
+    assert main.read_commit(repo, main.get_current_commit())["message"] == "it's  done\n"
+
+
+def test_malformed_arguments_fail_without_crashing(repo):
+    assert main.run_command(["commit", "-m"]) is False
+    assert main.run_command(["log", "-n", "many"]) is False
+    assert main.run_command(["gc", "--prune=soon"]) is False
+    assert main.run_command(["checkout", "missing"]) is False
+    assert main.run_command(["frobnicate"]) is False
+
+
+def test_exit_codes(repo):
+    write("a.txt", "a\n")
+    assert main.main(["add", "a.txt"]) == 0
+    assert main.main(["commit", "-m", "one"]) == 0
+    assert main.main(["commit", "-m", "nothing changed"]) == 1
+    assert main.main(["merge", "missing"]) == 1
+
+
+def test_batch_runs_every_line_and_counts_failures(repo, capsys):
+    write("a.txt", "a\n")
+    write("b.txt", "b\n")
+    script = io.StringIO(
+        "add a.txt   # staged first\n"
+        "\n"
+        "commit -m 'first commit'\n"
+        "checkout nowhere\n"
+        "commit -m 'unterminated\n"
+        "add b.txt\n"
+        "commit -m second\n"
+    )
+    assert main.run_batch(script) == 2
+    out = plain(capsys.readouterr().out)
+    assert "line 4: checkout nowhere" in out
+    assert "line 5:" in out
+
+    messages = [main.read_commit(repo, h)["message"] for h, _ in main.iter_commits(repo, main.get_current_commit())]
+    assert messages == ["second\n", "first commit\n"]
+
+
+def test_batch_file_from_the_command_line(repo, tmp_path):
+    commit_files({"a.txt": "a\n"}, "one")
+    good = tmp_path / "good.txt"
+    good.write_text("status\nlog --oneline\n")
+    bad = tmp_path / "bad.txt"
+    bad.write_text("status\nmerge missing\n")
+    assert main.main(["batch", str(good)]) == 0
+    assert main.main(["batch", str(bad)]) == 1
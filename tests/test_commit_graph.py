@@ -0,0 +1,55 @@
+import os
+
+import main
+from conftest import commit_files
+
+
+def test_commit_graph_records_every_commit(repo):
+    first = commit_files({"a.txt": "a\n"}, "one")
+    second = commit_files({"src/b.txt": "b\n"}, "two")
+    main.write_commit_graph()
+
+    graph = main.load_commit_graph(repo)
+    assert set(graph["hashes"]) == {first, second}
+    info = main.commit_info(repo, second)
+    assert info.parents == [first]
+    assert info.tree == main.commit_tree_hash(repo, second)
+    assert info.generation == main.commit_info(repo, first).generation + 1
+
+
+def test_append_after_torn_record_stays_aligned(repo):
+    first = commit_files({"a.txt": "a\n"}, "one")
+    with open(main.commit_graph_path(repo), "ab") as graph_file:
+        graph_file.write(b"\x01\x02\x03")
+    second = commit_files({"b.txt": "b\n"}, "two")
+    third = commit_files({"c.txt": "c\n"}, "three")
+
+    graph = main.load_commit_graph(repo)
+    assert graph["hashes"] == [first, second, third]
+    assert main.commit_info(repo, third).parents == [second]
+    assert main.commit_info(repo, third).generation == 3
+
+
+def test_merge_base_uses_generations(repo):
+    base = commit_files({"a.txt": "a\n"}, "one")
+    main.branch("feature")
+    theirs = commit_files({"b.txt": "b\n"}, "feature")
+    main.checkout_branch("master")
+    ours = commit_files({"a.txt": "ours\n"}, "two")
+
+    assert main.merge_base(repo, ours, theirs) == base
+    assert main.is_ancestor(repo, base, theirs)
+    assert not main.is_ancestor(repo, theirs, ours)
+
+
+def test_merge_base_without_commit_graph(repo):
+    base = commit_files({"a.txt": "a\n"}, "one")
+    main.branch("feature")
+    theirs = commit_files({"b.txt": "b\n"}, "feature")
+    main.checkout_branch("master")
+    ours = commit_files({"a.txt": "ours\n"}, "two")
+    os.remove(main.commit_graph_path(repo))
+
+    assert main.commit_info(repo, ours).generation is None
+    assert main.merge_base_by_walk(repo, ours, theirs) == base
+    assert main.is_ancestor(repo, base, ours)
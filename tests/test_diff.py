@@ -0,0 +1,91 @@
+import random
+import re
+
+import pytest
+
+import main
+from conftest import commit_files
+from diff import count_changes, diff_lines, is_binary, unified_diff
+
+
+def lcs_length(a, b):
+    previous = [0] * (len(b) + 1)
+    for x in a:
+        current = [0]
+        for j, y in enumerate(b):
+            current.append(previous[j] + 1 if x == y else max(previous[j + 1], current[j]))
+        previous = current
+    return previous[-1]
+
+
+def apply_opcodes(a, b, opcodes):
+    # rebuilds b from a, checking the opcodes tile both sides without gaps
+    result = []
+    i = j = 0
+    for tag, i1, i2, j1, j2 in opcodes:
+        assert (i1, j1) == (i, j)
+        if tag == "equal":
+            assert a[i1:i2] == b[j1:j2]
+            result.extend(a[i1:i2])
+        else:
+            result.extend(b[j1:j2])
+        i, j = i2, j2
+    assert (i, j) == (len(a), len(b))
+    return result
+
+
+def random_lines(generator, size):
+    return [f"{generator.randrange(6)}\n" for _ in range(size)]
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_diff_is_minimal_and_rebuilds_the_target(seed):
+    generator = random.Random(seed)
+    a = random_lines(generator, generator.randrange(30))
+    b = random_lines(generator, generator.randrange(30))
+    opcodes = diff_lines(a, b)
+
+    assert apply_opcodes(a, b, opcodes) == b
+    added, removed = count_changes(opcodes)
+    assert added + removed == len(a) + len(b) - 2 * lcs_length(a, b)
+
+
+def test_expensive_diff_falls_back_to_a_valid_replacement():
+    generator = random.Random(1)
+    a = random_lines(generator, 300)
+    b = random_lines(generator, 300)
+    assert apply_opcodes(a, b, diff_lines(a, b, max_cost=5)) == b
+
+
+@pytest.mark.parametrize("a, b", [([], []), ([], ["x\n"]), (["x\n"], []), (["x\n"], ["x\n"])])
+def test_diff_edge_cases(a, b):
+    assert apply_opcodes(a, b, diff_lines(a, b)) == b
+
+
+def test_unified_diff_hunks():
+    a = [f"{i}\n" for i in range(20)]
+    b = a[:2] + ["new\n"] + a[2:15] + a[16:]
+    lines = list(unified_diff(a, b, diff_lines(a, b), "a/f", "b/f"))
+    assert lines[:2] == ["--- a/f", "+++ b/f"]
+    hunks = [line for line in lines if line.startswith("@@")]
+    assert hunks == ["@@ -1,5 +1,6 @@", "@@ -13,7 +14,6 @@"]
+    assert "+new\n" in lines and "-15\n" in lines
+    assert list(unified_diff(a, a, diff_lines(a, a), "a/f", "b/f")) == []
+
+
+def test_binary_detection():
+    assert is_binary(b"abc\0def")
+    assert not is_binary(b"plain text\n")
+
+
+def test_diff_command_between_commits(repo, capsys):
+    first = commit_files({"a.txt": "one\ntwo\nthree\n"}, "one")
+    second = commit_files({"a.txt": "one\n2\nthree\n"}, "two")
+    capsys.readouterr()
+
+    assert main.run_command(["diff", first[:7], second[:7]])
+    out = re.sub(r"\x1b\[[0-9;]*m", "", capsys.readouterr().out)
+    assert "-two" in out and "+2" in out
+    assert main.run_command(["diff", first, second, "--stat"])
+    assert "a.txt" in capsys.readouterr().out
+    assert main.run_command(["diff", "nothing", second]) is False
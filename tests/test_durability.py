@@ -0,0 +1,40 @@
+import os
+
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize("level", main.DURABILITY_LEVELS)
+def test_objects_written_in_a_transaction_are_stored(repo, level):
+    main.config("core.durability", level)
+    with main.transaction(repo):
+        object_hash = main.write_object(repo, b"content\n")
+        # readable before the batch renames it into place
+        assert main.object_exists(repo, object_hash)
+        assert main.load_object(repo, object_hash) == ("blob", b"content\n")
+    assert os.path.exists(main.object_path(repo, object_hash))
+    assert not [name for name in os.listdir(os.path.join(repo, "objects")) if name.startswith("tmp-")]
+
+
+def test_flush_tolerates_a_fan_out_directory_made_meanwhile(repo):
+    with main.transaction(repo):
+        object_hash = main.write_object(repo, b"raced\n")
+        # another process creates the same fan-out directory before this batch flushes
+        os.makedirs(os.path.dirname(main.object_path(repo, object_hash)), exist_ok=True)
+    assert main.load_object(repo, object_hash) == ("blob", b"raced\n")
+
+
+def test_ref_published_in_a_batch_follows_its_objects(repo, monkeypatch):
+    order = []
+    replace = os.replace
+    monkeypatch.setattr(main.os, "replace", lambda src, dst: order.append(dst) or replace(src, dst))
+    with main.transaction(repo):
+        object_hash = main.write_object(repo, b"x\n")
+        main.repository(repo).write_ref("refs/tags/x", object_hash)
+    assert order.index(main.object_path(repo, object_hash)) < order.index(os.path.join(repo, "refs", "tags", "x"))
+
+
+def test_unknown_durability_is_refused(repo):
+    assert main.config("core.durability", "sometimes") is False
+    assert main.durability(repo) == main.CONFIG_DEFAULTS["core"]["durability"]
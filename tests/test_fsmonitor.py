@@ -0,0 +1,99 @@
+import os
+import re
+import time
+
+import pytest
+
+import main
+from conftest import commit_files, write
+
+pytestmark = pytest.mark.skipif(main.load_inotify() is None, reason="needs inotify")
+
+
+def plain(out):
+    return re.sub(r"\x1b\[[0-9;]*m", "", out)
+
+
+@pytest.fixture
+def monitor(repo):
+    commit_files({"a.txt": "a\n", "b.txt": "b\n", "src/c.txt": "c\n"}, "one")
+    assert main.fsmonitor("start") is not False
+    yield main._monitor
+    if main._monitor is not None:
+        main.fsmonitor("stop")
+
+
+def wait_for(monitor, *paths):
+    # events arrive on the watcher's thread, a moment after the change
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        changes = monitor.changes()
+        if changes is not None and set(paths) <= changes[0]:
+            return
+        time.sleep(0.01)
+    raise AssertionError(f"no events for {paths}")
+
+
+def settle(monitor):
+    # a status run clears everything it finds unchanged
+    main.status()
+    assert not monitor.changes()[0]
+
+
+def test_status_with_monitor_matches_a_full_scan(monitor, capsys):
+    settle(monitor)
+    write("a.txt", "edited\n")
+    os.remove("b.txt")
+    write("new/d.txt", "d\n")
+    wait_for(monitor, "a.txt", "b.txt", "new/d.txt")
+    capsys.readouterr()
+
+    main.status()
+    watched = plain(capsys.readouterr().out)
+    main.fsmonitor("stop")
+    capsys.readouterr()
+    main.status()
+    scanned = plain(capsys.readouterr().out)
+    assert watched == scanned
+    assert "a.txt" in watched and "b.txt" in watched and "new/d.txt" in watched
+
+
+def test_files_found_clean_leave_the_dirty_set(monitor):
+    settle(monitor)
+    write("a.txt", "edited\n")
+    wait_for(monitor, "a.txt")
+    assert monitor.changes()[0] == {"a.txt"}
+
+    main.add(["a.txt"])
+    main.status()
+    assert "a.txt" not in monitor.changes()[0]
+
+
+def test_add_and_commit_all_use_the_monitor(monitor, repo):
+    settle(monitor)
+    write("src/c.txt", "changed\n")
+    write("src/deep/e.txt", "e\n")
+    wait_for(monitor, "src/c.txt", "src/deep/e.txt")
+
+    main.add(["src"])
+    assert set(main.read_index(repo)) == {"a.txt", "b.txt", "src/c.txt", "src/deep/e.txt"}
+    write("a.txt", "edited\n")
+    wait_for(monitor, "a.txt")
+    assert main.commit("two", stage_all=True) is not False
+    files = main.read_tree(repo, main.commit_tree_hash(repo, main.get_current_commit()))
+    assert files["a.txt"] == main.write_object(repo, b"edited\n")
+    assert files["src/c.txt"] == main.write_object(repo, b"changed\n")
+
+
+def test_overflow_makes_the_monitor_rescan(monitor):
+    settle(monitor)
+    monitor.handle(-1, main.IN_Q_OVERFLOW, "")
+    assert monitor.changes() is None
+    # restarted, so every file is a candidate again
+    assert {"a.txt", "b.txt", "src/c.txt"} <= monitor.changes()[0]
+
+
+def test_ignore_file_change_restarts_the_monitor(monitor, repo):
+    settle(monitor)
+    write(os.path.join(repo, ".gitignore"), "*.log\n")
+    assert monitor.changes() is None
@@ -0,0 +1,96 @@
+import os
+import time
+
+import main
+from conftest import commit_files
+
+OLD = time.time() - 30 * 24 * 3600
+
+
+def age(path):
+    os.utime(path, (OLD, OLD))
+
+
+def age_loose_objects(repo):
+    for _, path in main.iter_loose_objects(repo):
+        age(path)
+
+
+def test_gc_removes_only_old_unreachable_objects(repo):
+    commit_files({"a.txt": "a\n", "src/b.txt": "b\n"}, "one")
+    kept = {object_hash for object_hash, _ in main.iter_loose_objects(repo)}
+    garbage = main.write_object(repo, b"garbage\n")
+    age_loose_objects(repo)
+    young = main.write_object(repo, b"young garbage\n")
+
+    main.gc()
+
+    remaining = {object_hash for object_hash, _ in main.iter_loose_objects(repo)}
+    assert remaining == kept | {young}
+    assert garbage not in remaining
+
+
+def test_gc_keeps_staged_but_uncommitted_blobs(repo):
+    commit_files({"a.txt": "a\n"}, "one")
+    with open("new.txt", "w") as new_file:
+        new_file.write("staged\n")
+    main.add(["new.txt"])
+    age_loose_objects(repo)
+
+    main.gc()
+    assert main.load_object(repo, main.read_index(repo)["new.txt"].hash) == ("blob", b"staged\n")
+
+
+def test_gc_keeps_history_of_every_branch(repo):
+    commit_files({"a.txt": "a\n"}, "one")
+    main.branch("feature")
+    feature = commit_files({"f.txt": "feature\n"}, "feature")
+    main.checkout_branch("master")
+    age_loose_objects(repo)
+
+    main.gc(prune_expire=0)
+    assert main.read_tree(repo, main.commit_tree_hash(repo, feature)) is not None
+    assert main.load_object(repo, main.read_tree(repo, main.commit_tree_hash(repo, feature))["f.txt"])[1] == b"feature\n"
+
+
+def test_reused_old_object_is_freshened(repo):
+    commit_files({"a.txt": "a\n"}, "one")
+    orphan = main.write_object(repo, b"orphan\n")
+    age(main.object_path(repo, orphan))
+
+    # the same content again, as add would store it, before anything points to it
+    assert main.write_object(repo, b"orphan\n") == orphan
+    main.gc()
+    assert main.object_exists(repo, orphan)
+
+    with open("again.txt", "w") as again_file:
+        again_file.write("orphan\n")
+    age(main.object_path(repo, orphan))
+    assert main.write_object_from_file(repo, "again.txt") == orphan
+    main.gc()
+    assert main.object_exists(repo, orphan)
+
+
+def test_reused_packed_object_freshens_its_pack(repo):
+    commit_files({"a.txt": "a\n"}, "one")
+    orphan = main.write_object(repo, b"orphan\n")
+    main.repack()
+    pack_path = main.load_packs(repo)[0]["path"]
+    age(pack_path)
+
+    main.write_object(repo, b"orphan\n")
+    assert os.path.getmtime(pack_path) > OLD + 1
+    main.gc()
+    assert main.object_exists(repo, orphan)
+
+
+def test_gc_drops_unreachable_objects_from_old_packs(repo):
+    commit = commit_files({"a.txt": "a\n"}, "one")
+    garbage = main.write_object(repo, b"garbage\n")
+    main.repack()
+    age(main.load_packs(repo)[0]["path"])
+
+    main.gc()
+    assert not main.object_exists(repo, garbage)
+    assert main.object_exists(repo, commit)
+    assert main.read_tree(repo, main.commit_tree_hash(repo, commit)) == {"a.txt": main.write_object(repo, b"a\n")}
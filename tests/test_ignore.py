@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+import main
+from conftest import write
+
+
+@pytest.mark.parametrize(
+    "rules, path, is_dir, expected",
+    [
+        (["*.log"], "debug.log", False, True),
+        (["*.log"], "deep/dir/debug.log", False, True),
+        (["*.log"], "debug.log.txt", False, False),
+        (["/top.txt"], "top.txt", False, True),
+        (["/top.txt"], "sub/top.txt", False, False),
+        (["build/"], "build", True, True),
+        (["build/"], "build", False, False),
+        (["build/"], "build/out.o", False, True),
+        (["docs/*.md"], "docs/a.md", False, True),
+        (["docs/*.md"], "docs/sub/a.md", False, False),
+        (["docs/**/*.md"], "docs/sub/deep/a.md", False, True),
+        (["**/cache"], "a/b/cache", True, True),
+        (["file?.txt"], "file1.txt", False, True),
+        (["file?.txt"], "file10.txt", False, False),
+        (["[ab].txt"], "b.txt", False, True),
+        (["[!ab].txt"], "b.txt", False, False),
+        (["\\#hash"], "#hash", False, True),
+        (["# comment", "", "x"], "# comment", False, False),
+        (["*.log", "!keep.log"], "keep.log", False, False),
+        (["*.log", "!keep.log"], "drop.log", False, True),
+        (["!keep.log", "*.log"], "keep.log", False, True),
+        (["logs/", "!logs/keep.log"], "logs/keep.log", False, True),
+        ([], ".trek/index", False, True),
+        ([], "a.txt", False, False),
+    ],
+)
+def test_ignore_rules(rules, path, is_dir, expected):
+    assert main.compile_ignore_rules(rules)(path, is_dir=is_dir) is expected
+
+
+def test_matcher_is_recompiled_when_gitignore_changes(repo):
+    ignore_path = os.path.join(repo, ".gitignore")
+    write(ignore_path, "*.tmp\n")
+    assert main.get_ignore_matcher()("a.tmp")
+    assert main.get_ignore_matcher() is main.get_ignore_matcher()
+
+    write(ignore_path, "*.bak\n")
+    assert not main.get_ignore_matcher()("a.tmp")
+    assert main.get_ignore_matcher()("a.bak")
+
+
+def test_add_skips_ignored_files_and_directories(repo):
+    write(os.path.join(repo, ".gitignore"), "*.log\nbuild/\n")
+    write("a.txt", "a\n")
+    write("debug.log", "log\n")
+    write("build/out.o", "binary\n")
+    write("src/b.txt", "b\n")
+    write("src/trace.log", "log\n")
+
+    main.add(["."])
+    assert set(main.read_index(repo)) == {"a.txt", "src/b.txt"}
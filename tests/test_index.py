@@ -0,0 +1,73 @@
+import json
+import os
+
+import pytest
+
+import main
+from conftest import commit_files, write
+
+
+def head_files(repo):
+    return main.read_tree(repo, main.commit_tree_hash(repo, main.get_current_commit()))
+
+
+def test_index_round_trip_with_tree_extension(repo):
+    commit_files({"a.txt": "a\n", "src/b.txt": "b\n", "src/lib/c.txt": "c\n"}, "one")
+
+    index = main.read_index(repo)
+    assert set(index) == {"a.txt", "src/b.txt", "src/lib/c.txt"}
+    assert set(index.trees) == {"", "src", "src/lib"}
+
+    with main.lock_index(repo) as lock:
+        main.write_index(repo, index, lock)
+    again = main.read_index(repo)
+    assert dict(again) == dict(index)
+    assert again.trees == index.trees
+
+
+def test_staging_a_file_drops_the_trees_above_it(repo):
+    commit_files({"a.txt": "a\n", "src/b.txt": "b\n", "docs/c.txt": "c\n"}, "one")
+    write("src/b.txt", "changed\n")
+    main.add(["src/b.txt"])
+    assert set(main.read_index(repo).trees) == {"docs"}
+
+
+def test_index_checksum_detects_corruption(repo):
+    commit_files({"a.txt": "a\n"}, "one")
+    index_path = os.path.join(repo, "index")
+    with open(index_path, "r+b") as index_file:
+        index_file.seek(20)
+        byte = index_file.read(1)
+        index_file.seek(20)
+        index_file.write(bytes([byte[0] ^ 0xFF]))
+    with pytest.raises(ValueError):
+        main.read_index(repo)
+
+
+def test_unchanged_files_are_not_rehashed(repo, monkeypatch):
+    commit_files({"a.txt": "a\n", "b.txt": "b\n"}, "one")
+    # entries written within the racy window carry no mtime, so one more add settles them
+    os.utime("a.txt", (1_000_000, 1_000_000))
+    os.utime("b.txt", (1_000_000, 1_000_000))
+    main.add(["."])
+
+    stored = []
+    store_file = main.store_file
+    monkeypatch.setattr(main, "store_file", lambda *args: stored.append(args[1]) or store_file(*args))
+    write("b.txt", "changed\n")
+    main.add(["."])
+    assert stored == ["b.txt"]
+
+
+def test_legacy_json_index_keeps_files_committed_before_it(repo):
+    commit_files({"a.txt": "a\n", "b.txt": "b\n"}, "one")
+    # the JSON index only listed what was staged since the last commit
+    write("c.txt", "c\n")
+    staged = {"c.txt": main.write_object(repo, b"c\n")}
+    with open(os.path.join(repo, "index"), "w") as index_file:
+        json.dump(staged, index_file)
+    main._repositories.clear()
+
+    assert set(main.read_index(repo)) == {"a.txt", "b.txt", "c.txt"}
+    assert main.commit("two") is not False
+    assert set(head_files(repo)) == {"a.txt", "b.txt", "c.txt"}
@@ -0,0 +1,114 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import main
+from conftest import commit_files, write
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_lock_file_replaces_its_target_only_on_success(tmp_path):
+    path = str(tmp_path / "target")
+    with open(path, "w") as target:
+        target.write("old")
+
+    with main.LockFile(path) as lock:
+        lock.write(b"new")
+        assert os.path.exists(path + ".lock")
+    assert open(path).read() == "new"
+
+    with pytest.raises(RuntimeError):
+        with main.LockFile(path) as lock:
+            lock.write(b"half")
+            raise RuntimeError
+    assert open(path).read() == "new"
+    assert not os.path.exists(path + ".lock")
+
+
+def test_held_lock_times_out(tmp_path):
+    path = str(tmp_path / "target")
+    with main.LockFile(path):
+        assert not main.LockFile(path, timeout=0).acquire()
+        with pytest.raises(TimeoutError):
+            with main.LockFile(path, timeout=0.05):
+                pass
+
+
+def test_command_waiting_on_a_stale_lock_fails_cleanly(repo, monkeypatch):
+    commit_files({"a.txt": "a\n"}, "one")
+    # the timeout default is bound when lock_index is defined
+    monkeypatch.setattr(main.lock_index, "__defaults__", (0.05,))
+    open(os.path.join(repo, "index.lock"), "w").close()
+    write("a.txt", "changed\n")
+    assert main.run_command(["add", "a.txt"]) is False
+
+
+def test_update_ref_compares_and_swaps(repo):
+    refs = main.repository(repo)
+    assert refs.update_ref("refs/tags/t", "aa" * 20, None)
+    assert not refs.update_ref("refs/tags/t", "bb" * 20, None)
+    assert not refs.update_ref("refs/tags/t", "bb" * 20, "cc" * 20)
+    assert refs.update_ref("refs/tags/t", "bb" * 20, "aa" * 20)
+    assert refs.read_ref("refs/tags/t") == "bb" * 20
+
+
+def test_commit_does_not_build_on_a_branch_moved_underneath_it(repo, monkeypatch):
+    commit_files({"a.txt": "a\n"}, "one")
+    pushed = main.create_commit(repo, main.write_tree(repo, {"pushed.txt": "11" * 20}), [], "pushed")
+    create_commit = main.create_commit
+
+    def racing_create_commit(*args):
+        # another writer moves the branch after this commit read it
+        main.repository().update_ref("refs/heads/master", pushed, main.get_current_commit())
+        return create_commit(*args)
+
+    write("a.txt", "changed\n")
+    main.add(["a.txt"])
+    monkeypatch.setattr(main, "create_commit", racing_create_commit)
+    assert main.commit("two") is False
+    assert main.get_current_commit() == pushed
+
+
+def test_concurrent_commits_lose_nothing(repo):
+    commit_files({"base.txt": "base\n"}, "base")
+    script = "import main, sys; main.add([sys.argv[1]]); sys.exit(0 if main.commit(sys.argv[1]) is not False else 1)"
+    processes = []
+    for i in range(6):
+        write(f"f{i}.txt", f"{i}\n")
+        processes.append(
+            subprocess.Popen(
+                [sys.executable, "-c", script, f"f{i}.txt"],
+                env={**os.environ, "PYTHONPATH": HERE},
+                stdout=subprocess.DEVNULL,
+            )
+        )
+    codes = [process.wait() for process in processes]
+    main._repositories.clear()
+
+    committed = [f"f{i}.txt" for i, code in enumerate(codes) if code == 0]
+    assert committed
+    files = main.read_tree(repo, main.commit_tree_hash(repo, main.get_current_commit()))
+    # every successful commit's file is in the final tree, none was reverted by a later one
+    assert set(committed) <= set(files)
+    assert len(list(main.iter_commits(repo, main.get_current_commit()))) == len(committed) + 1
+
+
+def test_concurrent_adds_keep_every_entry(repo):
+    script = "import main, sys; main.add(sys.argv[1:])"
+    processes = []
+    for i in range(6):
+        names = [f"d{i}/f{j}.txt" for j in range(10)]
+        for name in names:
+            write(name, f"{name}\n")
+        processes.append(
+            subprocess.Popen(
+                [sys.executable, "-c", script, *names],
+                env={**os.environ, "PYTHONPATH": HERE},
+                stdout=subprocess.DEVNULL,
+            )
+        )
+    assert [process.wait() for process in processes] == [0] * 6
+    assert len(main.read_index(repo)) == 60
@@ -0,0 +1,58 @@
+import re
+
+import main
+from conftest import commit_files
+
+
+def logged_messages(out):
+    return [re.sub(r"\x1b\[[0-9;]*m", "", line).split()[-1] for line in out.strip().splitlines()]
+
+
+def make_history():
+    commit_files({"a.txt": "a\n"}, "one")
+    commit_files({"src/b.txt": "b\n"}, "two")
+    commit_files({"a.txt": "changed\n"}, "three")
+    commit_files({"src/c.txt": "c\n"}, "four")
+
+
+def test_log_pages_newest_first(repo, capsys):
+    make_history()
+    capsys.readouterr()
+
+    assert main.run_command(["log", "--oneline"])
+    assert logged_messages(capsys.readouterr().out) == ["four", "three", "two", "one"]
+    assert main.run_command(["log", "--oneline", "-n", "2", "--skip", "1"])
+    assert logged_messages(capsys.readouterr().out) == ["three", "two"]
+    assert main.run_command(["log", "--oneline", "-n1"])
+    assert logged_messages(capsys.readouterr().out) == ["four"]
+
+
+def test_log_limited_to_paths(repo, capsys):
+    make_history()
+    capsys.readouterr()
+
+    assert main.run_command(["log", "--oneline", "--", "src"])
+    assert logged_messages(capsys.readouterr().out) == ["four", "two"]
+    assert main.run_command(["log", "--oneline", "a.txt"])
+    assert logged_messages(capsys.readouterr().out) == ["three", "one"]
+
+
+def test_log_dot_means_whole_repository(repo, capsys):
+    make_history()
+    capsys.readouterr()
+
+    assert main.run_command(["log", "--oneline", "--", "."])
+    assert logged_messages(capsys.readouterr().out) == ["four", "three", "two", "one"]
+    assert main.run_command(["log", "--oneline", "./"])
+    assert len(logged_messages(capsys.readouterr().out)) == 4
+
+
+def test_log_stat_and_patch(repo, capsys):
+    make_history()
+    capsys.readouterr()
+
+    assert main.run_command(["log", "-n", "1", "--skip", "1", "--patch"])
+    out = re.sub(r"\x1b\[[0-9;]*m", "", capsys.readouterr().out)
+    assert "-a" in out and "+changed" in out
+    assert main.run_command(["log", "-n", "1", "--stat"])
+    assert "src/c.txt" in capsys.readouterr().out
@@ -0,0 +1,109 @@
+import os
+
+import main
+from conftest import commit_files, read, write
+from diff import merge3
+
+
+def diverge(ours_extra=True):
+    # master has a.txt, feature adds notes.txt; master optionally moves on as well
+    commit_files({"a.txt": "a\n"}, "one")
+    main.branch("feature")
+    commit_files({"notes.txt": "theirs\n"}, "feature")
+    main.checkout_branch("master")
+    if ours_extra:
+        commit_files({"a.txt": "ours\n"}, "two")
+    assert not os.path.exists("notes.txt")
+
+
+def test_merge3_takes_both_sides_of_separate_changes():
+    base = ["a\n", "b\n", "c\n", "d\n", "e\n"]
+    ours = ["A\n", "b\n", "c\n", "d\n", "e\n"]
+    theirs = ["a\n", "b\n", "c\n", "d\n", "E\n"]
+    assert merge3(base, ours, theirs, "ours", "theirs") == (["A\n", "b\n", "c\n", "d\n", "E\n"], 0)
+
+
+def test_merge3_same_change_on_both_sides_is_clean():
+    base = ["a\n", "b\n"]
+    changed = ["a\n", "B\n"]
+    assert merge3(base, changed, changed, "ours", "theirs") == (changed, 0)
+
+
+def test_merge3_marks_overlapping_changes():
+    base = ["a\n", "b\n", "c\n"]
+    ours = ["a\n", "ours\n", "c\n"]
+    theirs = ["a\n", "theirs\n", "c\n"]
+    lines, conflicts = merge3(base, ours, theirs, "ours", "theirs")
+    assert conflicts == 1
+    text = "".join(lines)
+    assert "ours\n" in text and "theirs\n" in text
+    assert text.startswith("a\n") and text.endswith("c\n")
+
+
+def test_merge_takes_both_sides(repo):
+    diverge()
+    assert main.merge("feature") is not False
+    assert read("notes.txt") == "theirs\n"
+    assert read("a.txt") == "ours\n"
+    assert len(main.commit_info(repo, main.get_current_commit()).parents) == 2
+
+
+def test_fast_forward_merge(repo):
+    diverge(ours_extra=False)
+    theirs = main.repository().read_ref("refs/heads/feature")
+    assert main.merge("feature") is not False
+    assert main.get_current_commit() == theirs
+    assert read("notes.txt") == "theirs\n"
+
+
+def test_conflict_is_finished_by_commit(repo):
+    commit_files({"a.txt": "a\nb\nc\n"}, "one")
+    main.branch("feature")
+    theirs = commit_files({"a.txt": "a\ntheirs\nc\n"}, "feature")
+    main.checkout_branch("master")
+    ours = commit_files({"a.txt": "a\nours\nc\n"}, "two")
+
+    assert main.merge("feature") is False
+    assert main.repository().read_ref("MERGE_HEAD") == theirs
+    assert "<<<<<<<" in read("a.txt")
+
+    write("a.txt", "a\nboth\nc\n")
+    main.add(["a.txt"])
+    assert main.commit("merged") is not False
+    assert main.commit_info(repo, main.get_current_commit()).parents == [ours, theirs]
+    assert main.repository().read_ref("MERGE_HEAD") is None
+
+
+def test_three_way_merge_keeps_untracked_file(repo):
+    diverge()
+    write("notes.txt", "mine\n")
+    head = main.get_current_commit()
+
+    assert main.merge("feature") is False
+    assert read("notes.txt") == "mine\n"
+    assert main.get_current_commit() == head
+    assert main.repository().read_ref("MERGE_HEAD") is None
+
+
+def test_fast_forward_merge_keeps_untracked_file(repo):
+    diverge(ours_extra=False)
+    write("notes.txt", "mine\n")
+    head = main.get_current_commit()
+
+    assert main.merge("feature") is False
+    assert read("notes.txt") == "mine\n"
+    assert main.get_current_commit() == head
+
+
+def test_merge_interrupted_at_the_ref_update_can_be_committed(repo, monkeypatch):
+    diverge()
+    ours = main.get_current_commit()
+    theirs = main.repository().read_ref("refs/heads/feature")
+    with monkeypatch.context() as patch:
+        patch.setattr(main.Repository, "update_ref", lambda self, name, value, expected: False)
+        assert main.merge("feature") is False
+    assert main.repository().read_ref("MERGE_HEAD") == theirs
+
+    assert main.commit("finish merge") is not False
+    assert main.commit_info(repo, main.get_current_commit()).parents == [ours, theirs]
+    assert main.repository().read_ref("MERGE_HEAD") is None
@@ -0,0 +1,56 @@
+import hashlib
+import os
+import shutil
+
+import pytest
+
+import main
+from conftest import commit_files
+
+
+@pytest.fixture(params=sorted(main.OBJECT_FORMATS))
+def formatted_repo(request, repo):
+    # the fixture's repository is recreated with each object format in turn
+    shutil.rmtree(repo)
+    main._repositories.clear()
+    main.init(request.param)
+    return repo, request.param
+
+
+def test_every_format_round_trips(formatted_repo):
+    repo, object_format = formatted_repo
+    head = commit_files({"a.txt": "a\n", "src/b.txt": "b\n"}, "one")
+    hash_size = main.new_hasher(repo).digest_size
+    assert len(head) == 2 * hash_size
+
+    main.repack()
+    main._repositories.clear()
+    files = main.read_tree(repo, main.commit_tree_hash(repo, head))
+    assert main.load_object(repo, files["src/b.txt"]) == ("blob", b"b\n")
+    assert main.read_index(repo)["a.txt"].hash == files["a.txt"]
+    if object_format == "sha256":
+        assert files["a.txt"] == hashlib.sha256(b"a\n").hexdigest()
+
+
+def test_format_cannot_change_after_init(repo):
+    assert main.config("core.object_format", "sha256") is False
+    assert main.object_format(repo) == "sha1"
+
+
+def test_unknown_format_is_refused(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    main._repositories.clear()
+    assert main.init("md5") is False
+    assert not os.path.exists(".trek")
+
+
+def test_push_between_formats_is_refused(repo, tmp_path, monkeypatch):
+    commit_files({"a.txt": "a\n"}, "one")
+    other = tmp_path / "other"
+    other.mkdir()
+    monkeypatch.chdir(other)
+    main.init("sha256")
+    monkeypatch.chdir(tmp_path)
+
+    assert main.push_remote(str(other), "master:incoming") is False
+    assert main.repository(str(other / ".trek")).read_ref("refs/heads/incoming") is None
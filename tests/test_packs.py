@@ -0,0 +1,66 @@
+import random
+
+import pytest
+
+import main
+from conftest import commit_files
+
+
+def random_bytes(size, seed=0):
+    return random.Random(seed).randbytes(size)
+
+
+"_______Deltas_______"
+
+
+@pytest.mark.parametrize(
+    "base, target",
+    [
+        (b"", b""),
+        (b"", b"new content"),
+        (b"old content", b""),
+        (b"line\n" * 500, b"line\n" * 250 + b"inserted\n" + b"line\n" * 250),
+        (random_bytes(5000, 1), random_bytes(5000, 1)[:2000] + random_bytes(300, 2) + random_bytes(5000, 1)[2500:]),
+        (random_bytes(4000, 3), random_bytes(4000, 4)),
+    ],
+)
+def test_delta_round_trip(base, target):
+    assert main.apply_delta(base, main.create_delta(base, target)) == target
+
+
+def test_delta_against_wrong_base_fails():
+    base = b"abcdefgh" * 100
+    delta = main.create_delta(base, base + b"tail")
+    with pytest.raises(ValueError):
+        main.apply_delta(base[:-10], delta)
+
+
+"_______Packs_______"
+
+
+def test_pack_round_trip_with_deltas(repo):
+    base = "\n".join(f"line {i}" for i in range(2000)) + "\n"
+    contents = [base, base.replace("line 1000\n", "changed\n"), base + "appended\n"]
+    hashes = []
+    for i, content in enumerate(contents):
+        commit_files({"big.txt": content, f"small{i}.txt": f"{i}\n"}, f"commit {i}")
+        hashes.append(main.hash_file(repo, "big.txt"))
+
+    expected = {object_hash: main.load_object(repo, object_hash) for object_hash, _ in main.iter_loose_objects(repo)}
+    main.repack()
+
+    assert list(main.iter_loose_objects(repo)) == []
+    packs = main.load_packs(repo)
+    assert len(packs) == 1
+    assert packs[0]["count"] == len(expected)
+    for object_hash, stored in expected.items():
+        assert main.load_object(repo, object_hash) == stored
+    assert main.load_object(repo, hashes[1])[1] == contents[1].encode()
+
+
+def test_pack_index_misses_unknown_hashes(repo):
+    commit_files({"a.txt": "a\n"}, "one")
+    main.repack()
+    assert main.find_packed_object(repo, "00" * 20) is None
+    assert main.find_packed_object(repo, "ff" * 20) is None
+    assert main.find_packed_object(repo, "not hex") is None
@@ -0,0 +1,68 @@
+import os
+import re
+
+import pytest
+
+import main
+from conftest import commit_files
+
+
+def plain(out):
+    return re.sub(r"\x1b\[[0-9;]*m", "", out)
+
+
+def test_packed_refs_are_found_and_loose_refs_win(repo):
+    first = commit_files({"a.txt": "a\n"}, "one")
+    for name in ("b", "a", "c/d"):
+        assert main.run_command(["tag", name])
+    main.pack_refs()
+    refs = main.repository(repo)
+    assert not os.path.exists(os.path.join(repo, "refs", "tags", "a"))
+
+    second = commit_files({"a.txt": "changed\n"}, "two")
+    refs.write_ref("refs/tags/b", second)
+    main._repositories.clear()
+
+    refs = main.repository(repo)
+    assert refs.read_ref("refs/tags/a") == first
+    assert refs.read_ref("refs/tags/b") == second
+    assert refs.read_ref("refs/tags/c/d") == first
+    assert refs.read_ref("refs/tags/missing") is None
+    assert [name for name, _ in refs.list_refs("refs/tags/")] == ["refs/tags/a", "refs/tags/b", "refs/tags/c/d"]
+
+
+def test_deleted_packed_ref_stays_deleted(repo):
+    commit_files({"a.txt": "a\n"}, "one")
+    main.tag("old")
+    main.pack_refs()
+    main.repository(repo).delete_ref("refs/tags/old")
+    main._repositories.clear()
+    assert main.repository(repo).read_ref("refs/tags/old") is None
+
+
+def test_options_list_branches_instead_of_naming_one(repo, capsys):
+    commit_files({"a.txt": "a\n"}, "one")
+    for name in ("b1", "b2", "b3"):
+        main.repository(repo).update_ref(f"refs/heads/{name}", main.get_current_commit(), None)
+    capsys.readouterr()
+
+    assert main.run_command(["branch", "-n", "2"])
+    assert main.run_command(["branch", "--skip", "1", "b"])
+    assert main.run_command(["tag", "--skip", "1"])
+    out = plain(capsys.readouterr().out)
+    assert "b1" in out and "(1-2 of 4" in out and "(2-3 of 3" in out
+    refs = [name for name, _ in main.repository(repo).list_refs("refs/")]
+    assert not any(name.rpartition("/")[2].startswith("-") for name in refs)
+    assert main.repository(repo).head_branch() == "refs/heads/master"
+
+
+def test_unknown_option_is_an_error(repo):
+    assert main.run_command(["branch", "-x"]) is False
+
+
+@pytest.mark.parametrize("name", ["-n", "--skip", "topic.lock", "a..b", "../escape"])
+def test_bad_ref_names_are_refused(repo, name):
+    commit_files({"a.txt": "a\n"}, "one")
+    assert main.branch(name) is False
+    assert main.tag(name) is False
+    assert [ref for ref, _ in main.repository(repo).list_refs("refs/")] == ["refs/heads/master"]
@@ -0,0 +1,115 @@
+import os
+
+import pytest
+
+import main
+from conftest import commit_files, read
+
+
+@pytest.fixture
+def remote(repo, tmp_path, monkeypatch):
+    # a second repository next to the test's own, with nothing checked out in the way
+    path = tmp_path / "remote"
+    path.mkdir()
+    monkeypatch.chdir(path)
+    main.init()
+    main.config("receive.deny_current_branch", "false")
+    monkeypatch.chdir(tmp_path)
+    return str(path)
+
+
+def remote_repo(remote):
+    return main.repository(os.path.join(remote, ".trek"))
+
+
+def test_push_sends_only_missing_objects(repo, remote):
+    commit_files({"a.txt": "a\n", "src/b.txt": "b\n"}, "one")
+    assert main.push_remote(remote, "master") is not False
+    assert remote_repo(remote).read_ref("refs/heads/master") == main.get_current_commit()
+
+    head = commit_files({"src/b.txt": "changed\n"}, "two")
+    haves = {value for _, value in remote_repo(remote).list_refs("refs/")}
+    commits, objects = main.missing_objects(repo, remote_repo(remote).path, head, haves)
+    # the commit, the root and src trees, and the one changed blob
+    assert commits == 1
+    assert len(objects) == 4
+
+    assert main.push_remote(remote, "master") is not False
+    remote_path = remote_repo(remote).path
+    files = main.read_tree(remote_path, main.commit_tree_hash(remote_path, head))
+    assert main.load_object(remote_path, files["src/b.txt"]) == ("blob", b"changed\n")
+    assert main.load_object(remote_path, files["a.txt"]) == ("blob", b"a\n")
+
+
+def test_push_that_is_not_a_fast_forward_needs_force(repo, remote):
+    commit_files({"a.txt": "a\n"}, "one")
+    main.push_remote(remote, "master")
+    pushed = commit_files({"a.txt": "two\n"}, "two")
+    main.push_remote(remote, "master")
+
+    main.repository().update_ref("refs/heads/master", main.commit_info(repo, pushed).parents[0], pushed)
+    rewritten = commit_files({"a.txt": "rewritten\n"}, "rewritten")
+    assert main.push_remote(remote, "master") is False
+    assert remote_repo(remote).read_ref("refs/heads/master") == pushed
+    assert main.push_remote(remote, "master", force=True) is not False
+    assert remote_repo(remote).read_ref("refs/heads/master") == rewritten
+
+
+def test_pull_fast_forwards_the_checked_out_branch(repo, remote, tmp_path, monkeypatch):
+    commit_files({"a.txt": "a\n"}, "one")
+    main.push_remote(remote, "master")
+
+    monkeypatch.chdir(remote)
+    main.checkout_branch("master")
+    head = commit_files({"a.txt": "from remote\n", "new.txt": "new\n"}, "remote work")
+    monkeypatch.chdir(tmp_path)
+
+    assert main.pull_remote(remote, "master") is not False
+    assert main.get_current_commit() == head
+    assert read("a.txt") == "from remote\n"
+    assert read("new.txt") == "new\n"
+    assert set(main.read_index(repo)) == {"a.txt", "new.txt"}
+
+
+def test_pull_into_another_branch_leaves_the_working_tree(repo, remote):
+    commit_files({"a.txt": "a\n"}, "one")
+    main.push_remote(remote, "master:incoming")
+    assert main.pull_remote(remote, "incoming:copy") is not False
+    assert main.repository().read_ref("refs/heads/copy") == main.get_current_commit()
+
+
+def test_chunked_files_travel_with_their_chunks(repo, remote):
+    main.config("core.chunk_threshold", "1024")
+    with open("big.bin", "wb") as big_file:
+        big_file.write(os.urandom(main.CHUNK_MAX_SIZE + 5000))
+    main.add(["big.bin"])
+    main.commit("big")
+    assert main.push_remote(remote, "master") is not False
+
+    object_hash = main.read_index(repo)["big.bin"].hash
+    remote_path = remote_repo(remote).path
+    with open("big.bin", "rb") as big_file:
+        assert b"".join(main.iter_blob(remote_path, object_hash)) == big_file.read()
+
+
+def test_push_to_checked_out_branch_is_refused(repo, tmp_path, monkeypatch):
+    commit_files({"a.txt": "a\n"}, "one")
+    remote = tmp_path / "busy"
+    remote.mkdir()
+    monkeypatch.chdir(remote)
+    main.init()
+    commit_files({"r.txt": "r\n"}, "remote")
+    remote_head = main.get_current_commit()
+    monkeypatch.chdir(tmp_path)
+
+    assert main.push_remote(str(remote), "master") is False
+    assert remote_repo(str(remote)).read_ref("refs/heads/master") == remote_head
+
+    assert main.push_remote(str(remote), "master:incoming") is not False
+    assert remote_repo(str(remote)).read_ref("refs/heads/incoming") == main.get_current_commit()
+
+
+def test_refspec_names_are_checked(repo, remote):
+    commit_files({"a.txt": "a\n"}, "one")
+    assert main.run_command(["push", remote, "master:-x"]) is False
+    assert main.run_command(["push", remote, "master:a..b"]) is False
@@ -0,0 +1,65 @@
+import os
+
+import main
+from conftest import commit_files
+
+
+def head_files(repo):
+    return main.read_tree(repo, main.commit_tree_hash(repo, main.get_current_commit()))
+
+
+def test_tree_round_trip():
+    entries = {
+        "a.txt": (main.TREE_FILE, "11" * 20),
+        "dir": (main.TREE_DIR, "22" * 20),
+        "ünïcode name.txt": (main.TREE_FILE, "33" * 20),
+    }
+    assert main.decode_tree(main.encode_tree(entries)) == entries
+    assert main.decode_tree(main.encode_tree({})) == {}
+
+
+def test_legacy_flat_tree_still_decodes():
+    content = f"{'aa' * 20} a.txt\n{'bb' * 20} dir/with space.txt\n".encode()
+    assert main.decode_tree(content) == {
+        "a.txt": (main.TREE_FILE, "aa" * 20),
+        "dir/with space.txt": (main.TREE_FILE, "bb" * 20),
+    }
+
+
+def test_nested_tree_round_trip(repo):
+    files = {"a.txt": "11" * 20, "src/b.txt": "22" * 20, "src/lib/c.txt": "33" * 20}
+    trees = {}
+    tree_hash = main.write_tree(repo, files)
+    assert main.read_tree(repo, tree_hash, trees) == files
+    assert set(trees) == {"", "src", "src/lib"}
+    # the same files always give the same tree
+    assert main.write_tree(repo, dict(reversed(list(files.items())))) == tree_hash
+
+
+def test_unchanged_directories_keep_their_trees(repo):
+    commit_files({"src/a.txt": "a\n", "docs/b.txt": "b\n"}, "one")
+    trees = {}
+    main.read_tree(repo, main.commit_tree_hash(repo, main.get_current_commit()), trees)
+
+    commit_files({"src/a.txt": "changed\n"}, "two")
+    after = {}
+    files = main.read_tree(repo, main.commit_tree_hash(repo, main.get_current_commit()), after)
+    assert after["docs"] == trees["docs"]
+    assert after["src"] != trees["src"]
+    assert files["src/a.txt"] == main.write_object(repo, b"changed\n")
+
+
+def test_cached_trees_give_the_same_tree_as_a_full_rebuild(repo):
+    commit_files({"a.txt": "a\n", "src/b.txt": "b\n", "src/lib/c.txt": "c\n"}, "one")
+    commit_files({"src/lib/c.txt": "changed\n"}, "two")
+    files = head_files(repo)
+    assert main.write_tree(repo, files) == main.commit_tree_hash(repo, main.get_current_commit())
+
+
+def test_deleted_file_leaves_its_directory_tree(repo):
+    commit_files({"src/a.txt": "a\n", "src/b.txt": "b\n", "lib/c.txt": "c\n"}, "one")
+    os.remove("src/b.txt")
+    os.remove("lib/c.txt")
+    assert main.commit("two", stage_all=True) is not False
+    assert set(head_files(repo)) == {"src/a.txt"}
+    assert set(main.parse_tree(repo, main.commit_tree_hash(repo, main.get_current_commit()))) == {"src"}